@@ -0,0 +1,193 @@
+"""
+Replays the solution in Publishing/Testing Instructions.txt through lambda_handler
+
+Each turn sends the previous response's sessionAttributes back, as Alexa does, and starts a new
+session after the game stops. Storage is the in-process memory store. For every locale it reports
+the latency of each step and of the whole game, the memory each turn allocates and the size of
+the responses.
+
+Before timing it checks the game still finishes. Storage faults are covered by test_PuzzlePrison.py.
+
+    python BenchmarkGoldenPath.py --repeat 200 --save-baseline golden.json
+    python BenchmarkGoldenPath.py --repeat 200 --baseline golden.json --threshold 0.25
+
+With --baseline the run fails when a step's median is more than threshold slower than the
+saved median, ignoring differences under --noise-floor microseconds.
+"""
+
+from __future__ import print_function
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# Never touch a real table
+os.environ["PUZZLE_PRISON_STORE"] = "memory"
+
+import PuzzlePrison
+import SkillRequests
+
+# --------------- Replay
+
+def play(steps, locale, user_id, on_turn=None):
+    """ Plays the game once, returns each step's response """
+    responses = []
+    attributes = None
+    new = True
+    for step, utterance, action in steps:
+        event = SkillRequests.build_event(action, user_id, locale, attributes, new)
+        if on_turn is None:
+            response = PuzzlePrison.lambda_handler(event, None)
+        else:
+            response = on_turn(event)
+        responses.append(response)
+        if response['response']['shouldEndSession']:
+            attributes = None
+            new = True
+        else:
+            attributes = response['sessionAttributes']
+            new = False
+    return responses
+
+def check(steps, locale):
+    user_id = "amzn1.ask.account.golden." + locale + ".check"
+    responses = play(steps, locale, user_id)
+    # Finishing the game ends the session and starts the player again
+    stored = PuzzlePrison.get_quest_point_store().items[user_id]['questPoint']
+    if not responses[-1]['response']['shouldEndSession'] or stored != 0:
+        raise SystemExit(locale + ": the testing instructions no longer finish the game")
+    return responses
+
+def time_steps(steps, locale, repeat):
+    """ Each step's latencies over repeat games, in seconds """
+    timings = [[] for step in steps]
+    totals = []
+
+    for run in range(repeat):
+        turn = [0]
+
+        def timed(event):
+            start = time.perf_counter()
+            response = PuzzlePrison.lambda_handler(event, None)
+            timings[turn[0]].append(time.perf_counter() - start)
+            turn[0] += 1
+            return response
+
+        start = time.perf_counter()
+        play(steps, locale, "amzn1.ask.account.golden." + locale + "." + str(run), timed)
+        totals.append(time.perf_counter() - start)
+    return timings, totals
+
+def measure_allocations(steps, locale):
+    """ Peak bytes allocated during each turn and bytes still held after it """
+    allocations = []
+
+    def traced(event):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        response = PuzzlePrison.lambda_handler(event, None)
+        current, peak = tracemalloc.get_traced_memory()
+        allocations.append({"peakBytes": peak - before, "retainedBytes": current - before})
+        return response
+
+    tracemalloc.start()
+    try:
+        play(steps, locale, "amzn1.ask.account.golden." + locale + ".allocations", traced)
+    finally:
+        tracemalloc.stop()
+    return allocations
+
+# --------------- Report
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+def microseconds(seconds):
+    return round(seconds * 1e6, 1)
+
+def locale_report(steps, locale, repeat):
+    responses = check(steps, locale)
+    timings, totals = time_steps(steps, locale, repeat)
+    allocations = measure_allocations(steps, locale)
+
+    report_steps = []
+    for index, (step, utterance, action) in enumerate(steps):
+        size = len(json.dumps(responses[index]))
+        report_steps.append({
+            "step": step,
+            "utterance": utterance,
+            "medianUs": microseconds(median(timings[index])),
+            "minUs": microseconds(min(timings[index])),
+            "responseBytes": size,
+            "peakBytes": allocations[index]["peakBytes"],
+            "retainedBytes": allocations[index]["retainedBytes"],
+        })
+    return {
+        "steps": report_steps,
+        "gameMedianUs": microseconds(median(totals)),
+        "responseBytes": sum([entry["responseBytes"] for entry in report_steps]),
+        "peakBytes": max([entry["peakBytes"] for entry in report_steps]),
+    }
+
+def regressions(report, baseline, threshold, noise_floor):
+    """ Steps slower than the baseline by more than threshold and noise_floor microseconds """
+    found = []
+    for locale, results in report.items():
+        saved = dict((entry["step"], entry) for entry in baseline.get(locale, {}).get("steps", []))
+        for entry in results["steps"]:
+            before = saved.get(entry["step"])
+            if before is None:
+                continue
+            slower = entry["medianUs"] - before["medianUs"]
+            if slower > noise_floor and entry["medianUs"] > before["medianUs"] * (1 + threshold):
+                found.append("%s step %d (%s): %.1f us, baseline %.1f us" %
+                             (locale, entry["step"], entry["utterance"], entry["medianUs"], before["medianUs"]))
+    return found
+
+def run(args):
+    steps = SkillRequests.testing_instructions()
+    report = {}
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        for locale in args.locales:
+            report[locale] = locale_report(steps, locale, args.repeat)
+    return report
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Replay the golden path through lambda_handler")
+    parser.add_argument("--repeat", type=int, default=200, help="games played per locale")
+    parser.add_argument("--locales", nargs="+", default=list(PuzzlePrison.SUPPORTED_LOCALES),
+                        choices=PuzzlePrison.SUPPORTED_LOCALES)
+    parser.add_argument("--baseline", default=None, help="saved report to compare against")
+    parser.add_argument("--save-baseline", default=None, help="write this run's report here")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown of a step, 0.25 is 25%%")
+    parser.add_argument("--noise-floor", type=float, default=10.0, help="slowdowns under this many us are ignored")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    report = run(args)
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        found = regressions(report, baseline, args.threshold, args.noise_floor)
+        if found:
+            print("Regressed against " + args.baseline + ":", file=sys.stderr)
+            for line in found:
+                print("    " + line, file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Cold start import cost of PuzzlePrison, from python -X importtime
+
+Imports the module in fresh interpreters and reports the median cumulative import time, the
+modules that cost the most and whether boto3 came in with it. Also times the boto3 import the
+first storage call pays for.
+
+    python BenchmarkImportTime.py --runs 15 --save-baseline importtime.json
+    python BenchmarkImportTime.py --runs 15 --baseline importtime.json --threshold 0.2
+
+With --baseline the run fails when the median import time is more than threshold slower than
+the saved one, so each release can be checked against the last.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+CODE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# import time:       self [us] |    cumulative | imported package
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+FIRST_STORAGE_CALL = (
+    "import time, PuzzlePrison\n"
+    "start = time.perf_counter()\n"
+    "PuzzlePrison.import_boto3()\n"
+    "print(int((time.perf_counter() - start) * 1e6))\n"
+)
+
+def parse_import_times(output):
+    """ {module: (self us, cumulative us)} from -X importtime output """
+    modules = {}
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return modules
+
+def python(arguments):
+    # -E keeps PYTHONSTARTUP and friends out of the measurement
+    return subprocess.run([sys.executable, "-E"] + arguments, cwd=CODE_DIRECTORY, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+def import_once():
+    return parse_import_times(python(["-X", "importtime", "-c", "import PuzzlePrison"]).stderr)
+
+def first_storage_call_us():
+    return int(python(["-c", FIRST_STORAGE_CALL]).stdout.strip())
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+def run(args):
+    imports = [import_once() for run in range(args.runs)]
+    totals = [modules["PuzzlePrison"][1] for modules in imports]
+
+    # Most expensive modules by their own import time, as median over the runs
+    self_times = {}
+    for modules in imports:
+        for module, (self_us, cumulative_us) in modules.items():
+            self_times.setdefault(module, []).append(self_us)
+    slowest = sorted([(median(times), module) for module, times in self_times.items()], reverse=True)[:args.top]
+
+    storage = [first_storage_call_us() for run in range(args.runs)] if args.storage else []
+    last = imports[-1]
+    return {
+        "runs": args.runs,
+        "python": sys.version.split()[0],
+        "importMedianUs": median(totals),
+        "importMinUs": min(totals),
+        "modulesImported": len(last),
+        "boto3Imported": "boto3" in last or "botocore" in last,
+        "slowestModules": [{"module": module, "selfUs": self_us} for self_us, module in slowest],
+        "firstStorageCallImportMedianUs": median(storage) if storage else None,
+    }
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Measure the cold start import time of PuzzlePrison")
+    parser.add_argument("--runs", type=int, default=15, help="fresh interpreters to import in")
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to list")
+    parser.add_argument("--no-storage", dest="storage", action="store_false",
+                        help="skip timing the boto3 import of the first storage call")
+    parser.add_argument("--baseline", default=None, help="saved report to compare against")
+    parser.add_argument("--save-baseline", default=None, help="write this run's report here")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 is 20%%")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    report = run(args)
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if report["importMedianUs"] > baseline["importMedianUs"] * (1 + args.threshold):
+            print("Import time regressed: %d us, baseline %d us" % (report["importMedianUs"], baseline["importMedianUs"]),
+                  file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Overhead of the embedded metric format records lambda_handler writes
+
+Replays the solution in Publishing/Testing Instructions.txt with the metrics on and off, in
+alternating rounds so both see the same warm caches, and reports what the metrics add to each
+request. The records of one game are also checked against the embedded metric format.
+
+    python BenchmarkMetrics.py --rounds 20 --games 20 --budget 75
+
+The run fails when the median overhead per request is more than --budget percent of the median
+request with the metrics off. The overhead measured on the golden path is about half of it.
+"""
+
+from __future__ import print_function
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+# Never touch a real table
+os.environ["PUZZLE_PRISON_STORE"] = "memory"
+
+import PuzzlePrison
+import SkillRequests
+from BenchmarkGoldenPath import median, microseconds, play
+
+# --------------- Records
+
+def check_records(lines):
+    """ Problems with the records, which must each carry every metric and dimension they declare """
+    problems = []
+    for number, line in enumerate(lines):
+        record = json.loads(line)
+        directives = record.get('_aws', {}).get('CloudWatchMetrics', [])
+        if not isinstance(record.get('_aws', {}).get('Timestamp'), int) or not directives:
+            problems.append("record %d has no _aws metadata" % number)
+            continue
+        for directive in directives:
+            names = [metric['Name'] for metric in directive['Metrics']]
+            names += [name for dimensions in directive['Dimensions'] for name in dimensions]
+            for name in names:
+                if name not in record:
+                    problems.append("record %d is missing %s" % (number, name))
+    return problems
+
+def record_game(steps, locale):
+    sink = io.StringIO()
+    PuzzlePrison.metrics_sink = sink
+    PuzzlePrison.METRICS_ENABLED = True
+    play(steps, locale, "amzn1.ask.account.metrics." + locale + ".records")
+    lines = sink.getvalue().splitlines()
+    if len(lines) != len(steps):
+        raise SystemExit(locale + ": %d records for %d requests" % (len(lines), len(steps)))
+    return lines
+
+# --------------- Timing
+
+def time_games(steps, locale, enabled, games, round_number):
+    PuzzlePrison.METRICS_ENABLED = enabled
+    start = time.perf_counter()
+    for game in range(games):
+        play(steps, locale, "amzn1.ask.account.metrics." + locale + "." + str(round_number) + "." + str(game))
+    return (time.perf_counter() - start) / (games * len(steps))
+
+def locale_report(steps, locale, rounds, games):
+    lines = record_game(steps, locale)
+    problems = check_records(lines)
+
+    enabled = []
+    disabled = []
+    with open(os.devnull, "w") as sink:
+        PuzzlePrison.metrics_sink = sink
+        for round_number in range(rounds):
+            # Alternate which goes first so neither always runs on a cooler cache
+            order = (True, False) if round_number % 2 == 0 else (False, True)
+            for on in order:
+                per_request = time_games(steps, locale, on, games, round_number)
+                (enabled if on else disabled).append(per_request)
+    PuzzlePrison.metrics_sink = None
+    PuzzlePrison.METRICS_ENABLED = True
+
+    overhead = median(enabled) - median(disabled)
+    return {
+        "requestEnabledUs": microseconds(median(enabled)),
+        "requestDisabledUs": microseconds(median(disabled)),
+        "overheadUs": microseconds(overhead),
+        "overheadPercent": round(100.0 * overhead / median(disabled), 1),
+        "recordBytes": max([len(line) + 1 for line in lines]),
+        "recordProblems": problems,
+    }
+
+def run(args):
+    steps = SkillRequests.testing_instructions()
+    report = {}
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        for locale in args.locales:
+            report[locale] = locale_report(steps, locale, args.rounds, args.games)
+    return report
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Measure what the metrics records add to each request")
+    parser.add_argument("--rounds", type=int, default=20, help="alternating on and off rounds per locale")
+    parser.add_argument("--games", type=int, default=20, help="games played per round")
+    parser.add_argument("--budget", type=float, default=75.0,
+                        help="allowed overhead per request, percent of the request without metrics")
+    parser.add_argument("--locales", nargs="+", default=list(PuzzlePrison.SUPPORTED_LOCALES),
+                        choices=PuzzlePrison.SUPPORTED_LOCALES)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    report = run(args)
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+    failed = False
+    for locale, results in sorted(report.items()):
+        for problem in results["recordProblems"]:
+            print(locale + ": " + problem, file=sys.stderr)
+            failed = True
+        if results["overheadPercent"] > args.budget:
+            print("%s: metrics add %.1f us (%.1f%%) per request, budget %.1f%% of %.1f us" %
+                  (locale, results["overheadUs"], results["overheadPercent"], args.budget,
+                   results["requestDisabledUs"]), file=sys.stderr)
+            failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
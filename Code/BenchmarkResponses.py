@@ -0,0 +1,103 @@
+"""
+Micro-benchmark of build_response against the original &at replacement loop
+
+Builds a response for every text in every supported locale with both implementations,
+checks they produce the same response, then times each over all the texts.
+
+    python BenchmarkResponses.py --repeat 200
+"""
+
+from __future__ import print_function
+import argparse
+import sys
+import timeit
+
+import PuzzlePrison
+
+AUDIO = (
+    "https://s3.amazonaws.com/us.puzzleprison.resources/MovingWall.mp3",
+    "https://s3.amazonaws.com/us.puzzleprison.resources/LetterBox.mp3",
+    "https://s3.amazonaws.com/us.puzzleprison.resources/FinishJingle.mp3",
+)
+
+# --------------- Original implementation
+
+def legacy_build_speech_response(title, output_speech, output_card, reprompt_text, should_end_session):
+    return {
+        'outputSpeech': {
+            'type': 'SSML',
+            'ssml': '<speak>' + output_speech + '</speak>'
+        },
+        'card': {
+            'type': 'Simple',
+            'title': title,
+            'content': output_card
+        },
+        'reprompt': {
+            'outputSpeech': {
+                'type': 'PlainText',
+                'text': reprompt_text
+            }
+        },
+        'shouldEndSession': should_end_session
+    }
+
+def legacy_build_response(session_attributes, text, should_end_session = False):
+    output_speech = text[1]
+    output_card = text[1]
+    if len(text) > 3:
+        clip_index = 0
+        while (clip_index < len(text) - 3):
+            output_speech = output_speech.replace("&at", PuzzlePrison.create_audio_tag(text[3 + clip_index]), 1)
+            output_card = output_card.replace("&at", "", 1)
+            clip_index += 1
+
+    return {
+        'version': '1.0',
+        'sessionAttributes': session_attributes,
+        'response': legacy_build_speech_response(text[0], output_speech, output_card, text[2], should_end_session)
+    }
+
+# --------------- Benchmark
+
+def response_texts():
+    """ Every text with as many clips as it has markers, as the handlers call build_response """
+    texts = []
+    for text in PuzzlePrison.all_texts():
+        texts.append(["Title", text, "Reprompt"] + list(AUDIO[:text.count("&at")]))
+    return texts
+
+def check(texts):
+    for text in texts:
+        # Also cover fewer and more clips than markers
+        for clips in range(0, len(AUDIO) + 1):
+            variant = text[:3] + list(AUDIO[:clips])
+            assert PuzzlePrison.build_response({}, variant) == legacy_build_response({}, variant), variant[1]
+
+def run_all(build, texts):
+    for text in texts:
+        build({}, text)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare build_response with the original implementation")
+    parser.add_argument("--repeat", type=int, default=200, help="passes over all the texts")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    texts = response_texts()
+    check(texts)
+
+    report("all texts", texts, args.repeat)
+    report("texts with audio", [text for text in texts if len(text) > 3], args.repeat)
+
+def report(label, texts, repeat):
+    legacy = min(timeit.repeat(lambda: run_all(legacy_build_response, texts), number=repeat, repeat=3))
+    current = min(timeit.repeat(lambda: run_all(PuzzlePrison.build_response, texts), number=repeat, repeat=3))
+    calls = float(len(texts) * repeat)
+
+    print(label + " (" + str(len(texts)) + ")")
+    print("    legacy:      %.3f us per response" % (legacy / calls * 1e6))
+    print("    precompiled: %.3f us per response" % (current / calls * 1e6))
+    print("    speed up:    %.2fx" % (legacy / current))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Breadth-first explorer and solver for the Puzzle Prison game graph
+
+A state is the quest point, context, lap progress, the four terminal flags and whether a game
+is in progress. Every state is expanded by sending every intent with every slot value through
+lambda_handler, with the in-process storage stand-in, across a process pool.
+
+The report lists handler lines no transition ran, states the game cannot be finished from,
+transitions that end in error_response, and the shortest solution, checked against the
+solution in Publishing/Testing Instructions.txt.
+
+    python ExploreStates.py --workers 4 --locale en-GB
+"""
+
+from __future__ import print_function
+import argparse
+import contextlib
+import dis
+import inspect
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Never touch a real table
+os.environ["PUZZLE_PRISON_STORE"] = "memory"
+os.environ["PUZZLE_PRISON_WRITE_BEHIND"] = "0"
+
+import PuzzlePrison
+import SkillRequests
+
+USER_ID = "amzn1.ask.account.explorer"
+
+# Handlers whose lines are traced
+HANDLER_PREFIX = "on_intent"
+
+# Outcomes of a transition
+OK = "ok"
+MISUNDERSTOOD = "misunderstood"
+ERROR = "error"
+FINISHED = "finished"
+
+# (quest point, context, lap, NE, NW, SE, SW, is playing)
+START_STATE = (0, "", 0, False, False, False, False, False)
+
+locale = PuzzlePrison.DEFAULT_LOCALE
+transition_memo = {}
+covered_lines = set()
+
+# --------------- States
+
+def stopped_state(qp):
+    return (qp, "", 0, False, False, False, False, False)
+
+def session_attributes(state):
+    qp, context, lap, ne, nw, se, sw, is_playing = state
+    if not is_playing:
+        return None
+    return PuzzlePrison.encode_session_state(PuzzlePrison.SessionState(qp, lap, ne, nw, se, sw, context, True, None))
+
+def response_state(attributes):
+    state = PuzzlePrison.decode_session_state(attributes)
+    return (state.quest_point, state.context, state.lap, state.ne, state.nw, state.se, state.sw, bool(state.is_playing))
+
+def state_label(state):
+    qp, context, lap, ne, nw, se, sw, is_playing = state
+    if not is_playing:
+        return "stopped at quest point " + str(qp)
+    label = "quest point " + str(qp) + " at " + repr(context)
+    if qp == 4:
+        label += " lap " + repr(PuzzlePrison.LAP_PROGRESS[lap])
+    if qp == 6:
+        label += " terminals " + "".join(["1" if flag else "0" for flag in (ne, nw, se, sw)])
+    return label
+
+def action_label(action):
+    request_type, intent_name, slot_name, slot_value = action
+    if request_type != "IntentRequest":
+        return request_type
+    if slot_name is None:
+        return intent_name
+    return intent_name + " " + slot_name + "=" + repr(slot_value)
+
+def state_actions(state):
+    if state[7]:
+        return SkillRequests.all_actions()
+    # A new session, opened by launching the skill or asking it something straight away
+    return [SkillRequests.LAUNCH] + SkillRequests.all_actions()
+
+# --------------- Transitions
+
+def trace_handlers(frame, event, arg):
+    if frame.f_code.co_filename != PuzzlePrison.__file__ or not frame.f_code.co_name.startswith(HANDLER_PREFIX):
+        return None
+    return trace_lines
+
+def trace_lines(frame, event, arg):
+    if event == "line":
+        covered_lines.add((frame.f_code.co_name, frame.f_lineno))
+    return trace_lines
+
+def transition(state, action):
+    """ Sends action in state through lambda_handler, returns (next state, outcome) """
+    key = (state, action)
+    result = transition_memo.get(key)
+    if result is not None:
+        return result
+
+    store = PuzzlePrison.get_quest_point_store()
+    store.write_items([{'userID': USER_ID, 'questPoint': state[0], 'lastUpdate': PuzzlePrison.today()}])
+    PuzzlePrison.quest_point_cache.discard(USER_ID)
+    attributes = session_attributes(state)
+    event = SkillRequests.build_event(action, USER_ID, locale, attributes, new=attributes is None)
+
+    sys.settrace(trace_handlers)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = PuzzlePrison.lambda_handler(event, None)
+    finally:
+        sys.settrace(None)
+
+    stored = store.items[USER_ID]['questPoint']
+    body = response['response']
+    if body == PuzzlePrison.error_response()['response']:
+        outcome = ERROR
+    elif body['card']['title'] == PuzzlePrison.get_text("title_misunderstand"):
+        outcome = MISUNDERSTOOD
+    elif body['shouldEndSession'] and state[0] == 9 and stored == 0:
+        outcome = FINISHED
+    else:
+        outcome = OK
+
+    if body['shouldEndSession']:
+        next_state = stopped_state(stored)
+    else:
+        next_state = response_state(response['sessionAttributes'])
+    result = transition_memo[key] = (next_state, outcome)
+    return result
+
+def start_worker(worker_locale):
+    global locale
+    locale = worker_locale
+    PuzzlePrison.locale = worker_locale
+
+def expand(state):
+    """ Every transition out of state, with the handler lines they ran """
+    covered_lines.clear()
+    transitions = []
+    for action in state_actions(state):
+        next_state, outcome = transition(state, action)
+        transitions.append((action, next_state, outcome))
+    return state, transitions, set(covered_lines)
+
+# --------------- Search
+
+def explore(workers, explore_locale):
+    """ Breadth first from a new player, one pool task per state of each level """
+    graph = {}
+    parents = {START_STATE: None}
+    lines = set()
+    frontier = [START_STATE]
+    with ProcessPoolExecutor(max_workers=workers, initializer=start_worker, initargs=(explore_locale,)) as pool:
+        while frontier:
+            next_frontier = []
+            chunk_size = max(1, len(frontier) // (workers * 4))
+            for state, transitions, state_lines in pool.map(expand, frontier, chunksize=chunk_size):
+                graph[state] = transitions
+                lines |= state_lines
+                for action, next_state, outcome in transitions:
+                    if next_state not in parents:
+                        parents[next_state] = (state, action)
+                        next_frontier.append(next_state)
+            frontier = next_frontier
+    return graph, parents, lines
+
+def shortest_solution(graph):
+    """ The fewest actions from a new player to the end of the game """
+    queue = deque([START_STATE])
+    parents = {START_STATE: None}
+    while queue:
+        state = queue.popleft()
+        for action, next_state, outcome in graph[state]:
+            if outcome == FINISHED:
+                path = [(state, action)]
+                while parents[state] is not None:
+                    state, previous_action = parents[state]
+                    path.append((state, previous_action))
+                path.reverse()
+                return path
+            if next_state not in parents:
+                parents[next_state] = (state, action)
+                queue.append(next_state)
+    return None
+
+def dead_ends(graph):
+    """ Reachable states the game cannot be finished from """
+    incoming = {}
+    can_finish = set()
+    for state, transitions in graph.items():
+        for action, next_state, outcome in transitions:
+            incoming.setdefault(next_state, set()).add(state)
+            if outcome == FINISHED:
+                can_finish.add(state)
+    queue = deque(can_finish)
+    while queue:
+        state = queue.popleft()
+        for previous in incoming.get(state, ()):
+            if previous not in can_finish:
+                can_finish.add(previous)
+                queue.append(previous)
+    return sorted([state for state in graph if state not in can_finish], key=repr)
+
+def handler_lines():
+    """ Every line of every handler that can run, as (function, line) """
+    lines = set()
+    for name, function in inspect.getmembers(PuzzlePrison, inspect.isfunction):
+        if name.startswith(HANDLER_PREFIX) and function.__module__ == PuzzlePrison.__name__:
+            code = function.__code__
+            for offset, line in dis.findlinestarts(code):
+                if line is not None and line != code.co_firstlineno:
+                    lines.add((name, line))
+    return lines
+
+def unreachable_branches(lines):
+    source = inspect.getsourcelines(PuzzlePrison)[0]
+    unreachable = {}
+    for name, line in sorted(handler_lines() - lines):
+        unreachable.setdefault(name, []).append(str(line) + ": " + source[line - 1].strip())
+    return unreachable
+
+def replay_instructions(explore_locale):
+    """ Follows the testing instructions from a new player, returns the steps and whether they finish the game """
+    start_worker(explore_locale)
+    state = START_STATE
+    steps = SkillRequests.testing_instructions()
+    finished = False
+    for step, utterance, action in steps:
+        state, outcome = transition(state, action)
+        finished = outcome == FINISHED
+    return steps, finished
+
+# --------------- Report
+
+def run(args):
+    start = time.time()
+    graph, parents, lines = explore(args.workers, args.locale)
+    elapsed = time.time() - start
+
+    errors = []
+    outcomes = {}
+    for state, transitions in sorted(graph.items(), key=lambda entry: repr(entry[0])):
+        for action, next_state, outcome in transitions:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if outcome == ERROR:
+                errors.append(state_label(state) + ": " + action_label(action))
+
+    solution = shortest_solution(graph)
+    steps, instructions_finish = replay_instructions(args.locale)
+    solution_steps = len(solution) - 1 if solution else None
+    instruction_steps = steps[-1][0] if steps else None
+
+    return {
+        "locale": args.locale,
+        "states": len(graph),
+        "transitions": sum([len(transitions) for transitions in graph.values()]),
+        "outcomes": outcomes,
+        "seconds": round(elapsed, 3),
+        "unreachableBranches": unreachable_branches(lines),
+        "deadEnds": [state_label(state) for state in dead_ends(graph)],
+        "errorTransitions": errors,
+        "shortestSolution": [state_label(state) + ": " + action_label(action) for state, action in solution or []],
+        "shortestSolutionSteps": solution_steps,
+        "instructionSteps": instruction_steps,
+        "instructionsFinishGame": instructions_finish,
+        "matchesInstructions": instructions_finish and solution_steps == instruction_steps,
+    }
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Explore every reachable Puzzle Prison state")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="explorer processes")
+    parser.add_argument("--locale", default=PuzzlePrison.DEFAULT_LOCALE, choices=PuzzlePrison.SUPPORTED_LOCALES)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    report = run(args)
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if not report["matchesInstructions"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+Synthetic player load generator for capacity planning
+
+Runs simulated players through lambda_handler across a process pool. The handler keeps its
+request state in module globals, so each process plays its players one at a time, the way a
+warm Lambda container serves requests. Storage is the in-process memory store with an injected
+latency on every call.
+
+Players are a mix of:
+    solvers    play the solution in Publishing/Testing Instructions.txt
+    wanderers  send random intents and slot values, mostly answered with misunderstand_response
+    quitters   play the solution but stop or walk away after some letters and come back later
+
+Reports throughput, p50/p95/p99 latency per intent, storage calls per session and the
+storage latency histograms of the store, the quest point and response cache counters and
+how object slots were resolved.
+
+    python LoadTest.py --players 5000 --workers 8 --storage-latency 8 --storage-jitter 4
+"""
+
+from __future__ import print_function
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Never touch a real table
+os.environ["PUZZLE_PRISON_STORE"] = "memory"
+
+import PuzzlePrison
+import SkillRequests
+
+PLAYER_KINDS = ("solver", "wanderer", "quitter")
+
+# Things wanderers say that the skill does not know
+MISHEARD_ACTIONS = (
+    SkillRequests.intent_action("WalkIntent", "object", "door"),
+    SkillRequests.intent_action("WalkIntent", "object", "window"),
+    SkillRequests.intent_action("InteractWithIntent", "object", "ceiling"),
+    SkillRequests.intent_action("InteractWithIntent", "object", "floor"),
+    SkillRequests.intent_action("OptionIntent", "option", "3"),
+    SkillRequests.intent_action("ReadIntent"),
+)
+
+# --------------- Storage
+
+class LatentMemoryStore(PuzzlePrison.MemoryQuestPointStore):
+    """ Memory store that waits like a network round trip and counts its calls """
+
+    def __init__(self, latency, jitter, rng):
+        PuzzlePrison.MemoryQuestPointStore.__init__(self)
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = rng
+        self.calls = 0
+
+    def wait(self):
+        self.calls += 1
+        delay = self.latency + self.rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def save_item(self, user_id, qp, touch):
+        self.wait()
+        return PuzzlePrison.MemoryQuestPointStore.save_item(self, user_id, qp, touch)
+
+    def load_item(self, user_id):
+        self.wait()
+        return PuzzlePrison.MemoryQuestPointStore.load_item(self, user_id)
+
+class LambdaContext(object):
+    """ The part of the Lambda context the handler reads """
+
+    def __init__(self, timeout):
+        self.deadline = time.time() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.time()) * 1000)
+
+# --------------- Players
+
+class Player(object):
+    def __init__(self, kind, user_id, locale, rng, options):
+        self.kind = kind
+        self.user_id = user_id
+        self.locale = locale
+        self.rng = rng
+        self.options = options
+        self.store = PuzzlePrison.get_quest_point_store()
+        self.attributes = None
+        self.new = True
+        self.session_calls = self.store.calls
+        self.latencies = {}
+        self.storage_calls = []
+        self.outcomes = {}
+
+    def send(self, action):
+        event = SkillRequests.build_event(action, self.user_id, self.locale, self.attributes, self.new)
+        context = LambdaContext(self.options.timeout) if self.options.timeout else None
+        start = time.perf_counter()
+        response = PuzzlePrison.lambda_handler(event, context)
+        elapsed = time.perf_counter() - start
+
+        label = action[1] or action[0]
+        self.latencies.setdefault(label, []).append(elapsed)
+        self.count_outcome(response)
+        if response is None or response['response']['shouldEndSession']:
+            self.end_session()
+        else:
+            self.attributes = response['sessionAttributes']
+            self.new = False
+
+    def count_outcome(self, response):
+        if response is None:
+            outcome = "noResponse"
+        elif response['response']['card']['title'] == PuzzlePrison.get_text("title_misunderstand"):
+            outcome = "misunderstood"
+        elif response['response']['card']['title'] == PuzzlePrison.get_text("title_error"):
+            outcome = "error"
+        else:
+            outcome = "ok"
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def end_session(self):
+        self.storage_calls.append(self.store.calls - self.session_calls)
+        self.session_calls = self.store.calls
+        self.attributes = None
+        self.new = True
+
+    def leave(self):
+        """ Walks away mid session, Alexa then sends SessionEndedRequest """
+        if not self.new:
+            self.send(SkillRequests.SESSION_ENDED)
+
+    def play(self, steps, actions):
+        if self.kind == "wanderer":
+            self.send(SkillRequests.LAUNCH)
+            for turn in range(self.rng.randint(3, self.options.wander_turns)):
+                if self.rng.random() < self.options.mishear_rate:
+                    self.send(self.rng.choice(MISHEARD_ACTIONS))
+                else:
+                    self.send(self.rng.choice(actions))
+            if self.rng.random() < 0.5:
+                self.send(SkillRequests.intent_action("AMAZON.StopIntent"))
+            else:
+                self.leave()
+            return
+
+        for step, utterance, action in steps:
+            if action == SkillRequests.LAUNCH and not self.new:
+                continue
+            if action != SkillRequests.LAUNCH and self.new:
+                self.send(SkillRequests.LAUNCH)
+            self.send(action)
+            # Quitters come back after a letter, the game saves at each one
+            if self.kind == "quitter" and action[1] == "ReadIntent" and self.rng.random() < self.options.quit_rate:
+                if self.rng.random() < 0.5:
+                    self.send(SkillRequests.intent_action("AMAZON.StopIntent"))
+                else:
+                    self.leave()
+        if not self.new:
+            self.leave()
+
+# --------------- Workers
+
+def start_worker(options):
+    rng = random.Random(options.seed + os.getpid())
+    store = LatentMemoryStore(options.storage_latency / 1000.0, options.storage_jitter / 1000.0, rng)
+    PuzzlePrison.database_stores[PuzzlePrison.get_storage_region()] = store
+
+def run_players(batch):
+    """ Plays a batch of players in this process, returns their merged results """
+    first, count, options = batch
+    rng = random.Random(options.seed * 1000003 + first)
+    steps = SkillRequests.testing_instructions()
+    actions = SkillRequests.all_actions()
+    weights = (options.solvers, options.wanderers, options.quitters)
+
+    latencies = {}
+    storage_calls = []
+    outcomes = {}
+    kinds = {}
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        for index in range(first, first + count):
+            kind = rng.choices(PLAYER_KINDS, weights)[0]
+            locale = rng.choice(options.locales)
+            player = Player(kind, "amzn1.ask.account.load." + str(options.seed) + "." + str(index), locale, rng, options)
+            player.play(steps, actions)
+
+            kinds[kind] = kinds.get(kind, 0) + 1
+            for label, samples in player.latencies.items():
+                latencies.setdefault(label, []).extend(samples)
+            storage_calls.extend(player.storage_calls)
+            for outcome, total in player.outcomes.items():
+                outcomes[outcome] = outcomes.get(outcome, 0) + total
+    # Everything so far in this process, a later batch on the same process replaces it
+    process = {
+        "storageLatency": PuzzlePrison.storage_latency_report(),
+        "questPointCache": PuzzlePrison.quest_point_cache.stats(),
+        "responseCache": PuzzlePrison.response_cache.stats(),
+        "objectSlots": PuzzlePrison.object_slot_report(),
+    }
+    return latencies, storage_calls, outcomes, kinds, os.getpid(), process
+
+# --------------- Report
+
+def percentile(ordered, fraction):
+    """ Nearest rank percentile of a sorted list """
+    if not ordered:
+        return None
+    rank = max(1, int(round(fraction * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def milliseconds(seconds):
+    return round(seconds * 1000.0, 3)
+
+def add_counters(reports):
+    """ Adds up the counters of every process """
+    totals = {}
+    for report in reports:
+        for name, count in report.items():
+            totals[name] = totals.get(name, 0) + count
+    return totals
+
+def merge_latency_reports(reports):
+    """ Adds up the latency histograms of every process per backend and operation """
+    merged = {}
+    for report in reports:
+        operations = merged.setdefault(report["backend"], {})
+        for operation, summary in report["operations"].items():
+            total = operations.setdefault(operation, {"count": 0, "totalMs": 0.0, "maxMs": 0.0, "buckets": {}})
+            total["count"] += summary["count"]
+            total["totalMs"] += summary["meanMs"] * summary["count"]
+            total["maxMs"] = max(total["maxMs"], summary["maxMs"])
+            for bucket, count in summary["buckets"].items():
+                total["buckets"][bucket] = total["buckets"].get(bucket, 0) + count
+    for operations in merged.values():
+        for total in operations.values():
+            total_ms = total.pop("totalMs")
+            total["meanMs"] = round(total_ms / total["count"], 3) if total["count"] else 0.0
+            total["maxMs"] = round(total["maxMs"], 3)
+    return merged
+
+def run(options):
+    batches = []
+    for first in range(0, options.players, options.batch):
+        batches.append((first, min(options.batch, options.players - first), options))
+
+    latencies = {}
+    storage_calls = []
+    outcomes = {}
+    kinds = {}
+    processes = {}
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=options.workers, initializer=start_worker, initargs=(options,)) as pool:
+        for batch_latencies, batch_calls, batch_outcomes, batch_kinds, pid, process in pool.map(run_players, batches):
+            for label, samples in batch_latencies.items():
+                latencies.setdefault(label, []).extend(samples)
+            storage_calls.extend(batch_calls)
+            for outcome, total in batch_outcomes.items():
+                outcomes[outcome] = outcomes.get(outcome, 0) + total
+            for kind, total in batch_kinds.items():
+                kinds[kind] = kinds.get(kind, 0) + total
+            processes[pid] = process
+    elapsed = time.time() - start
+
+    requests = sum([len(samples) for samples in latencies.values()])
+    intents = {}
+    for label, samples in sorted(latencies.items()):
+        ordered = sorted(samples)
+        intents[label] = {
+            "requests": len(ordered),
+            "p50Ms": milliseconds(percentile(ordered, 0.50)),
+            "p95Ms": milliseconds(percentile(ordered, 0.95)),
+            "p99Ms": milliseconds(percentile(ordered, 0.99)),
+        }
+    everything = sorted([sample for samples in latencies.values() for sample in samples])
+    calls = sorted(storage_calls)
+
+    return {
+        "players": kinds,
+        "workers": options.workers,
+        "storageLatencyMs": options.storage_latency,
+        "storageJitterMs": options.storage_jitter,
+        "writeBehind": PuzzlePrison.WRITE_BEHIND,
+        "seconds": round(elapsed, 3),
+        "requests": requests,
+        "requestsPerSecond": round(requests / elapsed, 1) if elapsed > 0 else None,
+        "latency": {
+            "p50Ms": milliseconds(percentile(everything, 0.50)),
+            "p95Ms": milliseconds(percentile(everything, 0.95)),
+            "p99Ms": milliseconds(percentile(everything, 0.99)),
+        },
+        "intents": intents,
+        "outcomes": outcomes,
+        "sessions": len(calls),
+        "storageCallsPerSession": {
+            "mean": round(sum(calls) / float(len(calls)), 3) if calls else None,
+            "p50": percentile(calls, 0.50),
+            "p95": percentile(calls, 0.95),
+            "max": calls[-1] if calls else None,
+        },
+        "storageLatency": merge_latency_reports([report for process in processes.values()
+                                                 for report in process["storageLatency"]]),
+        "questPointCache": add_counters([process["questPointCache"] for process in processes.values()]),
+        "responseCache": add_counters([process["responseCache"] for process in processes.values()]),
+        "objectSlots": add_counters([process["objectSlots"] for process in processes.values()]),
+    }
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run synthetic players through lambda_handler")
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="player processes")
+    parser.add_argument("--batch", type=int, default=50, help="players handed to a process at a time")
+    parser.add_argument("--solvers", type=float, default=0.4, help="share of players who solve the game")
+    parser.add_argument("--wanderers", type=float, default=0.3, help="share of players sending random intents")
+    parser.add_argument("--quitters", type=float, default=0.3, help="share of players who stop and resume")
+    parser.add_argument("--quit-rate", type=float, default=0.5, help="chance a quitter stops after each letter")
+    parser.add_argument("--wander-turns", type=int, default=20, help="most turns a wanderer takes")
+    parser.add_argument("--mishear-rate", type=float, default=0.5, help="chance a wanderer says something unknown")
+    parser.add_argument("--storage-latency", type=float, default=5.0, help="ms added to every storage call")
+    parser.add_argument("--storage-jitter", type=float, default=2.0, help="ms of uniform jitter on that latency")
+    parser.add_argument("--timeout", type=float, default=8.0, help="seconds each request may take, 0 for no deadline")
+    parser.add_argument("--locales", nargs="+", default=list(PuzzlePrison.SUPPORTED_LOCALES),
+                        choices=PuzzlePrison.SUPPORTED_LOCALES)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    print(json.dumps(run(options), indent=2, sort_keys=True))
+
+if __name__ == "__main__":
+    main()
@@ -3,70 +3,102 @@ Puzzle Prison Game for Amazon Alexa by Benjamin Dring
 """
 
 from __future__ import print_function
+import io
+import json
+import os
+import random
+import sys
+import threading
 import time
-import boto3
-from boto3.dynamodb.conditions import Key, Attr
-from botocore.exceptions import ClientError
+import zlib
+from collections import OrderedDict, namedtuple
 
 # --------------- Locale
 
-def locale_gb():
-    return locale == "en-GB"
+SUPPORTED_LOCALES = ("en-GB", "en-US", "de-DE")
 
-def locale_us():
-    return locale == "en-US"
-
-def locale_de():
-    return locale == "de-DE"
+# Set from each request in lambda_handler
+locale = None
 
 # --------------- Audio
 
 def create_audio_tag(file_name):
     return '<audio src="' + file_name + '"/>'
 
-def audio_letter_box():
-    if (locale_gb()):
-        return "https://s3-eu-west-1.amazonaws.com/eu.puzzleprison.resources/LetterBox.mp3"
-    else:
-        return "https://s3.amazonaws.com/us.puzzleprison.resources/LetterBox.mp3"
-
-def audio_sharp_click():
-    if (locale_gb()):
-        return "https://s3-eu-west-1.amazonaws.com/eu.puzzleprison.resources/SharpClick.mp3"
-    else:
-        return "https://s3.amazonaws.com/us.puzzleprison.resources/SharpClick.mp3"
-
-def audio_moving_wall():
-    if (locale_gb()):
-        return "https://s3-eu-west-1.amazonaws.com/eu.puzzleprison.resources/MovingWall.mp3"
-    else:
-        return "https://s3.amazonaws.com/us.puzzleprison.resources/MovingWall.mp3"
-
-def audio_moving_statue():
-    if (locale_gb()):
-        return "https://s3-eu-west-1.amazonaws.com/eu.puzzleprison.resources/MovingStatue.mp3"
-    else:
-        return "https://s3.amazonaws.com/us.puzzleprison.resources/MovingStatue.mp3"
-
-def audio_computer_beeping():
-    if (locale_gb()):
-        return "https://s3-eu-west-1.amazonaws.com/eu.puzzleprison.resources/Beeps.mp3"
-    else:
-        return "https://s3.amazonaws.com/us.puzzleprison.resources/Beeps.mp3"
-
-def audio_jingle():
-    if (locale_gb()):
-        return "https://s3-eu-west-1.amazonaws.com/eu.puzzleprison.resources/FinishJingle.mp3"
-    else:
-        return "https://s3.amazonaws.com/us.puzzleprison.resources/FinishJingle.mp3"
+# File name, size in bytes and duration in seconds of each clip in Audio/
+AUDIO_CLIPS = {
+    "letter_box": ("LetterBox.mp3", 9934, 1.462),
+    "sharp_click": ("SharpClick.mp3", 6458, 0.246),
+    "moving_wall": ("MovingWall.mp3", 33844, 4.806),
+    "moving_statue": ("MovingStatue.mp3", 22616, 2.946),
+    "computer_beeping": ("Beeps.mp3", 23761, 3.115),
+    "jingle": ("FinishJingle.mp3", 18062, 2.168),
+}
+
+# Buckets holding a copy of every clip
+AUDIO_BUCKETS = {
+    "eu-west-1": "https://s3-eu-west-1.amazonaws.com/eu.puzzleprison.resources/",
+    "us-east-1": "https://s3.amazonaws.com/us.puzzleprison.resources/",
+}
+
+# Closest bucket to each locale, there is no eu-central-1 bucket so de-DE uses Ireland
+LOCALE_AUDIO_BUCKETS = {
+    "en-GB": "eu-west-1",
+    "en-US": "us-east-1",
+    "de-DE": "eu-west-1",
+}
+
+# Longest clip Alexa will play in a response
+AUDIO_MAX_DURATION = 240.0
+
+AudioClip = namedtuple("AudioClip", ["url", "size", "duration"])
+
+def build_audio_manifest():
+    """ Every clip for every locale, keyed by (clip, locale) """
+    manifest = {}
+    for audio_locale, bucket in LOCALE_AUDIO_BUCKETS.items():
+        for clip, (file_name, size, duration) in AUDIO_CLIPS.items():
+            manifest[(clip, audio_locale)] = AudioClip(AUDIO_BUCKETS[bucket] + file_name, size, duration)
+    return manifest
+
+def check_audio_manifest(manifest, audio_directory=None):
+    """ Returns a list of problems, checking sizes against the files too if audio_directory is given """
+    problems = []
+    for audio_locale in SUPPORTED_LOCALES:
+        for clip in sorted(AUDIO_CLIPS):
+            entry = manifest.get((clip, audio_locale))
+            if entry is None:
+                problems.append(audio_locale + " has no " + clip + " clip")
+            elif entry.duration > AUDIO_MAX_DURATION:
+                problems.append(clip + " is longer than " + str(AUDIO_MAX_DURATION) + " seconds")
+    if audio_directory is not None:
+        for clip, (file_name, size, duration) in sorted(AUDIO_CLIPS.items()):
+            path = os.path.join(audio_directory, file_name)
+            if not os.path.exists(path):
+                problems.append(file_name + " is missing from " + audio_directory)
+            elif os.path.getsize(path) != size:
+                problems.append(file_name + " is " + str(os.path.getsize(path)) + " bytes, not " + str(size))
+    return problems
+
+audio_manifest = build_audio_manifest()
+audio_manifest_problems = check_audio_manifest(audio_manifest)
+if audio_manifest_problems:
+    raise ValueError("Audio manifest is incomplete: " + "; ".join(audio_manifest_problems))
+
+def get_audio(clip):
+    """ URL of the clip in the bucket closest to the request locale """
+    entry = audio_manifest.get((clip, locale))
+    if entry is None:
+        entry = audio_manifest[(clip, DEFAULT_LOCALE)]
+    return entry.url
 
 # --------------- Response building
 
-def build_speech_response(title, output_speech, output_card, reprompt_text, should_end_session):
+def build_speech_response(title, output_ssml, output_card, reprompt_text, should_end_session):
     return {
         'outputSpeech': {
             'type': 'SSML',
-            'ssml': '<speak>' + output_speech + '</speak>'
+            'ssml': output_ssml
         },
         'card': {
             'type': 'Simple',
@@ -83,946 +115,1654 @@ def build_speech_response(title, output_speech, output_card, reprompt_text, shou
     }
 
 def build_response(session_attributes, text, should_end_session = False):
-    output_speech = text[1]
-    output_card = text[1]
-    if len(text) > 3:
-        clip_index = 0
-        while (clip_index < len(text) - 3):
-            output_speech = output_speech.replace("&at", create_audio_tag(text[3 + clip_index]), 1)
-            output_card = output_card.replace("&at", "", 1)
-            clip_index += 1
-
     return {
         'version': '1.0',
         'sessionAttributes': session_attributes,
-        'response': build_speech_response(text[0], output_speech, output_card, text[2], should_end_session)
+        'response': get_speech_response(text, should_end_session)
     }
 
-# --------------- Database
-
-def PutQuestPoint(session):
-    try:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table('PuzzlePrison')
-        userId = session['user']['userId']
-        table.put_item(
-            Item={
-                'userID': userId,
-                'questPoint': 0,
-                'lastUpdate': time.strftime("%Y-%m-%d")
-            }
-        )
-    except ClientError as e1:
-        print('Failed Database Access')
-
-def SaveQuestPoint(session, qp):
-    try:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table('PuzzlePrison')
-        userId = session['user']['userId']
-        response = table.update_item(
-            Key={
-                'userID': userId
-            },
-            UpdateExpression="set questPoint=:q, lastUpdate=:u",
-            ExpressionAttributeValues={
-                ':q': qp,
-                ':u': time.strftime("%Y-%m-%d")
-            },
-            ReturnValues = "UPDATED_NEW"
-        )
-    except ClientError as e:
-        print('Update Failed')
-
-def LoadQuestPoint(session):
-    try:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table('PuzzlePrison')
-        userId = session['user']['userId']
-        response = table.get_item(
-            Key={
-                'userID': userId
-            }
-        )
-        if (len(response) < 2):
-            PutQuestPoint(session)
-            return 0
+def get_speech_response(text, should_end_session):
+    # The response body only depends on the texts, audio and end flag, so it is built once and shared
+    key = (should_end_session,) + tuple(text)
+    response = response_cache.get(key)
+    if response is None:
+        template = response_templates.get(text[1])
+        if template is None or template.audio != len(text) - 3:
+            template = get_response_template(text[1], len(text) - 3)
+        if template.clips:
+            output_ssml = template.ssml % tuple([get_audio_tag(file_name) for file_name in text[3:3 + template.clips]])
         else:
-            item = response['Item']
-            qp = item['questPoint']
-            if (qp < 0 or qp > 10):
-                SaveQuestPoint(session, 0)
-                return 0
-            else:
-                return qp
-    except ClientError as e1:
-        try:
-            PutQuestPoint(session)
-            return 0
-        except ClientError as e2:
-            return 0
-
-# --------------- Custom Slots
-
-def get_object_slot(intent):
-    if intent.get('slots', {}) and 'object' in intent['slots'] and 'value' in intent['slots']['object']:
-        return intent['slots']['object']['value']
-    else:
-        return ""
-
-def get_option_slot(intent):
-    if intent.get('slots', {}) and 'option' in intent['slots'] and 'value' in intent['slots']['option']:
-        return intent['slots']['option']['value']
-    else:
-        return ""
-
-# --------------- Attributes
-
-def get_attr(session, attr, default):
-    if session.get('attributes', {}) and attr in session.get('attributes', {}):
-        return session['attributes'][attr]
-    else:
-        return default
-
-def get_quest_point(session):
-    return get_attr(session, "QuestPoint", LoadQuestPoint(session))
+            output_ssml = template.ssml
+        response = freeze(build_speech_response(text[0], output_ssml, template.card, text[2], should_end_session))
+        response_cache.set(key, response)
+    return response
 
-def get_diag_order(session):
-    return get_attr(session, "DiagProgress", "")
+# --------------- Response cache
 
-def get_ne_complete(session):
-    return get_attr(session, "NE", False)
+class FrozenDict(dict):
+    """ A dict that cannot be changed once built, so cached responses can be shared safely.
 
-def get_nw_complete(session):
-    return get_attr(session, "NW", False)
+    Still a dict, so the Lambda runtime serialises it as JSON like any other response.
+    """
 
-def get_se_complete(session):
-    return get_attr(session, "SE", False)
+    # Length of the JSON encoding, filled in by response_size the first time it is needed
+    encoded_size = None
 
-def get_sw_complete(session):
-    return get_attr(session, "SW", False)
+    def immutable(self, *args, **kwargs):
+        raise TypeError("Cached responses cannot be modified")
 
-def get_context(session):
-    return get_attr(session, "Context", "")
+    __setitem__ = immutable
+    __delitem__ = immutable
+    clear = immutable
+    pop = immutable
+    popitem = immutable
+    setdefault = immutable
+    update = immutable
+    __ior__ = immutable
 
-def get_is_playing(session):
-    return get_attr(session, "IsPlaying", False)
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
 
-def build_attr(qp, diag, NE, NW, SE, SW, context):
-    if (qp == 4):
-        return{
-            "QuestPoint": qp,
-            "DiagProgress": diag,
-            "Context": context,
-            "IsPlaying": True,
-        }
-    elif (qp == 6):
-        return {
-            "QuestPoint": qp,
-            "NE": NE,
-            "NW": NW,
-            "SE": SE,
-            "SW": SW,
-            "Context": context,
-            "IsPlaying": True,
-        }
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
     else:
+        return value
+
+class ResponseCache(object):
+    """ Bounded LRU cache of built response bodies """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        # Single OrderedDict operations are atomic, only set needs the lock
+        response = self.entries.get(key)
+        if response is None:
+            self.misses += 1
+            return None
+        try:
+            self.entries.move_to_end(key)
+        except KeyError:
+            pass
+        self.hits += 1
+        return response
+
+    def set(self, key, response):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = response
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
         return {
-            "QuestPoint": qp,
-            "Context": context,
-            "IsPlaying": True,
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
         }
 
-# --------------- Texts Utility
-
-def text_prompt():
-    return "What would you like to do?"
-
-def text_misunderstand():
-    return "Sorry, I didn't understand what you said. Say, help, to receive a list of possible commands. "
-
-def text_error():
-    return "Sorry something went wrong"
-
-def text_terminal_prompt():
-    return "Which terminal?"
-
-def text_statue_prompt():
-    return "Which statue?"
-
-def text_wall_prompt():
-    return "Which wall?"
-
-def text_options_prompt():
-    return "Which option do you choose? One or two?"
-
-# --------------- Texts Titles
-
-def text_title_misunderstand():
-    return "I didn't understand"
-
-def text_title_error():
-    return "Something went wrong"
-
-def text_title_play_again():
-    return "You are already playing"
-
-def text_title_start_qp0():
-    return "Welcome to Puzzle Prison"
-
-def text_title_start():
-    return "Welcome back to Puzzle Prison"
-
-def text_title_stop():
-    return "Thank you for playing!"
-
-def text_title_walk_only_terminal():
-    return "Walk to Computer Terminal"
-
-def text_title_walk_northeast_terminal():
-    return "Walk to North East Terminal"
-
-def text_title_walk_northwest_terminal():
-    return "Walk to North West Terminal"
-
-def text_title_walk_southeast_terminal():
-    return "Walk to South East Terminal"
-
-def text_title_walk_southwest_terminal():
-    return "Walk to South West Terminal"
-
-def text_title_walk_central_terminal():
-    return "Walk to Central Terminal"
-
-def text_title_walk_northeast_statue():
-    return "Walk to North East Statue"
-
-def text_title_walk_northwest_statue():
-    return "Walk to North West Statue"
-
-def text_title_walk_southeast_statue():
-    return "Walk to South East Statue"
-
-def text_title_walk_southwest_statue():
-    return "Walk to South West Statue"
-
-def text_title_walk_north_wall():
-    return "Walk to North Wall"
+# Length of a response's JSON around its session attributes and body
+RESPONSE_ENVELOPE_SIZE = len(json.dumps({'version': '1.0', 'sessionAttributes': 0, 'response': 0},
+                                        separators=(',', ':'))) - 2
+
+def encoded_size(value):
+    return len(json.dumps(value, separators=(',', ':'), default=str))
+
+def response_size(response):
+    """ Bytes of the response as compact JSON, the shared body only being encoded once """
+    body = response.get('response')
+    if not isinstance(body, FrozenDict) or len(response) != 3 or response.get('version') != '1.0':
+        return encoded_size(response)
+    if body.encoded_size is None:
+        body.encoded_size = encoded_size(body)
+    attributes = response['sessionAttributes']
+    if len(attributes) == 1 and type(attributes.get(SESSION_STATE_KEY)) is int:
+        # Packed state, its JSON is the digits of the integer inside a fixed wrapper
+        attributes_size = PACKED_ATTRIBUTES_SIZE + len(str(attributes[SESSION_STATE_KEY]))
+    else:
+        attributes_size = encoded_size(attributes)
+    return RESPONSE_ENVELOPE_SIZE + attributes_size + body.encoded_size
 
-def text_title_walk_south_wall():
-    return "Walk to South Wall"
+response_cache = ResponseCache(int(os.environ.get('PUZZLE_PRISON_RESPONSE_CACHE_SIZE', '1024')))
 
-def text_title_walk_east_wall():
-    return "Walk to East Wall"
+# --------------- Response templates
 
-def text_title_walk_west_wall():
-    return "Walk to West Wall"
+class ResponseTemplate(object):
+    """ A text split once on its &at audio markers.
 
-def text_title_walk_letter():
-    return "Walk to Letter"
+    Built for a given number of audio clips, the first clips markers become %s slots for
+    audio tags in the SSML and are dropped from the card. Markers beyond the clips given
+    are left in place.
+    """
 
-def text_title_walk_letter_box():
-    return "Walk to Letter Box"
+    __slots__ = ('audio', 'clips', 'ssml', 'card')
 
-def text_title_walk_metal_cabinet():
-    return "Walk to Metal Cabinet"
+    def __init__(self, text, audio):
+        segments = text.split("&at")
+        self.audio = audio
+        self.clips = min(audio, len(segments) - 1)
+        rest = "&at".join(segments[self.clips:])
+        if self.clips == 0:
+            self.ssml = '<speak>' + text + '</speak>'
+        else:
+            self.ssml = '<speak>' + '%s'.join([segment.replace('%', '%%') for segment in segments[:self.clips]]) + \
+                        '%s' + rest.replace('%', '%%') + '</speak>'
+        self.card = ''.join(segments[:self.clips]) + rest
+
+# Keyed by text for the clip count it is normally used with, other clip counts by (text, audio)
+response_templates = {}
+response_template_variants = {}
+audio_tags = {}
+
+def get_response_template(text, audio):
+    template = response_templates.get(text)
+    if template is None:
+        template = response_templates[text] = ResponseTemplate(text, audio)
+    elif template.audio != audio:
+        key = (text, audio)
+        template = response_template_variants.get(key)
+        if template is None:
+            template = response_template_variants[key] = ResponseTemplate(text, audio)
+    return template
+
+def get_audio_tag(file_name):
+    tag = audio_tags.get(file_name)
+    if tag is None:
+        tag = audio_tags[file_name] = create_audio_tag(file_name)
+    return tag
+
+def all_texts():
+    """ Every text of every supported locale """
+    texts = []
+    for text_locale in SUPPORTED_LOCALES:
+        texts.extend(get_text_catalog(text_locale).values())
+    return texts
 
-def text_title_only_computer_terminal_qp0():
-    return "Using the computer terminal"
+# --------------- Database
 
-def text_title_northeast_computer_terminal_qp6():
-    return "You use the north east terminal"
+DATABASE_TABLE_NAME = 'PuzzlePrison'
+
+# Storage backend: dynamodb (default), memory or sqlite
+DATABASE_BACKEND = os.environ.get('PUZZLE_PRISON_STORE', 'dynamodb').lower()
+SQLITE_PATH = os.environ.get('PUZZLE_PRISON_SQLITE_PATH', '/tmp/PuzzlePrison.sqlite')
+
+# When set, DynamoDB requests go to the table in the region closest to the request locale
+REGIONAL_TABLES = os.environ.get('PUZZLE_PRISON_REGIONAL_TABLES', '').lower() in ('1', 'true', 'yes')
+# Region of the original table, users missing from a regional table are copied from here
+LEGACY_REGION = os.environ.get('PUZZLE_PRISON_LEGACY_REGION', os.environ.get('AWS_REGION', 'us-east-1'))
+LOCALE_REGIONS = {
+    "en-GB": "eu-west-1",
+    "en-US": "us-east-1",
+    "de-DE": "eu-central-1",
+}
+
+# When set, quest point writes are held in the session and flushed once the session ends
+WRITE_BEHIND = os.environ.get('PUZZLE_PRISON_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+
+# boto3 is most of the cold start and many turns never reach storage, so it is imported by
+# the first DynamoDB call rather than with this module
+boto3 = None
+BotoCoreError = None
+ClientError = None
+# Only the sqlite backend needs sqlite3, it is imported when that store is built
+sqlite3 = None
+
+# Built once per container and reused by every warm invocation
+database_config = None
+database_tables = {}
+database_stores = {}
+database_deserializer = None
+database_clients_built = 0
+loaded_quest_point = None
+pending_quest_point = None
+# Set when the session's quest point could not be loaded, its saves would overwrite real progress
+quest_point_unknown = False
+
+def import_boto3():
+    global boto3, BotoCoreError, ClientError, database_config, database_deserializer
+    if database_deserializer is not None:
+        return
+    import boto3
+    from boto3.dynamodb.types import TypeDeserializer
+    from botocore.config import Config
+    from botocore.exceptions import BotoCoreError, ClientError
+    database_config = Config(
+        connect_timeout=STORAGE_CONNECT_TIMEOUT,
+        read_timeout=STORAGE_READ_TIMEOUT,
+        max_pool_connections=4,
+        tcp_keepalive=True,
+        retries={'max_attempts': 1, 'mode': 'standard'}
+    )
+    database_deserializer = TypeDeserializer()
+
+def get_database_table(region=None):
+    global database_clients_built
+    table = database_tables.get(region)
+    if table is None:
+        import_boto3()
+        dynamodb = boto3.resource('dynamodb', region_name=region, config=database_config)
+        table = database_tables[region] = dynamodb.Table(DATABASE_TABLE_NAME)
+        database_clients_built += 1
+    return table
+
+def get_storage_region():
+    if DATABASE_BACKEND == "dynamodb" and REGIONAL_TABLES:
+        return LOCALE_REGIONS.get(locale, LEGACY_REGION)
+    else:
+        return None
+
+def storage_region_name():
+    """ Region dimension of the metrics, the backend name for stores that are not in a region """
+    region = get_storage_region()
+    if region is not None:
+        return region
+    if DATABASE_BACKEND == "dynamodb":
+        return LEGACY_REGION
+    return DATABASE_BACKEND
+
+def get_quest_point_store():
+    region = get_storage_region()
+    store = database_stores.get(region)
+    if store is None:
+        store = database_stores[region] = create_quest_point_store(DATABASE_BACKEND, region)
+    return store
+
+def storage_latency_report():
+    reports = []
+    for store in database_stores.values():
+        reports.append(store.latency_report())
+        if getattr(store, 'legacy', None) is not None:
+            reports.append(store.legacy.latency_report())
+    return reports
 
-def text_title_northwest_computer_terminal_qp6():
-    return "You use the north west terminal"
+def SaveQuestPoint(session, qp):
+    # Starting over is written straight away, progress staged after it would otherwise be refused
+    # for being lower than what is stored
+    if WRITE_BEHIND and qp != 0:
+        StageQuestPoint(session, qp)
+    else:
+        WriteQuestPoint(session, qp)
+
+def WriteQuestPoint(session, qp):
+    global pending_quest_point
+    userId = session['user']['userId']
+    if quest_point_unknown:
+        storage_metrics["unknownSkips"] += 1
+        pending_quest_point = None
+        log_warning('Save Skipped, Quest Point Unknown')
+        return
+    if not has_time_for(STORAGE_CALL_BUDGET):
+        # Too close to the deadline, leave it for the flush at the end of the session
+        storage_metrics["deadlineSkips"] += 1
+        pending_quest_point = qp
+        return
+    try:
+        written = call_storage("save", userId, qp, has_time_for(BOOKKEEPING_BUDGET))
+        # Anything still held from an earlier failed or deferred save is older than this
+        pending_quest_point = None
+        if written:
+            quest_point_cache.set(userId, qp)
+        else:
+            # The session started from an older quest point than the one stored, which is kept
+            storage_metrics["staleSaves"] += 1
+            quest_point_cache.discard(userId)
+            log_warning('Save Refused, Stored Quest Point Is Further On', "quest point " + str(qp))
+    except StorageError as e:
+        # Keep the progress in the session so it is written again when the session ends
+        quest_point_cache.discard(userId)
+        pending_quest_point = qp
+        log_warning('Update Failed', e)
 
-def text_title_southeast_computer_terminal_qp6():
-    return "You use the south east terminal"
+def LoadQuestPoint(session):
+    global quest_point_unknown
+    userId = session['user']['userId']
+    qp = quest_point_cache.get(userId)
+    if qp is not None:
+        quest_point_unknown = False
+        return qp
+
+    # Never put off for the deadline, every save from the session depends on knowing the stored progress
+    try:
+        qp = call_storage("load", userId)
+    except StorageError as e:
+        # The game goes on from 0, but nothing from this session may be saved over the stored progress
+        quest_point_unknown = True
+        log_warning('Failed Database Access', e)
+        return 0
+    quest_point_unknown = False
+    quest_point_cache.set(userId, qp)
+    return qp
+
+# --------------- Deadline
+
+# Seconds kept back from the Lambda deadline for building and returning the response
+RESPONSE_RESERVE = 0.3
+# Seconds the DynamoDB client waits to connect and for each response before giving up
+STORAGE_CONNECT_TIMEOUT = 0.25
+STORAGE_READ_TIMEOUT = 0.5
+# Seconds a storage call can take, the client timeouts keep each request within it
+STORAGE_CALL_BUDGET = STORAGE_CONNECT_TIMEOUT + STORAGE_READ_TIMEOUT
+# Below this many seconds the lastUpdate bookkeeping is left out of saves
+BOOKKEEPING_BUDGET = 2 * STORAGE_CALL_BUDGET
+
+request_deadline = None
+
+def set_request_deadline(context):
+    global request_deadline
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        request_deadline = time.time() + context.get_remaining_time_in_millis() / 1000.0
+    else:
+        request_deadline = None
+
+def remaining_time():
+    if request_deadline is None:
+        return None
+    return request_deadline - time.time() - RESPONSE_RESERVE
+
+def has_time_for(seconds):
+    remaining = remaining_time()
+    return remaining is None or remaining >= seconds
+
+# --------------- Logging
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'OFF': 100}
+# Lines below this level are never built
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('PUZZLE_PRISON_LOG_LEVEL', 'INFO').upper(), LOG_LEVELS['INFO'])
+# Share of requests that write their summary line, requests with a warning always write it.
+# Every request already writes a metrics record, so by default only one in a hundred also logs
+LOG_SAMPLE_RATE = float(os.environ.get('PUZZLE_PRISON_LOG_SAMPLE_RATE', '0.01'))
+
+# Lines are written here, or to stdout when None
+log_sink = None
+# This request's event, timings and warnings, written as one line when the request finishes
+request_log = None
+
+def write_log_line(record):
+    # default=str, as a value json cannot encode must not cost the request its response
+    (log_sink or sys.stdout).write(json.dumps(record, sort_keys=True, separators=(',', ':'), default=str) + "\n")
+
+def log(level, message, fields=None):
+    """ Writes a line on its own, fields returns a dict and is only called when the line is written """
+    if LOG_LEVELS[level] < LOG_LEVEL:
+        return
+    record = {'level': level, 'message': message}
+    if fields is not None:
+        record.update(fields())
+    write_log_line(record)
+
+def log_warning(message, error=None):
+    """ Adds a warning to this request's line, which is then written whatever the sampling """
+    if LOG_LEVELS['WARNING'] < LOG_LEVEL:
+        return
+    warning = {'message': message}
+    if error is not None:
+        warning['error'] = str(error)
+    if request_log is None:
+        log('WARNING', message, lambda: warning)
+    else:
+        request_log['warnings'].append(warning)
+
+def start_request_log(event):
+    global request_log
+    request_log = {
+        'event': event,
+        'start': time.perf_counter(),
+        'sampled': LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE,
+        'warnings': [],
+    }
 
-def text_title_southwest_computer_terminal_qp6():
-    return "You use the south west terminal"
+def request_outcome(response, error):
+    if error is not None:
+        return "exception"
+    if response is None:
+        return "noResponse"
+    title = response['response']['card']['title']
+    if title == get_text("title_error"):
+        return "error"
+    if title == get_text("title_misunderstand"):
+        return "misunderstood"
+    if response['response']['shouldEndSession']:
+        return "ended"
+    return "ok"
+
+def finish_request_log(response, state, error=None):
+    """ Writes the request's line: intent, quest point, storage timings and outcome """
+    global request_log
+    entry = request_log
+    request_log = None
+    if entry is None:
+        return
+    if error is not None:
+        level = 'ERROR'
+    elif entry['warnings']:
+        level = 'WARNING'
+    elif entry['sampled']:
+        level = 'INFO'
+    else:
+        return
+    if LOG_LEVELS[level] < LOG_LEVEL:
+        return
+
+    event = entry['event']
+    request = event['request']
+    record = {
+        'level': level,
+        'message': "request",
+        'requestId': request['requestId'],
+        'sessionId': event['session']['sessionId'],
+        'newSession': event['session']['new'],
+        'locale': locale,
+        'type': request['type'],
+        'intent': request['intent']['name'] if 'intent' in request else None,
+        'questPoint': request_quest_point(state),
+        'outcome': request_outcome(response, error),
+        'durationMs': round((time.perf_counter() - entry['start']) * 1000.0, 3),
+        'storageMs': dict((operation, round(seconds * 1000.0, 3)) for operation, (calls, seconds) in request_storage.items()),
+        'databaseClientsBuilt': database_clients_built,
+    }
+    if entry['warnings']:
+        record['warnings'] = entry['warnings']
+    if error is not None:
+        record['error'] = repr(error)
+    write_log_line(record)
+
+# --------------- Metrics
+
+# Per request metrics in CloudWatch embedded metric format, written when the invocation finishes
+METRICS_ENABLED = os.environ.get('PUZZLE_PRISON_METRICS', '1').lower() in ('1', 'true', 'yes')
+METRICS_NAMESPACE = os.environ.get('PUZZLE_PRISON_METRICS_NAMESPACE', 'PuzzlePrison')
+# Records are appended to this file instead of stdout, for running locally and in tests
+METRICS_FILE = os.environ.get('PUZZLE_PRISON_METRICS_FILE')
+
+METRIC_DIRECTIVES = [{
+    'Namespace': METRICS_NAMESPACE,
+    'Dimensions': [['Intent', 'QuestPoint'], ['Intent'], ['Region']],
+    'Metrics': [
+        {'Name': 'HandlerTime', 'Unit': 'Milliseconds'},
+        {'Name': 'StorageTime', 'Unit': 'Milliseconds'},
+        {'Name': 'StorageCalls', 'Unit': 'Count'},
+        {'Name': 'ResponseSize', 'Unit': 'Bytes'},
+        {'Name': 'StorageRetries', 'Unit': 'Count'},
+        {'Name': 'StorageShortCircuits', 'Unit': 'Count'},
+        {'Name': 'LostWrites', 'Unit': 'Count'},
+        {'Name': 'BreakerOpenTime', 'Unit': 'Milliseconds'},
+    ],
+}]
+
+# The directives are the same in every record, so records are formatted around them once encoded
+METRIC_RECORD_FORMAT = ('{"_aws":{"Timestamp":%d,"CloudWatchMetrics":' +
+                        json.dumps(METRIC_DIRECTIVES, separators=(',', ':')) +
+                        '},"Intent":%s,"QuestPoint":"%s","Region":"%s","HandlerTime":%.3f,"StorageTime":%.3f,'
+                        '"StorageCalls":%d,"ResponseSize":%d,"StorageRetries":%d,"StorageShortCircuits":%d,'
+                        '"LostWrites":%d,"BreakerOpenTime":%.3f}\n')
+
+# QuestPoint dimension value of requests handled without knowing the quest point
+UNKNOWN_QUEST_POINT = "unknown"
+
+# Records are written here when set, before METRICS_FILE and stdout
+metrics_sink = None
+# (timestamp, intent name, quest point, storage region, handler seconds, storage seconds, storage calls, response bytes,
+#  retries, short circuits, lost writes, breaker open seconds)
+metrics_buffer = []
+# Resilience counts already reported, each record carries what happened since the previous one
+reported_resilience = (0, 0, 0, 0.0)
+
+def record_request_metrics(intent_name, qp, handler_seconds, response):
+    if not METRICS_ENABLED:
+        return
+    storage_calls = 0
+    storage_seconds = 0.0
+    for calls, seconds in request_storage.values():
+        storage_calls += calls
+        storage_seconds += seconds
+    response_bytes = response_size(response) if response is not None else 0
+    global reported_resilience
+    previous = reported_resilience
+    reported_resilience = resilience_counts()
+    metrics_buffer.append((int(time.time() * 1000), intent_name, qp, storage_region_name(), handler_seconds,
+                           storage_seconds, storage_calls, response_bytes) +
+                          tuple(now - before for now, before in zip(reported_resilience, previous)))
+
+def format_metric_record(entry):
+    (timestamp, intent_name, qp, region, handler_seconds, storage_seconds, storage_calls, response_bytes,
+     retries, short_circuits, lost_writes, open_seconds) = entry
+    if qp is None:
+        qp = UNKNOWN_QUEST_POINT
+    return METRIC_RECORD_FORMAT % (timestamp, json.dumps(intent_name), qp, region, handler_seconds * 1000.0,
+                                   storage_seconds * 1000.0, storage_calls, response_bytes,
+                                   retries, short_circuits, lost_writes, open_seconds * 1000.0)
+
+def flush_metrics():
+    """ Writes the buffered records in one go """
+    if not metrics_buffer:
+        return
+    lines = "".join([format_metric_record(entry) for entry in metrics_buffer])
+    del metrics_buffer[:]
+    if metrics_sink is not None:
+        metrics_sink.write(lines)
+    elif METRICS_FILE:
+        with open(METRICS_FILE, 'a') as metrics_file:
+            metrics_file.write(lines)
+    else:
+        sys.stdout.write(lines)
+
+# --------------- Storage Resilience
+
+STORAGE_MAX_RETRIES = 3
+STORAGE_BACKOFF_BASE = 0.025
+STORAGE_BACKOFF_CAP = 0.2
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+
+class StorageError(Exception):
+    """ Raised by call_storage when a storage operation could not be completed """
+
+class StorageUnavailable(StorageError):
+    """ Raised instead of calling storage while the circuit breaker is open """
+
+class CircuitBreaker(object):
+    """ Stops calling storage after repeated failures, trying again once the cooldown has passed """
+
+    def __init__(self, failure_threshold, cooldown):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.open_seconds = 0.0
+        self.times_opened = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            # Half open: let a single trial call through per cooldown period
+            if time.time() - self.opened_at >= self.cooldown:
+                self.open_seconds += time.time() - self.opened_at
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                self.open_seconds += time.time() - self.opened_at
+                self.opened_at = None
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.opened_at is None and self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+                self.times_opened += 1
+
+    def is_open(self):
+        return self.opened_at is not None
+
+    def stats(self):
+        open_seconds = self.open_seconds
+        if self.opened_at is not None:
+            open_seconds += time.time() - self.opened_at
+        return {
+            "open": self.is_open(),
+            "timesOpened": self.times_opened,
+            "openSeconds": open_seconds,
+        }
 
-def text_title_computer_terminal_not_responding():
-    return "The computer is not responding"
+storage_metrics = {
+    "retries": 0,
+    "failures": 0,
+    "shortCircuits": 0,
+    "deadlineSkips": 0,
+    "unknownSkips": 0,
+    "lostWrites": 0,
+    "staleSaves": 0,
+}
+
+def backoff_delay(attempt):
+    # Full jitter exponential backoff
+    return random.uniform(0, min(STORAGE_BACKOFF_CAP, STORAGE_BACKOFF_BASE * (2 ** attempt)))
+
+# Calls made and seconds spent in each storage operation during this request
+request_storage = {}
+
+def call_storage(operation, *args):
+    start = time.perf_counter()
+    try:
+        return retry_storage(operation, args)
+    finally:
+        timing = request_storage.get(operation)
+        if timing is None:
+            timing = request_storage[operation] = [0, 0.0]
+        timing[0] += 1
+        timing[1] += time.perf_counter() - start
+
+def retry_storage(operation, args):
+    store = get_quest_point_store()
+    if not store.breaker.allow():
+        storage_metrics["shortCircuits"] += 1
+        raise StorageUnavailable("Storage circuit breaker is open")
+
+    attempt = 0
+    while True:
+        try:
+            result = getattr(store, operation)(*args)
+        except store.errors as e:
+            if store.is_throttle(e) and attempt < STORAGE_MAX_RETRIES:
+                delay = backoff_delay(attempt)
+                if has_time_for(delay + STORAGE_CALL_BUDGET):
+                    storage_metrics["retries"] += 1
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+            storage_metrics["failures"] += 1
+            store.breaker.record_failure()
+            raise StorageError(str(e))
+        store.breaker.record_success()
+        return result
+
+def resilience_counts():
+    """ (retries, short circuits, lost writes, breaker open seconds) so far in this container """
+    open_seconds = 0.0
+    for store in database_stores.values():
+        open_seconds += store.breaker.stats()["openSeconds"]
+    return (storage_metrics["retries"], storage_metrics["shortCircuits"], storage_metrics["lostWrites"],
+            open_seconds)
+
+def resilience_report():
+    report = dict(storage_metrics)
+    report["breakers"] = dict((store.name, store.breaker.stats()) for store in database_stores.values())
+    return report
+
+# --------------- Quest Point Cache
+
+class QuestPointCache(object):
+    """ Bounded LRU cache of quest points keyed by userId, kept for the life of a warm container.
+
+    Entries older than ttl seconds are treated as misses so progress made on another
+    container is picked up again. Until then a player relaunching on a container that did
+    not save their latest progress starts from an older quest point. Saves never lower the
+    stored quest point, so that progress is not lost, only replayed.
+    """
 
-def text_title_interact_statue():
-    return "You examine the statue"
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self.entries[user_id]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, user_id, qp):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[user_id] = (qp, time.time())
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
 
-def text_title_interact_north_wall_qp2():
-    return "You Push the North Wall"
+quest_point_cache = QuestPointCache(
+    int(os.environ.get('PUZZLE_PRISON_CACHE_SIZE', '1024')),
+    float(os.environ.get('PUZZLE_PRISON_CACHE_TTL', '300'))
+)
 
-def text_title_interact_north_wall():
-    return "Knock on North Wall"
+# --------------- Storage Backends
 
-def text_title_interact_south_wall():
-    return "Knock on South Wall"
+def today():
+    return time.strftime("%Y-%m-%d")
 
-def text_title_interact_east_wall():
-    return "Knock on East Wall"
+def valid_quest_point(qp):
+    return 0 <= qp <= 10
 
-def text_title_interact_west_wall():
-    return "Knock on West Wall"
+class LatencyHistogram(object):
+    """ Counts operation latencies into fixed millisecond buckets """
 
-def text_title_interact_letter_box():
-    return "You look through the letter box"
+    BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
 
-def text_title_interact_metal_cabinet():
-    return "You attempt to open the metal cabinet"
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
 
-def text_title_read_letter():
-    return "You read the letter"
+    def record(self, elapsed_ms):
+        index = 0
+        while index < len(self.BUCKETS_MS) and elapsed_ms > self.BUCKETS_MS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
 
-def text_title_nice_option():
-    return "The computer seems happy"
+    def summary(self):
+        buckets = {}
+        for index, bound in enumerate(self.BUCKETS_MS):
+            buckets["<=" + str(bound)] = self.counts[index]
+        buckets[">" + str(self.BUCKETS_MS[-1])] = self.counts[-1]
+        return {
+            "count": self.count,
+            "meanMs": self.total_ms / self.count if self.count else 0.0,
+            "maxMs": self.max_ms,
+            "buckets": buckets,
+        }
 
-def text_title_mean_option():
-    return "You've upset the computer, it's stopped working"
+class QuestPointStore(object):
+    """ Storage interface behind SaveQuestPoint and LoadQuestPoint.
 
-# --------------- Texts Walk To Non Special
+    load creates missing users at quest point 0 and repairs quest points outside 0-10.
+    save never lowers a valid stored quest point, except to 0 when the game is started over
+    or finished, and returns whether it wrote. Backends raise one of their errors on failure.
+    """
 
-def text_walk_to_wall():
-    return "Which wall would you like to walk to? Your options are north, south, east and west."
+    name = "base"
+    errors = ()
 
-def text_walk_to_north_wall():
-    return "You walk up to the north most wall. " +\
-           text_prompt()
+    def __init__(self):
+        self.histograms = {}
+        self.breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN)
 
-def text_walk_to_south_wall():
-    return "You walk up to the south most wall. " +\
-           text_prompt()
+    def timed(self, operation, function, *args):
+        start = time.time()
+        try:
+            return function(*args)
+        finally:
+            histogram = self.histograms.get(operation)
+            if histogram is None:
+                histogram = self.histograms[operation] = LatencyHistogram()
+            histogram.record((time.time() - start) * 1000.0)
 
-def text_walk_to_east_wall():
-    return "You walk up to the east most wall. " +\
-           text_prompt()
+    def save(self, user_id, qp, touch=True):
+        return self.timed("save", self.save_item, user_id, qp, touch)
 
-def text_walk_to_west_wall():
-    return "You walk up to the west most wall. " +\
-           text_prompt()
+    def load(self, user_id):
+        return self.timed("load", self.load_item, user_id)
 
-def text_walk_to_statue():
-    return "Which statue would you like to walk to? Your options are north east, north west, " \
-           "south east and south west."
+    def is_throttle(self, error):
+        return False
 
-def text_walk_to_northeast_statue():
-    return "You walk up to the statue in the north east corner. " +\
-           text_prompt()
+    def latency_report(self):
+        report = {}
+        for operation, histogram in self.histograms.items():
+            report[operation] = histogram.summary()
+        return {"backend": self.name, "operations": report}
 
-def text_walk_to_northwest_statue():
-    return "You walk up to the statue in the north west corner. " +\
-           text_prompt()
+    def save_item(self, user_id, qp, touch):
+        raise NotImplementedError
 
-def text_walk_to_southeast_statue():
-    return "You walk up to the statue in the south east corner. " +\
-           text_prompt()
+    def load_item(self, user_id):
+        raise NotImplementedError
 
-def text_walk_to_southwest_statue():
-    return "You walk up to the statue in the south west corner. " +\
-           text_prompt()
+    def scan_segment(self, segment, total_segments):
+        """ Yields every item in one segment of a parallel scan as userID, questPoint and lastUpdate """
+        raise NotImplementedError
 
-def text_walk_to_terminal():
-    return "Which Terminal would you like to walk to? Your options are north east, north west, " \
-           "south east and south west."
+    def write_items(self, items):
+        """ Writes whole items in as few batched requests as the backend allows """
+        raise NotImplementedError
 
-def text_walk_to_northeast_computer_terminal():
-    return "You walk up to the computer terminal in the north east corner. " +\
-           text_prompt()
+    def insert_items(self, items):
+        """ Writes items for users that are not stored yet and returns how many were written """
+        raise NotImplementedError
 
-def text_walk_to_northwest_computer_terminal():
-    return "You walk up to the computer terminal in the north west corner. " +\
-           text_prompt()
+    def missing_items(self, items):
+        """ The items whose users are not stored yet, the ones insert_items would write """
+        raise NotImplementedError
 
-def text_walk_to_southeast_computer_terminal():
-    return "You walk up to the computer terminal in the south east corner. " +\
-           text_prompt()
+    def repair_items(self, repairs):
+        """ Writes each (scanned quest point, item) where the stored quest point is still the scanned one,
+        returning how many were written
+        """
+        raise NotImplementedError
 
-def text_walk_to_southwest_computer_terminal():
-    return "You walk up to the computer terminal in the south west corner. " +\
-           text_prompt()
+class DynamoDBQuestPointStore(QuestPointStore):
+    """ The PuzzlePrison table, in the default region or a given one.
 
-def text_walk_to_central_computer_terminal():
-    return "You walk up to the computer terminal in the centre of the room. " +\
-           text_prompt()
+    A store with a legacy store copies users it has never seen from the legacy table,
+    moving players over the first time they play after regional tables are turned on.
+    """
 
-def text_walk_to_only_computer_terminal():
-    return "You walk up to the computer terminal. " +\
-           text_prompt()
+    throttle_codes = (
+        'ProvisionedThroughputExceededException',
+        'ThrottlingException',
+        'RequestLimitExceeded',
+    )
 
-def text_walk_to_letter_box():
-    return "You walk up to the letter box in the south most wall. " +\
-           text_prompt()
+    def __init__(self, region=None, legacy=None):
+        QuestPointStore.__init__(self)
+        self.region = region
+        self.legacy = legacy
+        self.name = "dynamodb:" + region if region else "dynamodb"
+        self.migrated = 0
+
+    @property
+    def errors(self):
+        import_boto3()
+        return (ClientError, BotoCoreError)
+
+    def table(self):
+        return get_database_table(self.region)
+
+    def is_throttle(self, error):
+        return isinstance(error, ClientError) and \
+            error.response.get('Error', {}).get('Code') in self.throttle_codes
+
+    def save_item(self, user_id, qp, touch):
+        arguments = {
+            'Key': {
+                'userID': user_id
+            },
+            'UpdateExpression': "set questPoint=:q",
+            'ExpressionAttributeValues': {
+                ':q': qp
+            }
+        }
+        if touch:
+            arguments['UpdateExpression'] += ", lastUpdate=:u"
+            arguments['ExpressionAttributeValues'][':u'] = today()
+        if qp != 0:
+            arguments['ConditionExpression'] = \
+                "attribute_not_exists(questPoint) or questPoint <= :q or questPoint < :zero or questPoint > :max"
+            arguments['ExpressionAttributeValues'][':zero'] = 0
+            arguments['ExpressionAttributeValues'][':max'] = 10
+        try:
+            self.table().update_item(**arguments)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def load_item(self, user_id):
+        if self.legacy is not None:
+            qp = self.fetch_item(user_id)
+            if qp is not None and valid_quest_point(qp):
+                return qp
+            if qp is None:
+                # The user is only created here once the legacy table has been read, so a failed
+                # legacy read leaves nothing behind and the next load tries the migration again
+                legacy_qp = self.legacy.timed("fetch", self.legacy.fetch_item, user_id)
+                if legacy_qp is not None and valid_quest_point(legacy_qp):
+                    qp, created = self.upsert_item(user_id, legacy_qp)
+                    if created:
+                        self.migrated += 1
+                    return qp
+        return self.upsert_item(user_id)[0]
+
+    def fetch_item(self, user_id):
+        response = self.table().get_item(
+            Key={
+                'userID': user_id
+            }
+        )
+        qp = response.get('Item', {}).get('questPoint')
+        # Numbers come back as Decimal, which the rest of the skill and json do not expect
+        return int(qp) if qp is not None else None
 
-def text_walk_to_metal_cabinet():
-    return "You walk up to the metal cabinet beneath the computer terminal. " +\
-           text_prompt()
-
-# --------------- Texts Walk To Special
-
-def text_walk_to_qp4_end_northeast_statue():
-    return "You walk up to the statue in the north east corner. " \
-           "You see a red flash from the eyes of the raven statue. " \
-           "&atYou hear a noise and see a letter fall through the letter box. " +\
-           text_prompt()
-
-def text_walk_to_qp4_end_northwest_statue():
-    return "You walk up to the statue in the north west corner. " \
-           "You see a red flash from the eyes of the raven statue. " \
-           "&atYou hear a noise and see a letter fall through the letter box. " +\
-           text_prompt()
-
-def text_walk_to_qp4_end_southeast_statue():
-    return "You walk up to the statue in the south east corner. " \
-           "You see a red flash from the eyes of the raven statue. " \
-           "&atYou hear a noise and see a letter fall through the letter box. " +\
-           text_prompt()
-
-def text_walk_to_qp4_end_southwest_statue():
-    return "You walk up to the statue in the south west corner. " \
-           "You see a red flash from the eyes of the raven statue. " \
-           "&atYou hear a noise and see a letter fall through the letter box. " +\
-           text_prompt()
-
-# --------------- Texts Interact Non Special
-
-def text_interact_wall():
-    return "Which wall would you like to interact with? Your options are north, south, east and west."
-
-def text_interact_north_wall():
-    return "You knock on the north wall, the wall seems to be solid brick, you couldn't find any secrets. " +\
-           text_prompt()
-
-def text_interact_south_wall():
-    return "You knock on the south wall, the wall seems to be solid brick, you couldn't find any secrets. " +\
-           text_prompt()
-
-def text_interact_east_wall():
-    return "You knock on the east wall, the wall seems to be solid brick, you couldn't find any secrets. " +\
-           text_prompt()
-
-def text_interact_west_wall():
-    return "You knock on the west wall, the wall seems to be solid brick, you couldn't find any secrets. " +\
-           text_prompt()
-
-def text_interact_statue():
-    return "Which statue would you like to interact with? Your options are north east, north west, " \
-           "south east and south west."
-
-def text_interact_northeast_statue():
-    return "You knock on the north east statue, it appears to be hollow inside. " \
-           "You run your hand across the surface and find a seam. " \
-           "You try to open the statue at the seam but some sort of hidden locking mechanism is stopping you. " +\
-           text_prompt()
-
-def text_interact_northwest_statue():
-    return "You knock on the north west statue, it appears to be hollow inside. " \
-           "You run your hand across the surface and find a seam. " \
-           "You try to open the statue at the seam but some sort of hidden locking mechanism is stopping you. " +\
-           text_prompt()
-
-def text_interact_southeast_statue():
-    return "You knock on the south east statue, it appears to be hollow inside. " \
-           "You run your hand across the surface and find a seam. " \
-           "You try to open the statue at the seam but some sort of hidden locking mechanism is stopping you. " +\
-           text_prompt()
-
-def text_interact_southwest_statue():
-    return "You knock on the south west statue, it appears to be hollow inside. " \
-           "You run your hand across the surface and find a seam. " \
-           "You try to open the statue at the seam but some sort of hidden locking mechanism is stopping you. " +\
-           text_prompt()
-
-def text_interact_terminal():
-    return "Which Terminal would you like to interact with? Your options are north east, north west, " \
-            "south east and south west."
-
-def text_interact_northeast_computer_terminal():
-    return "You attempt to use the north east computer terminal, the computer seems to be not responding, " \
-           "you can't find anyway to fix it. " +\
-           text_prompt()
-
-def text_interact_northwest_computer_terminal():
-    return "You attempt to use the north west computer terminal, the computer seems to be not responding, " \
-           "you can't find anyway to fix it. " +\
-           text_prompt()
-
-def text_interact_southeast_computer_terminal():
-    return "You attempt to use the south east computer terminal, the computer seems to be not responding, " \
-           "you can't find anyway to fix it. " +\
-           text_prompt()
-
-def text_interact_southwest_computer_terminal():
-    return "You attempt to use the south west computer terminal, the computer seems to be not responding, " \
-           "you can't find anyway to fix it. " +\
-           text_prompt()
-
-def text_interact_central_computer_terminal():
-    return "You attempt to use the central computer terminal, the computer seems to be not responding, " \
-           "you can't find anyway to fix it. " +\
-           text_prompt()
-
-def text_interact_only_computer_terminal():
-    return "You attempt to use the computer terminal, the computer seems to be not responding, " \
-           "you can't find anyway to fix it. " +\
-           text_prompt()
-
-def text_interact_letter_box():
-    return "You kneel down, open the letter box and peer through. " \
-           "All you see is dark emptiness, it gives you the creeps so you close the letter box. " +\
-           text_prompt()
-
-def text_interact_metal_cabinet():
-    return "You attempt to open the metal cabinet. " \
-           "The cabinet is locked and the lock is stronger than it appears. " \
-           "You can't break the lock. " +\
-           text_prompt()
-
-# --------------- Texts Interact Special
-
-def text_interact_north_wall_qp2():
-    return "You knock on the north wall, you notice that the wall has some give to it. " \
-           "You give the north wall a firm push and it starts moving.&at " \
-           "The northeast and northwest statues move with the wall but the computer terminal remains. " \
-           "The wall locks into place leaving the room square and the computer terminal in the very centre. " \
-           "&atYou hear a noise and see a letter fall through the letter box. " +\
-           text_prompt()
-
-def text_interact_northeast_computer_terminal_qp6():
-    return "You press a button on the north east computer terminal and some text appears, it reads, " \
-           "I hope to be a great father someday. " \
-           "Two options appear on screen. " \
-           "One. " \
-           "I'm sure you will. " \
-           "And two. " \
-           "You will never have children. " \
-           "Which option would you like to choose? Option one or two?"
-
-def text_interact_northwest_computer_terminal_qp6():
-    return "You press a button on the north west computer terminal and some text appears, it reads, " \
-           "I want to be remembered, looked back upon as part of history. " \
-           "Two options appear on screen. " \
-           "One. " \
-           "Your grave will hold a meaningless name. " \
-           "And two. " \
-           "With enough work, you can do this. " \
-           "Which option would you like to choose? Option one or two?"
-
-def text_interact_southeast_computer_terminal_qp6():
-    return "You press a button on the south east computer terminal and some text appears, it reads, " \
-           "As long as I can continue helping people, I will be happy. " \
-           "Two options appear on screen. " \
-           "One. " \
-           "A helping hand is always needed. " \
-           "And two. " \
-           "You can't even help yourself. " \
-           "Which option would you like to choose? Option one or two?"
-
-def text_interact_southwest_computer_terminal_qp6():
-    return "You press a button on the south west computer terminal and some text appears, it reads, " \
-           "I want to create something brand new and advance mankind. " \
-           "Two options appear on screen. " \
-           "One. " \
-           "Everything that can be done, has already been done. " \
-           "And two. " \
-           "Think outside the box, I believe in you. " \
-           "Which option would you like to choose? Option one or two?"
-
-def text_interact_northeast_computer_terminal_qp6_help():
-    return "Two options appear on screen. " \
-           "One. " \
-           "I'm sure you will. " \
-           "And two. " \
-           "You will never have children. " \
-           "Say, one, to select option one. Say, two, to select option two."
-
-def text_interact_northwest_computer_terminal_qp6_help():
-    return "Two options appear on screen. " \
-           "One. " \
-           "Your grave will hold a meaningless name. " \
-           "And two. " \
-           "With enough work, you can do this. " \
-           "Say, one, to select option one. Say, two, to select option two."
-
-def text_interact_southeast_computer_terminal_qp6_help():
-    return "Two options appear on screen. " \
-           "One. " \
-           "A helping hand is always needed. " \
-           "And two. " \
-           "You can't even help yourself. " \
-           "Say, one, to select option one. Say, two, to select option two."
-
-def text_interact_southwest_computer_terminal_qp6_help():
-    return "Two options appear on screen. " \
-           "One. " \
-           "Everything that can be done, has already been done. " \
-           "And two. " \
-           "Think outside the box, I believe in you. " \
-           "Say, one, to select option one. Say, two, to select option two."
-
-def text_interact_only_computer_terminal_qp0():
-    return "You press a button on the computer terminal and some text appears, it reads, " \
-           "Escape your prison. " \
-           "The computer seems to have stopped responding to your input. " \
-           "&atYou hear a noise and see a letter fall through the letter box. " \
-           "Say read, to read the letter. " +\
-           text_prompt()
-
-# --------------- Texts Options
-
-def text_option_northeast_computer_terminal_a():
-    return "Text appears on the screen. It reads, " \
-           "Thank you so much for your support. " \
-           "A pixelated smiley face appears on screen. "
-
-def text_option_northeast_computer_terminal_b():
-    return "Text appears on the screen. It reads, " \
-           "I feel awful! Why would you say that? " \
-           "A pixelated sad face appears on screen, " \
-           "the computer terminal seems to have stopped responding. "
-
-def text_option_northwest_computer_terminal_a():
-    return "Text appears on the screen. It reads, " \
-           "That is my greatest fear, I cannot cope with that. " \
-           "A pixelated sad face appears on screen, "
-
-def text_option_northwest_computer_terminal_b():
-    return "Text appears on the screen. It reads, " \
-           "I will work my hardest, thank you. " \
-           "A pixelated smiley face appears on screen. "
-
-def text_option_southeast_computer_terminal_a():
-    return "Text appears on the screen. It reads, " \
-           "I believe so too, if you need anything let me know. " \
-           "A pixelated smiley face appears on screen. "
-
-def text_option_southeast_computer_terminal_b():
-    return "Text appears on the screen. It reads, " \
-           "Why must I be punished for my selflessness? " \
-           "A pixelated sad face appears on screen, " \
-           "the computer terminal seems to have stopped responding. "
-
-def text_option_southwest_computer_terminal_a():
-    return "Text appears on the screen. It reads, " \
-           "I'm not unique. what is the point of anything? " \
-           "A pixelated sad face appears on screen, " \
-           "the computer terminal seems to have stopped responding. "
-
-def text_option_southwest_computer_terminal_b():
-    return "Text appears on the screen. It reads, " \
-           "Thank you so much, have a great day! " \
-           "A pixelated smiley face appears on screen. "
-
-def text_option_non_end_northeast_computer_terminal_a():
-    return text_option_northeast_computer_terminal_a() + \
-           text_prompt()
-
-def text_option_non_end_northeast_computer_terminal_b():
-    return text_option_northeast_computer_terminal_b() + \
-           text_prompt()
-
-def text_option_non_end_northwest_computer_terminal_a():
-    return text_option_northwest_computer_terminal_a() + \
-           text_prompt()
-
-def text_option_non_end_northwest_computer_terminal_b():
-    return text_option_northwest_computer_terminal_b() + \
-           text_prompt()
-
-def text_option_non_end_southeast_computer_terminal_a():
-    return text_option_southeast_computer_terminal_a() + \
-           text_prompt()
-
-def text_option_non_end_southeast_computer_terminal_b():
-    return text_option_southeast_computer_terminal_b() + \
-           text_prompt()
-
-def text_option_non_end_southwest_computer_terminal_a():
-    return text_option_southwest_computer_terminal_a() + \
-           text_prompt()
-
-def text_option_non_end_southwest_computer_terminal_b():
-    return text_option_southwest_computer_terminal_b() + \
-           text_prompt()
-
-def text_option_end_northeast_computer_terminal_b():
-    return text_option_northeast_computer_terminal_b() + \
-           "All the corner computers start making beeping noises.&at " \
-           "&atYou hear a noise and see a letter fall through the letter box. " + \
-           text_prompt()
-
-def text_option_end_northwest_computer_terminal_a():
-    return text_option_northwest_computer_terminal_a() + \
-           "All the corner computers start making beeping noises.&at " \
-           "&atYou hear a noise and see a letter fall through the letter box. " + \
-           text_prompt()
-
-def text_option_end_southeast_computer_terminal_b():
-    return text_option_southeast_computer_terminal_b() + \
-           "All the corner computers start making beeping noises.&at " \
-           "&atYou hear a noise and see a letter fall through the letter box. " + \
-           text_prompt()
-
-def text_option_end_southwest_computer_terminal_a():
-    return text_option_southwest_computer_terminal_a() + \
-           "All the corner computers start making beeping noises.&at " \
-           "&atYou hear a noise and see a letter fall through the letter box. " + \
-           text_prompt()
-
-# --------------- Texts Letters
-
-def text_interact_letter_qp2():
-    return "You bend down and pick up the letter. It reads, " \
-           "Better yourself, push your boundaries. " +\
-           text_prompt()
-
-def text_interact_letter_qp4():
-    return "You bend down and pick up the latest letter. It reads, " \
-           "Prepare yourself, take a lap to clear your head. " +\
-           text_prompt()
-
-def text_interact_letter_qp6():
-    return "You bend down and pick up the latest letter. It reads, " \
-           "Frame yourself, act uncharacteristically for perspective. " +\
-           text_prompt()
-
-def text_interact_letter_qp8():
-    return "You bend down and pick up the latest letter. It reads, " \
-           "Remove yourself, take a break from what you're doing. " +\
-           text_prompt()
-
-def text_interact_letter_qp2_first_time():
-    return "You bend down and pick up the letter. It reads, " \
-           "Better yourself, push your boundaries. " \
-           "&atYou hear a sharp click but you can't tell where it came from. " +\
-           text_prompt()
-
-def text_interact_letter_qp6_first_time():
-    return "You bend down and pick up the latest letter. It reads, " \
-           "Frame yourself, act uncharacteristically for perspective. " \
-           "Suddenly the four statues starting moving loudly&at, they unfurled revealing four computer terminals in " \
-           "northeast, southeast, northwest and southwest corners of the room. " +\
-           text_prompt()
-
-def text_end():
-    if locale_gb():
-        return "You bend down and pick up the latest letter. It reads, " \
-               "Believe in yourself, it's time to go. " \
-               "You hear a noise, the cabinet under the central computer terminal opens, " \
-               "revealing a ladder leading underground. " \
-               "You start climbing down but your foot slips. " \
-               "You tumble down the ladder, although bewildered, you are unharmed. " \
-               "You look around to find yourself on the floor of your own house, " \
-               "a ladder leading up to your loft rests in front of you. " \
-               "You look up the ladder to find the room nowhere to be found. " \
-               "You suddenly remember that you've got an exam to sit, you forget about the room and start getting ready. " \
-               "The end. " \
-               "Please let people know what you thought by leaving a review of the skill on the Amazon store. " \
-               "Thank you for playing Puzzle Prison.&at "
+    def upsert_item(self, user_id, qp=0):
+        # One conditional write both creates new users at qp and repairs out of range quest points.
+        # Valid existing users fail the condition and the stored item is returned with the error.
+        try:
+            response = self.table().update_item(
+                Key={
+                    'userID': user_id
+                },
+                UpdateExpression="set questPoint=:q, lastUpdate=:u",
+                ConditionExpression="attribute_not_exists(questPoint) or questPoint < :zero or questPoint > :max",
+                ExpressionAttributeValues={
+                    ':q': qp,
+                    ':zero': 0,
+                    ':max': 10,
+                    ':u': today()
+                },
+                ReturnValues="ALL_OLD",
+                ReturnValuesOnConditionCheckFailure="ALL_OLD"
+            )
+            return qp, 'questPoint' not in response.get('Attributes', {})
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException' and 'Item' in e.response:
+                return int(database_deserializer.deserialize(e.response['Item']['questPoint'])), False
+            else:
+                raise
+
+    def scan_segment(self, segment, total_segments):
+        arguments = {'Segment': segment, 'TotalSegments': total_segments}
+        while True:
+            response = self.table().scan(**arguments)
+            for item in response.get('Items', []):
+                yield item
+            if 'LastEvaluatedKey' not in response:
+                break
+            arguments['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def write_items(self, items):
+        # batch_writer sends BatchWriteItem requests of up to 25 items and resends unprocessed ones
+        with self.table().batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+
+    def insert_items(self, items):
+        # BatchWriteItem has no conditions, so each copy is its own conditional put
+        inserted = 0
+        for item in items:
+            try:
+                self.table().put_item(Item=item, ConditionExpression="attribute_not_exists(userID)")
+                inserted += 1
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                    raise
+        return inserted
+
+    def missing_items(self, items):
+        missing = []
+        for item in items:
+            response = self.table().get_item(
+                Key={
+                    'userID': item['userID']
+                },
+                ProjectionExpression="userID"
+            )
+            if 'Item' not in response:
+                missing.append(item)
+        return missing
+
+    def repair_items(self, repairs):
+        # Conditional on the scanned quest point, so progress saved since the scan is left alone
+        repaired = 0
+        for scanned_qp, item in repairs:
+            values = {
+                ':q': item['questPoint'],
+                ':u': item['lastUpdate']
+            }
+            if scanned_qp is None:
+                condition = "attribute_exists(userID) and attribute_not_exists(questPoint)"
+            else:
+                condition = "questPoint = :scanned"
+                values[':scanned'] = scanned_qp
+            try:
+                self.table().update_item(
+                    Key={
+                        'userID': item['userID']
+                    },
+                    UpdateExpression="set questPoint=:q, lastUpdate=:u",
+                    ConditionExpression=condition,
+                    ExpressionAttributeValues=values
+                )
+                repaired += 1
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                    raise
+        return repaired
+
+class MemoryQuestPointStore(QuestPointStore):
+    """ In-process stand-in for benchmarks and load tests """
+
+    name = "memory"
+
+    def __init__(self):
+        QuestPointStore.__init__(self)
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def save_item(self, user_id, qp, touch):
+        with self.lock:
+            item = self.items.get(user_id)
+            if item is not None and qp != 0 and valid_quest_point(item['questPoint']) and item['questPoint'] > qp:
+                return False
+            if touch or item is None:
+                self.items[user_id] = {'questPoint': qp, 'lastUpdate': today()}
+            else:
+                self.items[user_id] = {'questPoint': qp, 'lastUpdate': item['lastUpdate']}
+            return True
+
+    def load_item(self, user_id):
+        with self.lock:
+            item = self.items.get(user_id)
+            if item is None or not valid_quest_point(item['questPoint']):
+                item = self.items[user_id] = {'questPoint': 0, 'lastUpdate': today()}
+            return item['questPoint']
+
+    def scan_segment(self, segment, total_segments):
+        with self.lock:
+            snapshot = list(self.items.items())
+        for user_id, item in snapshot:
+            if zlib.crc32(user_id.encode('utf-8')) % total_segments == segment:
+                yield {'userID': user_id, 'questPoint': item['questPoint'], 'lastUpdate': item['lastUpdate']}
+
+    def write_items(self, items):
+        with self.lock:
+            for item in items:
+                self.items[item['userID']] = {'questPoint': item['questPoint'], 'lastUpdate': item['lastUpdate']}
+
+    def insert_items(self, items):
+        inserted = 0
+        with self.lock:
+            for item in items:
+                if item['userID'] not in self.items:
+                    self.items[item['userID']] = {'questPoint': item['questPoint'], 'lastUpdate': item['lastUpdate']}
+                    inserted += 1
+        return inserted
+
+    def missing_items(self, items):
+        with self.lock:
+            return [item for item in items if item['userID'] not in self.items]
+
+    def repair_items(self, repairs):
+        repaired = 0
+        with self.lock:
+            for scanned_qp, item in repairs:
+                stored = self.items.get(item['userID'])
+                if stored is not None and stored['questPoint'] == scanned_qp:
+                    self.items[item['userID']] = {'questPoint': item['questPoint'], 'lastUpdate': item['lastUpdate']}
+                    repaired += 1
+        return repaired
+
+class SQLiteQuestPointStore(QuestPointStore):
+    """ Local file stand-in using SQLite in WAL mode """
+
+    name = "sqlite"
+
+    @property
+    def errors(self):
+        return (sqlite3.Error,)
+
+    def is_throttle(self, error):
+        return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+    def __init__(self, path):
+        global sqlite3
+        import sqlite3
+        QuestPointStore.__init__(self)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("pragma journal_mode=wal")
+        self.connection.execute("pragma synchronous=normal")
+        self.connection.execute(
+            "create table if not exists " + DATABASE_TABLE_NAME +
+            " (userID text primary key, questPoint integer not null, lastUpdate text not null)"
+        )
+
+    def save_item(self, user_id, qp, touch):
+        update = "questPoint=excluded.questPoint, lastUpdate=excluded.lastUpdate" if touch else "questPoint=excluded.questPoint"
+        with self.lock:
+            before = self.connection.total_changes
+            self.connection.execute(
+                "insert into " + DATABASE_TABLE_NAME + " (userID, questPoint, lastUpdate) values (?, ?, ?) "
+                "on conflict(userID) do update set " + update + " "
+                "where excluded.questPoint = 0 or questPoint <= excluded.questPoint or questPoint < 0 or questPoint > 10",
+                (user_id, qp, today())
+            )
+            return self.connection.total_changes > before
+
+    def load_item(self, user_id):
+        with self.lock:
+            self.connection.execute("begin immediate")
+            try:
+                self.connection.execute(
+                    "insert into " + DATABASE_TABLE_NAME + " (userID, questPoint, lastUpdate) values (?, 0, ?) "
+                    "on conflict(userID) do update set questPoint=0, lastUpdate=excluded.lastUpdate "
+                    "where questPoint < 0 or questPoint > 10",
+                    (user_id, today())
+                )
+                row = self.connection.execute(
+                    "select questPoint from " + DATABASE_TABLE_NAME + " where userID=?", (user_id,)
+                ).fetchone()
+                self.connection.execute("commit")
+            except sqlite3.Error:
+                self.connection.execute("rollback")
+                raise
+            return row[0]
+
+    def scan_segment(self, segment, total_segments):
+        with self.lock:
+            rows = self.connection.execute(
+                "select userID, questPoint, lastUpdate from " + DATABASE_TABLE_NAME + " where rowid % ? = ?",
+                (total_segments, segment)
+            ).fetchall()
+        for row in rows:
+            yield {'userID': row[0], 'questPoint': row[1], 'lastUpdate': row[2]}
+
+    def write_items(self, items):
+        with self.lock:
+            self.connection.execute("begin immediate")
+            try:
+                self.connection.executemany(
+                    "insert or replace into " + DATABASE_TABLE_NAME + " (userID, questPoint, lastUpdate) values (?, ?, ?)",
+                    [(item['userID'], item['questPoint'], item['lastUpdate']) for item in items]
+                )
+                self.connection.execute("commit")
+            except sqlite3.Error:
+                self.connection.execute("rollback")
+                raise
+
+    def insert_items(self, items):
+        with self.lock:
+            before = self.connection.total_changes
+            self.connection.execute("begin immediate")
+            try:
+                self.connection.executemany(
+                    "insert or ignore into " + DATABASE_TABLE_NAME + " (userID, questPoint, lastUpdate) values (?, ?, ?)",
+                    [(item['userID'], item['questPoint'], item['lastUpdate']) for item in items]
+                )
+                self.connection.execute("commit")
+            except sqlite3.Error:
+                self.connection.execute("rollback")
+                raise
+            return self.connection.total_changes - before
+
+    def missing_items(self, items):
+        with self.lock:
+            return [item for item in items if self.connection.execute(
+                "select 1 from " + DATABASE_TABLE_NAME + " where userID=?", (item['userID'],)
+            ).fetchone() is None]
+
+    def repair_items(self, repairs):
+        with self.lock:
+            before = self.connection.total_changes
+            self.connection.execute("begin immediate")
+            try:
+                self.connection.executemany(
+                    "update " + DATABASE_TABLE_NAME + " set questPoint=?, lastUpdate=? where userID=? and questPoint is ?",
+                    [(item['questPoint'], item['lastUpdate'], item['userID'], scanned_qp) for scanned_qp, item in repairs]
+                )
+                self.connection.execute("commit")
+            except sqlite3.Error:
+                self.connection.execute("rollback")
+                raise
+            return self.connection.total_changes - before
+
+def create_quest_point_store(backend, region=None):
+    if backend == "dynamodb":
+        if region is None or region == LEGACY_REGION:
+            return DynamoDBQuestPointStore(region)
+        else:
+            return DynamoDBQuestPointStore(region, DynamoDBQuestPointStore(LEGACY_REGION))
+    elif backend == "memory":
+        return MemoryQuestPointStore()
+    elif backend == "sqlite":
+        return SQLiteQuestPointStore(SQLITE_PATH)
     else:
-        return "You bend down and pick up the latest letter. It reads, " \
-               "Believe in yourself, it's time to go. " \
-               "You hear a noise, the cabinet under the central computer terminal opens, " \
-               "revealing a ladder leading underground. " \
-               "You start climbing down but your foot slips. " \
-               "You tumble down the ladder, although bewildered, you are unharmed. " \
-               "You look around to find yourself on the floor of your own house, " \
-               "a ladder leading up to your attic rests in front of you. " \
-               "You look up the ladder to find the room nowhere to be found. " \
-               "You suddenly remember that you've got an exam to sit, you forget about the room and start getting ready. " \
-               "The end. " \
-               "Please let people know what you thought by leaving a review of the skill on the Amazon store. " \
-               "Thank you for playing Puzzle Prison.&at "
-
-# --------------- Texts Events and Help
-
-def text_instructions():
-    return "Say, walk to, followed by something in the room to move towards that object. " \
-           "Say, interact with, followed by something in the room to use that object. " \
-           "Say help, to hear these instructions again at any point during the game. " \
-           "Say repeat, to get an overview of the room and say stop, to stop playing. "
-
-def text_instructions_first_time():
-    return text_instructions()
-
-def text_play_again():
-    return "You are already playing. To restart say, replay. For instructions on how to play say, help. " +\
-           text_prompt()
-
-def text_play_again_options():
-    return "You are already playing. To restart say, replay. For instructions on how to play say, help. " +\
-           text_options_prompt()
-
-def text_qp0_start():
-    return "Welcome to puzzle prison. " + \
-           text_instructions_first_time() + \
-           "The room has four walls but no doors. " \
-           "The room is rectangular with the east and west walls half the length of the north and south walls. " \
-           "There are four raven statues in the northeast, northwest, southeast and southwest corners of the room. " \
-           "A single computer terminal resting atop a locked metal cabinet sits beside the centre of the north wall. " \
-           "In the centre of the south wall resides a single letter box. " +\
-           text_prompt()
-
-def text_qp0_overview():
-    return "You are in a rectangular room with four walls north, south, east and west. " \
-           "There are four raven statues in the northeast, northwest, southeast and southwest corners of the room. " \
-           "A computer terminal resting atop a locked metal cabinet sits beside the centre of the north wall. " \
-           "In the centre of the south wall resides a single letter box. " +\
-           text_prompt()
-
-def text_qp0_repeat():
-    return "You awake to find yourself in a room. " + \
-           text_qp0_overview()
-
-def text_qp0_help():
-    return text_instructions() + \
-           text_qp0_overview()
-
-def text_qp1_overview():
-    return "You are in a rectangular room with four walls north, south, east and west. " \
-           "There are four raven statues in the northeast, northwest, southeast and southwest corners of the room. " \
-           "A computer terminal resting atop a locked metal cabinet sits beside the centre of the north wall. " \
-           "In the centre of the south wall resides a single letter box. " \
-           "A letter has just been posted through the box and rests on the floor. " +\
-           text_prompt()
-
-def text_qp1_start():
-    return "Welcome back to puzzle prison. " + \
-           text_qp1_overview()
-
-def text_qp1_repeat():
-    return text_qp1_overview()
-
-def text_qp1_help():
-    return text_instructions() + \
-           text_qp1_overview()
-
-def text_qp2_overview():
-    return text_qp1_overview()
-
-def text_qp2_start():
-    return "Welcome back to puzzle prison. " + \
-           text_qp2_overview()
-
-def text_qp2_repeat():
-    return text_qp2_overview()
-
-def text_qp2_help():
-    return text_instructions() + \
-           text_qp2_overview()
-
-def text_qp3_overview():
-    return "You are in a square room with four walls north, south, east and west. " \
-           "There are four raven statues in the northeast, northwest, southeast and southwest corners of the room. " \
-           "A computer terminal resting atop a locked metal cabinet sits in the centre of the room. " \
-           "In the centre of the south wall resides a single letter box. " \
-           "A letter has just been posted through the box and rests on the floor. " +\
-           text_prompt()
-
-def text_qp3_start():
-    return "Welcome back to puzzle prison. " + \
-           text_qp3_overview()
-
-def text_qp3_repeat():
-    return text_qp3_overview()
-
-def text_qp3_help():
-    return text_instructions() + \
-           text_qp3_overview()
-
-def text_qp4_overview():
-    return text_qp3_overview()
-
-def text_qp4_start():
-    return "Welcome back to puzzle prison. " + \
-           text_qp4_overview()
-
-def text_qp4_repeat():
-    return text_qp4_overview()
-
-def text_qp4_help():
-    return text_instructions() + \
-           text_qp4_overview()
-
-def text_qp5_overview():
-    return text_qp3_overview()
-
-def text_qp5_start():
-    return "Welcome back to puzzle prison. " + \
-           text_qp5_overview()
-
-def text_qp5_repeat():
-    return text_qp5_overview()
-
-def text_qp5_help():
-    return text_instructions() + \
-           text_qp5_overview()
+        raise ValueError("Unknown storage backend " + backend)
+
+# --------------- Write Behind
+
+def StageQuestPoint(session, qp):
+    # Progress rides along in the session attributes until the session ends
+    global pending_quest_point
+    if quest_point_unknown:
+        pending_quest_point = None
+        return
+    # Held progress is still this container's latest quest point for the user
+    quest_point_cache.set(session['user']['userId'], qp)
+    if qp == loaded_quest_point:
+        pending_quest_point = None
+    else:
+        pending_quest_point = qp
+
+def FlushQuestPoint(session):
+    # The session cannot carry the quest point any further, a write that fails here loses it
+    global pending_quest_point
+    if pending_quest_point is not None:
+        qp = pending_quest_point
+        pending_quest_point = None
+        # Bounded by the deadline like any other save, one left undone here is lost too
+        WriteQuestPoint(session, qp)
+        if pending_quest_point is not None:
+            pending_quest_point = None
+            storage_metrics["lostWrites"] += 1
+            log_warning('Quest Point Lost', "quest point " + str(qp) + " was not saved")
+
+def carry_pending_quest_point(session, response):
+    # The only place held quest points are flushed, once a response ends the session or SessionEndedRequest arrives
+    if response is None or response['response']['shouldEndSession']:
+        FlushQuestPoint(session)
+    elif pending_quest_point is not None or quest_point_unknown:
+        response['sessionAttributes'] = with_storage_state(response['sessionAttributes'], pending_quest_point,
+                                                           quest_point_unknown)
 
-def text_qp6_overview():
-    return "You are in a square room with four walls north, south, east and west. " \
-           "There are four computer terminals in the northeast, northwest, southeast and southwest corners of the room. " \
-           "A fifth computer terminal resting atop a locked metal cabinet sits in the centre of the room. " \
-           "In the centre of the south wall resides a single letter box. " \
-           "A letter has just been posted through the box and rests on the floor. " +\
-           text_prompt()
+# --------------- Custom Slots
 
-def text_qp6_start():
-    return "Welcome back to puzzle prison. " + \
-           text_qp6_overview()
+def get_object_slot(intent):
+    if intent.get('slots', {}) and 'object' in intent['slots'] and 'value' in intent['slots']['object']:
+        return intent['slots']['object']['value']
+    else:
+        return ""
 
-def text_qp6_repeat():
-    return text_qp6_overview()
+def get_option_slot(intent):
+    if intent.get('slots', {}) and 'option' in intent['slots'] and 'value' in intent['slots']['option']:
+        return intent['slots']['option']['value']
+    else:
+        return ""
 
-def text_qp6_help():
-    return text_instructions() + \
-           text_qp6_overview()
+# --------------- Objects
+
+# Every value of the object slot in Custom_Slots_Object.txt, by the object it means
+OBJECT_SYNONYMS = {
+    "north wall": ("north wall", "north"),
+    "south wall": ("south wall", "south"),
+    "east wall": ("east wall", "east"),
+    "west wall": ("west wall", "west"),
+    "wall": ("wall",),
+    "letter": ("letter",),
+    "letter box": ("letter box",),
+    "metal cabinet": ("metal cabinet", "cabinet"),
+    "northeast terminal": ("northeast terminal", "northeast computer"),
+    "northwest terminal": ("northwest terminal", "northwest computer"),
+    "southeast terminal": ("southeast terminal", "southeast computer"),
+    "southwest terminal": ("southwest terminal", "southwest computer"),
+    "central terminal": ("central terminal", "central computer"),
+    "terminal": ("terminal", "computer", "computer terminal"),
+    "northeast statue": ("northeast statue", "northeast raven"),
+    "northwest statue": ("northwest statue", "northwest raven"),
+    "southeast statue": ("southeast statue", "southeast raven"),
+    "southwest statue": ("southwest statue", "southwest raven"),
+    "statue": ("statue", "raven"),
+    "northeast": ("northeast", "northeast corner"),
+    "northwest": ("northwest", "northwest corner"),
+    "southeast": ("southeast", "southeast corner"),
+    "southwest": ("southwest", "southwest corner"),
+}
+
+TERMINALS = ("northeast terminal", "northwest terminal", "southeast terminal", "southwest terminal",
+             "central terminal", "terminal")
+STATUES = ("northeast statue", "northwest statue", "southeast statue", "southwest statue", "statue")
+CORNERS = ("northeast", "northwest", "southeast", "southwest")
+
+# Unknown values are corrected to the closest synonym within this edit distance, longer values allow more
+OBJECT_MAX_DISTANCE = ((5, 1), (12, 2))
+OBJECT_LONG_MAX_DISTANCE = 3
+OBJECT_CORRECTION_CACHE_SIZE = 1024
+
+def normalise_object(value):
+    words = value.lower().split()
+    if words and words[0] == "the":
+        words = words[1:]
+    return " ".join(words)
+
+def build_object_index():
+    """ Synonym to canonical object, canonical objects map to themselves """
+    index = {}
+    for obj, synonyms in OBJECT_SYNONYMS.items():
+        index[obj] = obj
+        for synonym in synonyms:
+            if index.get(synonym, obj) != obj:
+                raise ValueError(synonym + " means both " + index[synonym] + " and " + obj)
+            index[synonym] = obj
+    return index
+
+object_index = build_object_index()
+object_corrections = {}
+object_slot_metrics = {
+    "resolved": 0,
+    "corrected": 0,
+    "missed": 0,
+}
+
+def edit_distance(a, b, limit):
+    """ Levenshtein distance, or limit + 1 once it is known to be more than limit """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+def max_object_distance(value):
+    for length, distance in OBJECT_MAX_DISTANCE:
+        if len(value) <= length:
+            return distance
+    return OBJECT_LONG_MAX_DISTANCE
+
+def correct_object(value):
+    """ The object of the only closest synonym within the allowed distance, otherwise None """
+    limit = max_object_distance(value)
+    best = None
+    best_distance = limit + 1
+    for synonym, obj in object_index.items():
+        distance = edit_distance(value, synonym, limit)
+        if distance < best_distance:
+            best, best_distance = obj, distance
+        elif distance == best_distance and best is not None and obj != best:
+            # Equally close to two objects, guessing could send the player the wrong way
+            best = None
+    return best
+
+def resolve_object(value):
+    """ Canonical object of an object slot value, or None when nothing is close enough """
+    key = normalise_object(value)
+    obj = object_index.get(key)
+    if obj is not None:
+        object_slot_metrics["resolved"] += 1
+        return obj
+    if not key:
+        object_slot_metrics["missed"] += 1
+        return None
+
+    if key in object_corrections:
+        obj = object_corrections[key]
+    else:
+        obj = correct_object(key)
+        if len(object_corrections) >= OBJECT_CORRECTION_CACHE_SIZE:
+            object_corrections.clear()
+        object_corrections[key] = obj
+    if obj is None:
+        object_slot_metrics["missed"] += 1
+    else:
+        object_slot_metrics["corrected"] += 1
+    return obj
+
+def object_slot_report():
+    report = dict(object_slot_metrics)
+    report["cachedCorrections"] = len(object_corrections)
+    return report
+
+# --------------- Session State
+
+# Session attribute holding the packed state
+SESSION_STATE_KEY = "State"
+# Length of the JSON encoding of packed attributes, less the digits of the state
+PACKED_ATTRIBUTES_SIZE = encoded_size({SESSION_STATE_KEY: 0}) - 1
+
+# The statues in the order the lap goes round, laps can go either way
+LAP_CYCLE = "ABCD"
+
+def lap_progress_values():
+    """ Every partial lap, the empty string first """
+    values = [""]
+    for length in range(1, len(LAP_CYCLE)):
+        for start in range(len(LAP_CYCLE)):
+            for step in (1, -1):
+                value = "".join([LAP_CYCLE[(start + step * index) % len(LAP_CYCLE)] for index in range(length)])
+                if value not in values:
+                    values.append(value)
+    return tuple(values)
+
+LAP_PROGRESS = lap_progress_values()
+
+# Every context build_attr is given
+CONTEXTS = (
+    "",
+    "north wall",
+    "south wall",
+    "east wall",
+    "west wall",
+    "letter",
+    "letter box",
+    "metal cabinet",
+    "central terminal",
+    "northeast terminal",
+    "northwest terminal",
+    "southeast terminal",
+    "southwest terminal",
+    "northeast statue",
+    "northwest statue",
+    "southeast statue",
+    "southwest statue",
+    "qp6_ne",
+    "qp6_nw",
+    "qp6_se",
+    "qp6_sw",
+)
+
+# Bit widths of the packed fields, from the lowest bits up: is playing, quest point, the SW, SE, NW
+# and NE terminals, lap progress, context, pending quest point (0 for none, otherwise one more) and
+# whether the quest point is unknown
+STATE_FIELD_BITS = (1, 4, 1, 1, 1, 1, 5, 5, 4, 1)
+
+lap_progress_index = dict((value, index) for index, value in enumerate(LAP_PROGRESS))
+context_index = dict((value, index) for index, value in enumerate(CONTEXTS))
+
+class SessionState(object):
+    """ The game state carried in the session attributes, read only once built """
+
+    __slots__ = ("quest_point", "lap", "ne", "nw", "se", "sw", "context", "is_playing", "pending_quest_point",
+                 "quest_point_unknown")
+
+    def __init__(self, quest_point, lap, ne, nw, se, sw, context, is_playing, pending_quest_point,
+                 quest_point_unknown=False):
+        set_field = object.__setattr__
+        set_field(self, "quest_point", quest_point)
+        set_field(self, "lap", lap)
+        set_field(self, "ne", ne)
+        set_field(self, "nw", nw)
+        set_field(self, "se", se)
+        set_field(self, "sw", sw)
+        set_field(self, "context", context)
+        set_field(self, "is_playing", is_playing)
+        set_field(self, "pending_quest_point", pending_quest_point)
+        set_field(self, "quest_point_unknown", quest_point_unknown)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SessionState is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("SessionState is immutable")
+
+EMPTY_SESSION_STATE = SessionState(None, 0, False, False, False, False, "", False, None)
+
+def is_small_int(value, bits):
+    return type(value) is int and 0 <= value < (1 << bits)
+
+def pack_session_state(state):
+    """ The state as one integer, or None if it has a value the packing cannot hold """
+    flags = (state.is_playing, state.sw, state.se, state.nw, state.ne, state.quest_point_unknown)
+    if any([type(flag) is not bool for flag in flags]):
+        return None
+    if state.pending_quest_point is None:
+        pending = 0
+    elif type(state.pending_quest_point) is int:
+        pending = state.pending_quest_point + 1
+    else:
+        return None
+    fields = (flags[0], state.quest_point) + flags[1:5] + \
+             (state.lap, context_index.get(state.context), pending, flags[5])
+
+    packed = 0
+    shift = 0
+    for field, bits in zip(fields, STATE_FIELD_BITS):
+        if not is_small_int(int(field) if type(field) is bool else field, bits):
+            return None
+        packed |= int(field) << shift
+        shift += bits
+    return packed
+
+def unpack_session_state(packed):
+    if not is_small_int(packed, sum(STATE_FIELD_BITS)):
+        return EMPTY_SESSION_STATE
+    fields = []
+    for bits in STATE_FIELD_BITS:
+        fields.append(packed & ((1 << bits) - 1))
+        packed >>= bits
+    is_playing, quest_point, sw, se, nw, ne, lap, context, pending, unknown = fields
+    if lap >= len(LAP_PROGRESS) or context >= len(CONTEXTS):
+        return EMPTY_SESSION_STATE
+    return SessionState(quest_point, lap, bool(ne), bool(nw), bool(se), bool(sw), CONTEXTS[context],
+                        bool(is_playing), pending - 1 if pending else None, bool(unknown))
+
+def legacy_attributes(state):
+    """ The state in the original attribute format, for states the packing cannot hold """
+    attributes = {
+        "QuestPoint": state.quest_point,
+        "Context": state.context,
+        "IsPlaying": state.is_playing,
+    }
+    if (state.quest_point == 4):
+        attributes["DiagProgress"] = LAP_PROGRESS[state.lap]
+    elif (state.quest_point == 6):
+        attributes["NE"] = state.ne
+        attributes["NW"] = state.nw
+        attributes["SE"] = state.se
+        attributes["SW"] = state.sw
+    if state.pending_quest_point is not None:
+        attributes["PendingQuestPoint"] = state.pending_quest_point
+    if state.quest_point_unknown:
+        attributes["QuestPointUnknown"] = True
+    return attributes
+
+def encode_session_state(state):
+    packed = pack_session_state(state)
+    if packed is None:
+        return legacy_attributes(state)
+    return {SESSION_STATE_KEY: packed}
+
+def decode_session_state(attributes):
+    """ Reads packed attributes and the original attribute format, as sent by sessions started before packing """
+    if not attributes:
+        return EMPTY_SESSION_STATE
+    packed = attributes.get(SESSION_STATE_KEY)
+    if packed is not None:
+        return unpack_session_state(packed)
+    return SessionState(
+        attributes.get("QuestPoint"),
+        # Progress the lap table does not know starts the lap again
+        lap_progress_index.get(attributes.get("DiagProgress", ""), 0),
+        attributes.get("NE", False),
+        attributes.get("NW", False),
+        attributes.get("SE", False),
+        attributes.get("SW", False),
+        attributes.get("Context", ""),
+        attributes.get("IsPlaying", False),
+        attributes.get("PendingQuestPoint"),
+        attributes.get("QuestPointUnknown", False),
+    )
 
-def text_qp7_overview():
-    return text_qp6_overview()
+def with_storage_state(attributes, qp, unknown):
+    state = decode_session_state(attributes)
+    return encode_session_state(SessionState(state.quest_point, state.lap, state.ne, state.nw, state.se, state.sw,
+                                             state.context, state.is_playing, qp, unknown))
 
-def text_qp7_start():
-    return "Welcome back to puzzle prison. " + \
-           text_qp7_overview()
+# --------------- Attributes
 
-def text_qp7_repeat():
-    return text_qp7_overview()
+def get_quest_point(session, state):
+    if state.quest_point is not None:
+        return state.quest_point
+    else:
+        return load_quest_point_once(session)
+
+def load_quest_point_once(session):
+    # Storage is only read when the session has no quest point, and at most once per request
+    global loaded_quest_point
+    if pending_quest_point is not None:
+        return pending_quest_point
+    if loaded_quest_point is None:
+        loaded_quest_point = LoadQuestPoint(session)
+    return loaded_quest_point
+
+def request_quest_point(state):
+    """ The quest point the request was handled at, without reading storage """
+    if state.quest_point is not None:
+        return state.quest_point
+    if state.pending_quest_point is not None:
+        return state.pending_quest_point
+    if quest_point_unknown:
+        return None
+    return loaded_quest_point
+
+def build_attr(qp, lap, NE, NW, SE, SW, context):
+    # Lap progress only matters at quest point 4 and the terminals only at 6
+    if (qp == 4):
+        state = SessionState(qp, lap, False, False, False, False, context, True, None)
+    elif (qp == 6):
+        state = SessionState(qp, 0, NE, NW, SE, SW, context, True, None)
+    else:
+        state = SessionState(qp, 0, False, False, False, False, context, True, None)
+    return encode_session_state(state)
 
-def text_qp7_help():
-    return text_instructions() + \
-           text_qp7_overview()
+# --------------- Texts
 
-def text_qp8_overview():
-    return text_qp6_overview()
+# One JSON catalog per locale mapping message ids to text, see Texts/en-US.json. The Texts
+# directory has to be deployed next to this file, the Lambda package needs both
+TEXTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Texts')
+DEFAULT_LOCALE = "en-US"
 
-def text_qp8_start():
-    return "Welcome back to puzzle prison. " \
-           "You awake from a well deserved break and look around the square room. " \
-           "&atYou hear a noise and see a letter fall through the letter box. " +\
-           text_prompt()
+def text_catalog_path(text_locale):
+    return os.path.join(TEXTS_DIRECTORY, text_locale + '.json')
 
-def text_qp8_repeat():
-    return text_qp8_overview()
+# Every other locale falls back to the default one, so without it no request could be answered
+if not os.path.exists(text_catalog_path(DEFAULT_LOCALE)):
+    raise ValueError("Text catalog " + text_catalog_path(DEFAULT_LOCALE) + " is missing, deploy Texts/ with the skill")
 
-def text_qp8_help():
-    return text_instructions() + \
-           text_qp8_overview()
+# Catalogs are only loaded once a locale is served
+text_catalogs = {}
 
-def text_qp9_overview():
-    return text_qp6_overview()
+def get_text(message_id):
+    return get_text_catalog(locale)[message_id]
 
-def text_qp9_start():
-    return "Welcome back to puzzle prison. " + \
-           text_qp9_overview()
+def get_text_catalog(text_locale):
+    catalog = text_catalogs.get(text_locale)
+    if catalog is None:
+        catalog = text_catalogs[text_locale] = load_text_catalog(text_locale or DEFAULT_LOCALE)
+    return catalog
 
-def text_qp9_repeat():
-    return text_qp9_overview()
+def load_text_catalog(text_locale):
+    """ Reads a locale's texts over those of its fallback locale.
 
-def text_qp9_help():
-    return text_instructions() + \
-           text_qp9_overview()
+    A locale without a catalog file, such as de-DE until it is translated, uses the default locale,
+    which must have one. Texts are interned and their response templates compiled as they are loaded.
+    """
+    path = text_catalog_path(text_locale)
+    if os.path.exists(path) or text_locale == DEFAULT_LOCALE:
+        with io.open(path, encoding='utf-8') as catalog_file:
+            source = json.load(catalog_file)
+        fallback = source.get('fallback')
+    else:
+        source = {'texts': {}}
+        fallback = DEFAULT_LOCALE
 
-def text_stop():
-    return "Your progress has been saved. Thank you for playing.&at"
+    if fallback and fallback != text_locale:
+        catalog = dict(get_text_catalog(fallback))
+    else:
+        catalog = {}
+    for message_id, message in source['texts'].items():
+        message = sys.intern(message)
+        catalog[sys.intern(message_id)] = message
+        get_response_template(message, message.count("&at"))
+    return catalog
 
 # --------------- Diag
 
+# The original string implementation of the lap, the lap table is checked against it at import
 def update_diag(diag, update):
     if len(diag) == 0:
         return update
@@ -1061,14 +1801,64 @@ def update_lap(diag, update):
     else:
         return [False, diag]
 
+def next_lap_progress(progress, corner):
+    """ Where a partial lap goes when the player walks to corner, and whether that finished the lap """
+    if not progress:
+        return (False, corner)
+    last = LAP_CYCLE.index(progress[-1])
+    step = LAP_CYCLE.index(corner) - last
+    if step == 0:
+        return (False, progress)
+    if len(progress) > 1:
+        # The lap keeps going the way the first two statues went
+        expected = (LAP_CYCLE.index(progress[1]) - LAP_CYCLE.index(progress[0])) % len(LAP_CYCLE)
+    else:
+        expected = None
+    step %= len(LAP_CYCLE)
+    if step not in (1, len(LAP_CYCLE) - 1) or (expected is not None and step != expected):
+        return (False, "")
+    if len(progress) + 1 == len(LAP_CYCLE):
+        return (True, "")
+    return (False, progress + corner)
+
+def build_lap_transitions():
+    """ (lap, corner) to (lap finished, next lap), laps being indexes into LAP_PROGRESS """
+    transitions = {}
+    for lap, progress in enumerate(LAP_PROGRESS):
+        for corner in LAP_CYCLE:
+            done, next_progress = next_lap_progress(progress, corner)
+            transitions[(lap, corner)] = (done, lap_progress_index[next_progress])
+    return transitions
+
+def check_lap_transitions(transitions):
+    """ Returns every (progress, corner) where the table and update_lap disagree """
+    problems = []
+    for lap, progress in enumerate(LAP_PROGRESS):
+        for corner in LAP_CYCLE:
+            done, next_lap = transitions[(lap, corner)]
+            expected = update_lap(progress, corner)
+            if [done, LAP_PROGRESS[next_lap]] != expected:
+                problems.append(repr(progress) + " + " + corner + " gives " + repr([done, LAP_PROGRESS[next_lap]]) +
+                                " not " + repr(expected))
+    return problems
+
+lap_transitions = build_lap_transitions()
+lap_transition_problems = check_lap_transitions(lap_transitions)
+if lap_transition_problems:
+    raise ValueError("Lap table differs from update_lap: " + "; ".join(lap_transition_problems))
+
+def advance_lap(lap, corner):
+    """ Returns (lap finished, next lap) """
+    return lap_transitions[(lap, corner)]
+
 # --------------- Intent Events
 
 def misunderstand_response(attr):
     return build_response(
         attr,
         [
-            text_title_misunderstand(),
-            text_misunderstand(),
+            get_text("title_misunderstand"),
+            get_text("misunderstand"),
             ""
         ]
     )
@@ -1077,419 +1867,111 @@ def error_response():
     return build_response(
         {},
         [
-            text_title_error(),
-            text_error(),
+            get_text("title_error"),
+            get_text("error"),
             ""
         ],
         False
     )
 
-def on_intent_start(session):
-    qp = get_quest_point(session)
-    is_playing = get_is_playing(session)
+# Quest point the game starts from, the title and text of the start and the clip played
+START_TRANSITIONS = {
+    0: (0, "title_start_qp0", "qp0_start", None),
+    1: (1, "title_start", "qp1_start", None),
+    2: (2, "title_start", "qp2_start", None),
+    3: (3, "title_start", "qp3_start", None),
+    4: (4, "title_start", "qp4_start", None),
+    5: (5, "title_start", "qp5_start", None),
+    6: (6, "title_start", "qp6_start", None),
+    7: (7, "title_start", "qp7_start", None),
+    8: (9, "title_start", "qp8_start", "letter_box"),
+    9: (9, "title_start", "qp9_start", None),
+}
+
+HELP_TEXTS = dict((qp, "qp" + str(qp) + "_help") for qp in range(10))
+OVERVIEW_TEXTS = dict((qp, "qp" + str(qp) + "_overview") for qp in range(10))
+
+TERMINAL_NAMES = {
+    "qp6_ne": "northeast",
+    "qp6_nw": "northwest",
+    "qp6_se": "southeast",
+    "qp6_sw": "southwest",
+}
+TERMINAL_HELP_TEXTS = dict((context, "interact_" + name + "_computer_terminal_qp6_help") for context, name in TERMINAL_NAMES.items())
+TERMINAL_OVERVIEW_TEXTS = dict((context, "interact_" + name + "_computer_terminal_qp6") for context, name in TERMINAL_NAMES.items())
+
+def on_intent_start(session, state):
+    qp = get_quest_point(session, state)
+    is_playing = state.is_playing
 
     if is_playing:
         attr = session['attributes']
-        if ("qp6_" in get_context(session)):
+        if ("qp6_" in state.context):
             return build_response(
                 attr,
                 [
-                    text_title_play_again(),
-                    text_play_again_options(),
-                    text_options_prompt()
+                    get_text("title_play_again"),
+                    get_text("play_again_options"),
+                    get_text("options_prompt")
                 ]
             )
         else:
             return build_response(
                 attr,
                 [
-                    text_title_play_again(),
-                    text_play_again(),
-                    text_prompt()
+                    get_text("title_play_again"),
+                    get_text("play_again"),
+                    get_text("prompt")
                 ]
             )
-    elif qp == 0:
-        return build_response(
-            build_attr(0, "", False, False, False, False, ""),
-            [
-                text_title_start_qp0(),
-                text_qp0_start(),
-                text_prompt()
-            ]
-        )
-    elif qp == 1:
-        return build_response(
-            build_attr(1, "", False, False, False, False, ""),
-            [
-                text_title_start(),
-                text_qp1_start(),
-                text_prompt()
-            ]
-        )
-    elif qp == 2:
-        return build_response(
-            build_attr(2, "", False, False, False, False, ""),
-            [
-                text_title_start(),
-                text_qp2_start(),
-                text_prompt()
-            ]
-        )
-    elif qp == 3:
-        return build_response(
-            build_attr(3, "", False, False, False, False, ""),
-            [
-                text_title_start(),
-                text_qp3_start(),
-                text_prompt()
-            ]
-        )
-    elif qp == 4:
-        return build_response(
-            build_attr(4, "", False, False, False, False, ""),
-            [
-                text_title_start(),
-                text_qp4_start(),
-                text_prompt()
-            ]
-        )
-    elif qp == 5:
-        return build_response(
-            build_attr(5, "", False, False, False, False, ""),
-            [
-                text_title_start(),
-                text_qp5_start(),
-                text_prompt()
-            ]
-        )
-    elif qp == 6:
-        return build_response(
-            build_attr(6, "", False, False, False, False, ""),
-            [
-                text_title_start(),
-                text_qp6_start(),
-                text_prompt()
-            ]
-        )
-    elif qp == 7:
-        return build_response(
-            build_attr(7, "", False, False, False, False, ""),
-            [
-                text_title_start(),
-                text_qp7_start(),
-                text_prompt()
-            ]
-        )
-    elif qp == 8:
-        SaveQuestPoint(session, 9)
-        return build_response(
-            build_attr(9, "", False, False, False, False, ""),
-            [
-                text_title_start(),
-                text_qp8_start(),
-                text_prompt(),
-                audio_letter_box()
-            ]
-        )
-    elif qp == 9:
-        return build_response(
-            build_attr(9, "", False, False, False, False, ""),
-            [
-                text_title_start(),
-                text_qp9_start(),
-                text_prompt()
-            ]
-        )
-    else:
-        return error_response()
 
-def on_intent_help(session):
-    qp = get_quest_point(session)
-    attr = session['attributes']
-
-    if qp == 0:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp0_help(),
-                text_prompt()
-            ]
-        )
-    elif qp == 1:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp1_help(),
-                text_prompt()
-            ]
-        )
-    elif qp == 2:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp2_help(),
-                text_prompt()
-            ]
-        )
-    elif qp == 3:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp3_help(),
-                text_prompt()
-            ]
-        )
-    elif qp == 4:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp4_help(),
-                text_prompt()
-            ]
-        )
-    elif qp == 5:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp5_help(),
-                text_prompt()
-            ]
-        )
-    elif qp == 6:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp6_help(),
-                text_prompt()
-            ]
-        )
-    elif qp == 7:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp7_help(),
-                text_prompt()
-            ]
-        )
-    elif qp == 8:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp8_help(),
-                text_prompt()
-            ]
-        )
-    elif qp == 9:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp9_help(),
-                text_prompt()
-            ]
-        )
-    else:
-        return error_response()
-
-def on_intent_repeat(session):
-    qp = get_quest_point(session)
-    attr = session['attributes']
-
-    if qp == 0:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp0_overview(),
-                text_prompt()
-            ]
-        )
-    elif qp == 1:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp1_overview(),
-                text_prompt()
-            ]
-        )
-    elif qp == 2:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp2_overview(),
-                text_prompt()
-            ]
-        )
-    elif qp == 3:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp3_overview(),
-                text_prompt()
-            ]
-        )
-    elif qp == 4:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp4_overview(),
-                text_prompt()
-            ]
-        )
-    elif qp == 5:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp5_overview(),
-                text_prompt()
-            ]
-        )
-    elif qp == 6:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp6_overview(),
-                text_prompt()
-            ]
-        )
-    elif qp == 7:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp7_overview(),
-                text_prompt()
-            ]
-        )
-    elif qp == 8:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp8_overview(),
-                text_prompt()
-            ]
-        )
-    elif qp == 9:
-        return build_response(
-            attr,
-            [
-                text_prompt(),
-                text_qp9_overview(),
-                text_prompt()
-            ]
-        )
-    else:
-        return error_response()
-
-def on_intent_help_on_terminal(session):
-    attr = session['attributes']
-    context = get_context(session)
-
-    if (context == "qp6_ne"):
-        return build_response(
-            attr,
-            [
-                text_options_prompt(),
-                text_interact_northeast_computer_terminal_qp6_help(),
-                text_options_prompt()
-            ]
-        )
-    elif (context == "qp6_nw"):
-        return build_response(
-            attr,
-            [
-                text_options_prompt(),
-                text_interact_northwest_computer_terminal_qp6_help(),
-                text_options_prompt()
-            ]
-        )
-    elif (context == "qp6_se"):
-        return build_response(
-            attr,
-            [
-                text_options_prompt(),
-                text_interact_southeast_computer_terminal_qp6_help(),
-                text_options_prompt()
-            ]
-        )
-    elif (context == "qp6_sw"):
-        return build_response(
-            attr,
-            [
-                text_options_prompt(),
-                text_interact_southwest_computer_terminal_qp6_help(),
-                text_options_prompt()
-            ]
-        )
-    else:
+    transition = START_TRANSITIONS.get(qp)
+    if transition is None:
         return error_response()
-
-def on_intent_repeat_on_terminal(session):
-    attr = session['attributes']
-    context = get_context(session)
-
-    if (context == "qp6_ne"):
-        return build_response(
-            attr,
-            [
-                text_options_prompt(),
-                text_interact_northeast_computer_terminal_qp6(),
-                text_options_prompt()
-            ]
-        )
-    elif (context == "qp6_nw"):
-        return build_response(
-            attr,
-            [
-                text_options_prompt(),
-                text_interact_northwest_computer_terminal_qp6(),
-                text_options_prompt()
-            ]
-        )
-    elif (context == "qp6_se"):
-        return build_response(
-            attr,
-            [
-                text_options_prompt(),
-                text_interact_southeast_computer_terminal_qp6(),
-                text_options_prompt()
-            ]
-        )
-    elif (context == "qp6_sw"):
-        return build_response(
-            attr,
-            [
-                text_options_prompt(),
-                text_interact_southwest_computer_terminal_qp6(),
-                text_options_prompt()
-            ]
-        )
-    else:
+    next_qp, title, text, clip = transition
+    if next_qp != qp:
+        SaveQuestPoint(session, next_qp)
+    response_text = [
+        get_text(title),
+        get_text(text),
+        get_text("prompt")
+    ]
+    if clip is not None:
+        response_text.append(get_audio(clip))
+    return build_response(build_attr(next_qp, 0, False, False, False, False, ""), response_text)
+
+def on_intent_help(session, state):
+    return prompt_response(session, HELP_TEXTS.get(get_quest_point(session, state)), "prompt")
+
+def on_intent_repeat(session, state):
+    return prompt_response(session, OVERVIEW_TEXTS.get(get_quest_point(session, state)), "prompt")
+
+def on_intent_help_on_terminal(session, state):
+    return prompt_response(session, TERMINAL_HELP_TEXTS.get(state.context), "options_prompt")
+
+def on_intent_repeat_on_terminal(session, state):
+    return prompt_response(session, TERMINAL_OVERVIEW_TEXTS.get(state.context), "options_prompt")
+
+def prompt_response(session, text, prompt):
+    """ Repeats text without changing the game, titled with the prompt """
+    if text is None:
         return error_response()
+    return build_response(
+        session['attributes'],
+        [
+            get_text(prompt),
+            get_text(text),
+            get_text(prompt)
+        ]
+    )
 
 def on_intent_startover():
     return build_response(
-        build_attr(0, "", False, False, False, False, ""),
+        build_attr(0, 0, False, False, False, False, ""),
         [
-            text_title_start_qp0(),
-            text_qp0_start(),
-            text_prompt()
+            get_text("title_start_qp0"),
+            get_text("qp0_start"),
+            get_text("prompt")
         ]
     )
 
@@ -1497,790 +1979,721 @@ def on_intent_stop():
     return build_response(
         {},
         [
-            text_title_stop(),
-            text_stop(),
+            get_text("title_stop"),
+            get_text("stop"),
             "",
-            audio_jingle()
+            get_audio("jingle")
         ],
         True
     )
 
-def on_intent_walk_terminal(session, obj):
-    qp = get_quest_point(session)
-    diag = get_diag_order(session)
-    NE = get_ne_complete(session)
-    NW = get_nw_complete(session)
-    SE = get_se_complete(session)
-    SW = get_sw_complete(session)
+def on_intent_walk_terminal(session, state, obj):
+    qp = get_quest_point(session, state)
+    lap = state.lap
+    NE = state.ne
+    NW = state.nw
+    SE = state.se
+    SW = state.sw
     attr = session['attributes']
 
     if qp < 6:
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "central terminal"),
+            build_attr(qp, lap, NE, NW, SE, SW, "central terminal"),
             [
-                text_title_walk_only_terminal(),
-                text_walk_to_only_computer_terminal(),
-                text_prompt()
+                get_text("title_walk_only_terminal"),
+                get_text("walk_to_only_computer_terminal"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "northeast terminal") or (obj == "northeast computer"):
+    elif (obj == "northeast terminal"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "northeast terminal"),
+            build_attr(qp, lap, NE, NW, SE, SW, "northeast terminal"),
             [
-                text_title_walk_northeast_terminal(),
-                text_walk_to_northeast_computer_terminal(),
-                text_prompt()
+                get_text("title_walk_northeast_terminal"),
+                get_text("walk_to_northeast_computer_terminal"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "northwest terminal") or (obj == "northwest computer"):
+    elif (obj == "northwest terminal"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "northwest terminal"),
+            build_attr(qp, lap, NE, NW, SE, SW, "northwest terminal"),
             [
-                text_title_walk_northwest_terminal(),
-                text_walk_to_northwest_computer_terminal(),
-                text_prompt()
+                get_text("title_walk_northwest_terminal"),
+                get_text("walk_to_northwest_computer_terminal"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "southeast terminal") or (obj == "southeast computer"):
+    elif (obj == "southeast terminal"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "southeast terminal"),
+            build_attr(qp, lap, NE, NW, SE, SW, "southeast terminal"),
             [
-                text_title_walk_southeast_terminal(),
-                text_walk_to_southeast_computer_terminal(),
-                text_prompt()
+                get_text("title_walk_southeast_terminal"),
+                get_text("walk_to_southeast_computer_terminal"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "southwest terminal") or (obj == "southwest computer"):
+    elif (obj == "southwest terminal"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "southwest terminal"),
+            build_attr(qp, lap, NE, NW, SE, SW, "southwest terminal"),
             [
-                text_title_walk_southwest_terminal(),
-                text_walk_to_southwest_computer_terminal(),
-                text_prompt()
+                get_text("title_walk_southwest_terminal"),
+                get_text("walk_to_southwest_computer_terminal"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "central terminal") or (obj == "central computer"):
+    elif (obj == "central terminal"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "central terminal"),
+            build_attr(qp, lap, NE, NW, SE, SW, "central terminal"),
             [
-                text_title_walk_central_terminal(),
-                text_walk_to_central_computer_terminal(),
-                text_prompt()
+                get_text("title_walk_central_terminal"),
+                get_text("walk_to_central_computer_terminal"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "terminal") or (obj == "computer") or (obj == "computer terminal"):
+    elif (obj == "terminal"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, get_context(session)),
+            build_attr(qp, lap, NE, NW, SE, SW, state.context),
             [
-                text_terminal_prompt(),
-                text_walk_to_terminal(),
-                text_terminal_prompt()
+                get_text("terminal_prompt"),
+                get_text("walk_to_terminal"),
+                get_text("terminal_prompt")
             ]
         )
     else:
         return misunderstand_response(attr)
 
-def on_intent_walk_statue(session, obj):
-    qp = get_quest_point(session)
-    diag = get_diag_order(session)
-    NE = get_ne_complete(session)
-    NW = get_nw_complete(session)
-    SE = get_se_complete(session)
-    SW = get_sw_complete(session)
-    context = get_context(session)
+def on_intent_walk_statue(session, state, obj):
+    qp = get_quest_point(session, state)
+    lap = state.lap
+    NE = state.ne
+    NW = state.nw
+    SE = state.se
+    SW = state.sw
+    context = state.context
     attr = session['attributes']
 
     if qp >= 6:
         return misunderstand_response(attr)
-    elif (obj == "statue") or (obj == "raven"):
+    elif (obj == "statue"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, context),
+            build_attr(qp, lap, NE, NW, SE, SW, context),
             [
-                text_statue_prompt(),
-                text_walk_to_statue(),
-                text_statue_prompt()
+                get_text("statue_prompt"),
+                get_text("walk_to_statue"),
+                get_text("statue_prompt")
             ]
         )
     elif (qp == 4):
-        if (obj == "northeast statue") or (obj == "northeast raven"):
-            [lap_done, diag] = update_lap(diag, "C")
+        if (obj == "northeast statue"):
+            lap_done, lap = advance_lap(lap, "C")
             if (lap_done):
                 SaveQuestPoint(session, qp + 1)
                 return build_response(
-                    build_attr(qp + 1, diag, NE, NW, SE, SW, "northeast statue"),
+                    build_attr(qp + 1, lap, NE, NW, SE, SW, "northeast statue"),
                     [
-                        text_title_walk_northeast_statue(),
-                        text_walk_to_qp4_end_northeast_statue(),
-                        text_prompt(),
-                        audio_letter_box()
+                        get_text("title_walk_northeast_statue"),
+                        get_text("walk_to_qp4_end_northeast_statue"),
+                        get_text("prompt"),
+                        get_audio("letter_box")
                     ]
                 )
             else:
                 return build_response(
-                    build_attr(qp, diag, NE, NW, SE, SW, "northeast statue"),
+                    build_attr(qp, lap, NE, NW, SE, SW, "northeast statue"),
                     [
-                        text_title_walk_northeast_statue(),
-                        text_walk_to_northeast_statue(),
-                        text_prompt()
+                        get_text("title_walk_northeast_statue"),
+                        get_text("walk_to_northeast_statue"),
+                        get_text("prompt")
                     ]
                 )
-        elif (obj == "northwest statue") or (obj == "northwest raven"):
-            [lap_done, diag] = update_lap(diag, "B")
+        elif (obj == "northwest statue"):
+            lap_done, lap = advance_lap(lap, "B")
             if (lap_done):
                 SaveQuestPoint(session, qp + 1)
                 return build_response(
-                    build_attr(qp + 1, diag, NE, NW, SE, SW, "northwest statue"),
+                    build_attr(qp + 1, lap, NE, NW, SE, SW, "northwest statue"),
                     [
-                        text_title_walk_northwest_statue(),
-                        text_walk_to_qp4_end_northwest_statue(),
-                        text_prompt(),
-                        audio_letter_box()
+                        get_text("title_walk_northwest_statue"),
+                        get_text("walk_to_qp4_end_northwest_statue"),
+                        get_text("prompt"),
+                        get_audio("letter_box")
                     ]
                 )
             else:
                 return build_response(
-                    build_attr(qp, diag, NE, NW, SE, SW, "northwest statue"),
+                    build_attr(qp, lap, NE, NW, SE, SW, "northwest statue"),
                     [
-                        text_title_walk_northwest_statue(),
-                        text_walk_to_northwest_statue(),
-                        text_prompt()
+                        get_text("title_walk_northwest_statue"),
+                        get_text("walk_to_northwest_statue"),
+                        get_text("prompt")
                     ]
                 )
-        elif (obj == "southeast statue") or (obj == "southeast raven"):
-            [lap_done, diag] = update_lap(diag, "D")
+        elif (obj == "southeast statue"):
+            lap_done, lap = advance_lap(lap, "D")
             if (lap_done):
                 SaveQuestPoint(session, qp + 1)
                 return build_response(
-                    build_attr(qp + 1, diag, NE, NW, SE, SW, "southeast statue"),
+                    build_attr(qp + 1, lap, NE, NW, SE, SW, "southeast statue"),
                     [
-                        text_title_walk_southeast_statue(),
-                        text_walk_to_qp4_end_southeast_statue(),
-                        text_prompt(),
-                        audio_letter_box()
+                        get_text("title_walk_southeast_statue"),
+                        get_text("walk_to_qp4_end_southeast_statue"),
+                        get_text("prompt"),
+                        get_audio("letter_box")
                     ]
                 )
             else:
                 return build_response(
-                    build_attr(qp, diag, NE, NW, SE, SW, "southeast statue"),
+                    build_attr(qp, lap, NE, NW, SE, SW, "southeast statue"),
                     [
-                        text_title_walk_southeast_statue(),
-                        text_walk_to_southeast_statue(),
-                        text_prompt()
+                        get_text("title_walk_southeast_statue"),
+                        get_text("walk_to_southeast_statue"),
+                        get_text("prompt")
                     ]
                 )
-        elif (obj == "southwest statue") or (obj == "southwest raven"):
-            [lap_done, diag] = update_lap(diag, "A")
+        elif (obj == "southwest statue"):
+            lap_done, lap = advance_lap(lap, "A")
             if (lap_done):
                 SaveQuestPoint(session, qp + 1)
                 return build_response(
-                    build_attr(qp + 1, diag, NE, NW, SE, SW, "southwest statue"),
+                    build_attr(qp + 1, lap, NE, NW, SE, SW, "southwest statue"),
                     [
-                        text_title_walk_southwest_statue(),
-                        text_walk_to_qp4_end_southwest_statue(),
-                        text_prompt(),
-                        audio_letter_box()
+                        get_text("title_walk_southwest_statue"),
+                        get_text("walk_to_qp4_end_southwest_statue"),
+                        get_text("prompt"),
+                        get_audio("letter_box")
                     ]
                 )
             else:
                 return build_response(
-                    build_attr(qp, diag, NE, NW, SE, SW, "southwest statue"),
+                    build_attr(qp, lap, NE, NW, SE, SW, "southwest statue"),
                     [
-                        text_title_walk_southwest_statue(),
-                        text_walk_to_southwest_statue(),
-                        text_prompt()
+                        get_text("title_walk_southwest_statue"),
+                        get_text("walk_to_southwest_statue"),
+                        get_text("prompt")
                     ]
                 )
         else:
             return misunderstand_response(attr)
     else:
-        if (obj == "northeast statue") or (obj == "northeast raven"):
+        if (obj == "northeast statue"):
             return build_response(
-                build_attr(qp, diag, NE, NW, SE, SW, "northeast statue"),
+                build_attr(qp, lap, NE, NW, SE, SW, "northeast statue"),
                 [
-                    text_title_walk_northeast_statue(),
-                    text_walk_to_northeast_statue(),
-                    text_prompt()
+                    get_text("title_walk_northeast_statue"),
+                    get_text("walk_to_northeast_statue"),
+                    get_text("prompt")
                 ]
             )
-        elif (obj == "northwest statue") or (obj == "northwest raven"):
+        elif (obj == "northwest statue"):
             return build_response(
-                build_attr(qp, diag, NE, NW, SE, SW, "northwest statue"),
+                build_attr(qp, lap, NE, NW, SE, SW, "northwest statue"),
                 [
-                    text_title_walk_northwest_statue(),
-                    text_walk_to_northwest_statue(),
-                    text_prompt()
+                    get_text("title_walk_northwest_statue"),
+                    get_text("walk_to_northwest_statue"),
+                    get_text("prompt")
                 ]
             )
-        elif (obj == "southeast statue") or (obj == "southeast raven"):
+        elif (obj == "southeast statue"):
             return build_response(
-                build_attr(qp, diag, NE, NW, SE, SW, "southeast statue"),
+                build_attr(qp, lap, NE, NW, SE, SW, "southeast statue"),
                 [
-                    text_title_walk_southeast_statue(),
-                    text_walk_to_southeast_statue(),
-                    text_prompt()
+                    get_text("title_walk_southeast_statue"),
+                    get_text("walk_to_southeast_statue"),
+                    get_text("prompt")
                 ]
             )
-        elif (obj == "southwest statue") or (obj == "southwest raven"):
+        elif (obj == "southwest statue"):
             return build_response(
-                build_attr(qp, diag, NE, NW, SE, SW, "southwest statue"),
+                build_attr(qp, lap, NE, NW, SE, SW, "southwest statue"),
                 [
-                    text_title_walk_southwest_statue(),
-                    text_walk_to_southwest_statue(),
-                    text_prompt()
+                    get_text("title_walk_southwest_statue"),
+                    get_text("walk_to_southwest_statue"),
+                    get_text("prompt")
                 ]
             )
         else:
             return misunderstand_response(attr)
 
-def on_intent_walk(session, obj):
-    qp = get_quest_point(session)
-    diag = get_diag_order(session)
-    NE = get_ne_complete(session)
-    NW = get_nw_complete(session)
-    SE = get_se_complete(session)
-    SW = get_sw_complete(session)
+def on_intent_walk(session, state, obj):
+    qp = get_quest_point(session, state)
+    lap = state.lap
+    NE = state.ne
+    NW = state.nw
+    SE = state.se
+    SW = state.sw
     attr = session['attributes']
+    obj = resolve_object(obj)
 
-    if (obj == "north wall") or (obj == "north"):
+    if (obj == "north wall"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "north wall"),
+            build_attr(qp, lap, NE, NW, SE, SW, "north wall"),
             [
-                text_title_walk_north_wall(),
-                text_walk_to_north_wall(),
-                text_prompt()
+                get_text("title_walk_north_wall"),
+                get_text("walk_to_north_wall"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "south wall") or (obj == "south"):
+    elif (obj == "south wall"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "south wall"),
+            build_attr(qp, lap, NE, NW, SE, SW, "south wall"),
             [
-                text_title_walk_south_wall(),
-                text_walk_to_south_wall(),
-                text_prompt()
+                get_text("title_walk_south_wall"),
+                get_text("walk_to_south_wall"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "east wall") or (obj == "east"):
+    elif (obj == "east wall"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "east wall"),
+            build_attr(qp, lap, NE, NW, SE, SW, "east wall"),
             [
-                text_title_walk_east_wall(),
-                text_walk_to_east_wall(),
-                text_prompt()
+                get_text("title_walk_east_wall"),
+                get_text("walk_to_east_wall"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "west wall") or (obj == "west"):
+    elif (obj == "west wall"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "west wall"),
+            build_attr(qp, lap, NE, NW, SE, SW, "west wall"),
             [
-                text_title_walk_west_wall(),
-                text_walk_to_west_wall(),
-                text_prompt()
+                get_text("title_walk_west_wall"),
+                get_text("walk_to_west_wall"),
+                get_text("prompt")
             ]
         )
     elif (obj == "wall"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, get_context(session)),
+            build_attr(qp, lap, NE, NW, SE, SW, state.context),
             [
-                text_wall_prompt(),
-                text_walk_to_wall(),
-                text_wall_prompt()
+                get_text("wall_prompt"),
+                get_text("walk_to_wall"),
+                get_text("wall_prompt")
             ]
         )
     elif (obj == "letter"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "letter"),
+            build_attr(qp, lap, NE, NW, SE, SW, "letter"),
             [
-                text_title_walk_letter(),
-                text_walk_to_letter_box(),
-                text_prompt()
+                get_text("title_walk_letter"),
+                get_text("walk_to_letter_box"),
+                get_text("prompt")
             ]
         )
     elif (obj == "letter box"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "letter box"),
+            build_attr(qp, lap, NE, NW, SE, SW, "letter box"),
             [
-                text_title_walk_letter_box(),
-                text_walk_to_letter_box(),
-                text_prompt()
+                get_text("title_walk_letter_box"),
+                get_text("walk_to_letter_box"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "metal cabinet" or (obj == "cabinet")):
+    elif (obj == "metal cabinet"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "metal cabinet"),
+            build_attr(qp, lap, NE, NW, SE, SW, "metal cabinet"),
             [
-                text_title_walk_metal_cabinet(),
-                text_walk_to_metal_cabinet(),
-                text_prompt()
+                get_text("title_walk_metal_cabinet"),
+                get_text("walk_to_metal_cabinet"),
+                get_text("prompt")
             ]
         )
-    elif ((obj == "northeast terminal") or  (obj == "northwest terminal") or
-              (obj == "southeast terminal") or (obj == "southwest terminal") or
-              (obj == "central terminal") or (obj == "terminal") or
-              (obj == "northeast computer") or (obj == "northwest computer") or
-              (obj == "southeast computer") or (obj == "southwest computer") or
-              (obj == "central computer") or (obj == "computer") or
-              (obj == "computer terminal")):
-        return on_intent_walk_terminal(session, obj)
-    elif ((obj == "northeast statue") or (obj == "northwest statue") or
-          (obj == "southeast statue") or (obj == "southwest statue") or
-          (obj == "northeast raven") or (obj == "northwest raven") or
-          (obj == "southeast raven") or (obj == "southwest raven") or
-          (obj == "statue") or (obj == "raven")):
-        return on_intent_walk_statue(session, obj)
-    elif ((obj == "northeast") or (obj == "northwest") or
-          (obj == "southeast") or (obj == "southwest") or
-          (obj == "northeast corner") or (obj == "northwest corner") or
-          (obj == "southeast corner") or (obj == "southwest corner")):
+    elif (obj in TERMINALS):
+        return on_intent_walk_terminal(session, state, obj)
+    elif (obj in STATUES):
+        return on_intent_walk_statue(session, state, obj)
+    elif (obj in CORNERS):
         if qp < 6:
-            return on_intent_walk_statue(session, obj + " statue")
+            return on_intent_walk_statue(session, state, obj + " statue")
         else:
-            return on_intent_walk_terminal(session, obj + " terminal")
+            return on_intent_walk_terminal(session, state, obj + " terminal")
     else:
         return misunderstand_response(attr)
 
-def on_intent_interact_with_terminal(session, obj):
-    qp = get_quest_point(session)
-    diag = get_diag_order(session)
-    NE = get_ne_complete(session)
-    NW = get_nw_complete(session)
-    SE = get_se_complete(session)
-    SW = get_sw_complete(session)
+def on_intent_interact_with_terminal(session, state, obj):
+    qp = get_quest_point(session, state)
+    lap = state.lap
+    NE = state.ne
+    NW = state.nw
+    SE = state.se
+    SW = state.sw
     attr = session['attributes']
 
     if qp == 0:
         SaveQuestPoint(session, qp + 1)
         return build_response(
-            build_attr(qp + 1, diag, NE, NW, SE, SW, "central terminal"),
+            build_attr(qp + 1, lap, NE, NW, SE, SW, "central terminal"),
             [
-                text_title_only_computer_terminal_qp0(),
-                text_interact_only_computer_terminal_qp0(),
-                text_prompt(),
-                audio_letter_box()
+                get_text("title_only_computer_terminal_qp0"),
+                get_text("interact_only_computer_terminal_qp0"),
+                get_text("prompt"),
+                get_audio("letter_box")
             ]
         )
     elif qp < 6:
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "central terminal"),
+            build_attr(qp, lap, NE, NW, SE, SW, "central terminal"),
             [
-                text_title_computer_terminal_not_responding(),
-                text_interact_only_computer_terminal(),
-                text_prompt()
+                get_text("title_computer_terminal_not_responding"),
+                get_text("interact_only_computer_terminal"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "northeast terminal")  or (obj == "northeast computer"):
-        if ((qp == 6) and (get_ne_complete(session) == False)):
+    elif (obj == "northeast terminal"):
+        if ((qp == 6) and (state.ne == False)):
             return build_response(
-                build_attr(qp, diag, NE, NW, SE, SW, "qp6_ne"),
+                build_attr(qp, lap, NE, NW, SE, SW, "qp6_ne"),
                 [
-                    text_title_northeast_computer_terminal_qp6(),
-                    text_interact_northeast_computer_terminal_qp6(),
-                    text_options_prompt()
+                    get_text("title_northeast_computer_terminal_qp6"),
+                    get_text("interact_northeast_computer_terminal_qp6"),
+                    get_text("options_prompt")
                 ]
             )
         else:
             return build_response(
-                build_attr(qp, diag, NE, NW, SE, SW, "northeast terminal"),
+                build_attr(qp, lap, NE, NW, SE, SW, "northeast terminal"),
                 [
-                    text_title_computer_terminal_not_responding(),
-                    text_interact_northeast_computer_terminal(),
-                    text_prompt()
+                    get_text("title_computer_terminal_not_responding"),
+                    get_text("interact_northeast_computer_terminal"),
+                    get_text("prompt")
                 ]
             )
-    elif (obj == "northwest terminal") or (obj == "northwest computer"):
-        if ((qp == 6) and (get_nw_complete(session) == False)):
+    elif (obj == "northwest terminal"):
+        if ((qp == 6) and (state.nw == False)):
             return build_response(
-                build_attr(qp, diag, NE, NW, SE, SW, "qp6_nw"),
+                build_attr(qp, lap, NE, NW, SE, SW, "qp6_nw"),
                 [
-                    text_title_northwest_computer_terminal_qp6(),
-                    text_interact_northwest_computer_terminal_qp6(),
-                    text_options_prompt()
+                    get_text("title_northwest_computer_terminal_qp6"),
+                    get_text("interact_northwest_computer_terminal_qp6"),
+                    get_text("options_prompt")
                 ]
             )
         else:
             return build_response(
-                build_attr(qp, diag, NE, NW, SE, SW, "northwest terminal"),
+                build_attr(qp, lap, NE, NW, SE, SW, "northwest terminal"),
                 [
-                    text_title_computer_terminal_not_responding(),
-                    text_interact_northwest_computer_terminal(),
-                    text_prompt()
+                    get_text("title_computer_terminal_not_responding"),
+                    get_text("interact_northwest_computer_terminal"),
+                    get_text("prompt")
                 ]
             )
-    elif (obj == "southeast terminal") or (obj == "southeast computer"):
-        if ((qp == 6) and (get_se_complete(session) == False)):
+    elif (obj == "southeast terminal"):
+        if ((qp == 6) and (state.se == False)):
             return build_response(
-                build_attr(qp, diag, NE, NW, SE, SW, "qp6_se"),
+                build_attr(qp, lap, NE, NW, SE, SW, "qp6_se"),
                 [
-                    text_title_southeast_computer_terminal_qp6(),
-                    text_interact_southeast_computer_terminal_qp6(),
-                    text_options_prompt()
+                    get_text("title_southeast_computer_terminal_qp6"),
+                    get_text("interact_southeast_computer_terminal_qp6"),
+                    get_text("options_prompt")
                 ]
             )
         else:
             return build_response(
-                build_attr(qp, diag, NE, NW, SE, SW, "southeast terminal"),
+                build_attr(qp, lap, NE, NW, SE, SW, "southeast terminal"),
                 [
-                    text_title_computer_terminal_not_responding(),
-                    text_interact_southeast_computer_terminal(),
-                    text_prompt()
+                    get_text("title_computer_terminal_not_responding"),
+                    get_text("interact_southeast_computer_terminal"),
+                    get_text("prompt")
                 ]
             )
-    elif (obj == "southwest terminal") or (obj == "southwest computer"):
-        if ((qp == 6) and (get_sw_complete(session) == False)):
+    elif (obj == "southwest terminal"):
+        if ((qp == 6) and (state.sw == False)):
             return build_response(
-                build_attr(qp, diag, NE, NW, SE, SW, "qp6_sw"),
+                build_attr(qp, lap, NE, NW, SE, SW, "qp6_sw"),
                 [
-                    text_title_southwest_computer_terminal_qp6(),
-                    text_interact_southwest_computer_terminal_qp6(),
-                    text_options_prompt()
+                    get_text("title_southwest_computer_terminal_qp6"),
+                    get_text("interact_southwest_computer_terminal_qp6"),
+                    get_text("options_prompt")
                 ]
             )
         else:
             return build_response(
-                build_attr(qp, diag, NE, NW, SE, SW, "southwest terminal"),
+                build_attr(qp, lap, NE, NW, SE, SW, "southwest terminal"),
                 [
-                    text_title_computer_terminal_not_responding(),
-                    text_interact_southwest_computer_terminal(),
-                    text_prompt()
+                    get_text("title_computer_terminal_not_responding"),
+                    get_text("interact_southwest_computer_terminal"),
+                    get_text("prompt")
                 ]
             )
-    elif (obj == "central terminal") or (obj == "central computer"):
+    elif (obj == "central terminal"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "central terminal"),
+            build_attr(qp, lap, NE, NW, SE, SW, "central terminal"),
             [
-                text_title_computer_terminal_not_responding(),
-                text_interact_central_computer_terminal(),
-                text_prompt()
+                get_text("title_computer_terminal_not_responding"),
+                get_text("interact_central_computer_terminal"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "terminal") or (obj == "computer terminal") or (obj == "computer"):
+    elif (obj == "terminal"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, get_context(session)),
+            build_attr(qp, lap, NE, NW, SE, SW, state.context),
             [
-                text_terminal_prompt(),
-                text_interact_terminal(),
-                text_terminal_prompt()
+                get_text("terminal_prompt"),
+                get_text("interact_terminal"),
+                get_text("terminal_prompt")
             ]
         )
     else:
         return misunderstand_response(attr)
 
-def on_intent_interact_with_statue(session, obj):
-    qp = get_quest_point(session)
-    diag = get_diag_order(session)
-    NE = get_ne_complete(session)
-    NW = get_nw_complete(session)
-    SE = get_se_complete(session)
-    SW = get_sw_complete(session)
+def on_intent_interact_with_statue(session, state, obj):
+    qp = get_quest_point(session, state)
+    lap = state.lap
+    NE = state.ne
+    NW = state.nw
+    SE = state.se
+    SW = state.sw
     attr = session['attributes']
 
     if qp >= 6:
         return misunderstand_response(attr)
-    elif (obj == "northeast statue") or (obj == "northeast raven"):
+    elif (obj == "northeast statue"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "northeast statue"),
+            build_attr(qp, lap, NE, NW, SE, SW, "northeast statue"),
             [
-                text_title_interact_statue(),
-                text_interact_northeast_statue(),
-                text_prompt()
+                get_text("title_interact_statue"),
+                get_text("interact_northeast_statue"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "northwest statue") or (obj == "northwest raven"):
+    elif (obj == "northwest statue"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "northwest statue"),
+            build_attr(qp, lap, NE, NW, SE, SW, "northwest statue"),
             [
-                text_title_interact_statue(),
-                text_interact_northwest_statue(),
-                text_prompt()
+                get_text("title_interact_statue"),
+                get_text("interact_northwest_statue"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "southeast statue") or (obj == "southeast raven"):
+    elif (obj == "southeast statue"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "southeast statue"),
+            build_attr(qp, lap, NE, NW, SE, SW, "southeast statue"),
             [
-                text_title_interact_statue(),
-                text_interact_southeast_statue(),
-                text_prompt()
+                get_text("title_interact_statue"),
+                get_text("interact_southeast_statue"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "southwest statue") or (obj == "southwest raven"):
+    elif (obj == "southwest statue"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "southwest statue"),
+            build_attr(qp, lap, NE, NW, SE, SW, "southwest statue"),
             [
-                text_title_interact_statue(),
-                text_interact_southwest_statue(),
-                text_prompt()
+                get_text("title_interact_statue"),
+                get_text("interact_southwest_statue"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "statue") or (obj == "raven"):
+    elif (obj == "statue"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, get_context(session)),
+            build_attr(qp, lap, NE, NW, SE, SW, state.context),
             [
-                text_statue_prompt(),
-                text_interact_statue(),
-                text_statue_prompt()
+                get_text("statue_prompt"),
+                get_text("interact_statue"),
+                get_text("statue_prompt")
             ]
         )
     else:
         return misunderstand_response(attr)
 
 
-def on_intent_interact_with(session, obj):
-    qp = get_quest_point(session)
-    diag = get_diag_order(session)
-    NE = get_ne_complete(session)
-    NW = get_nw_complete(session)
-    SE = get_se_complete(session)
-    SW = get_sw_complete(session)
+def on_intent_interact_with(session, state, obj):
+    qp = get_quest_point(session, state)
+    lap = state.lap
+    NE = state.ne
+    NW = state.nw
+    SE = state.se
+    SW = state.sw
     attr = session['attributes']
+    obj = resolve_object(obj)
 
-    if (obj == "north wall") or (obj == "north"):
+    if (obj == "north wall"):
         if (qp == 2):
             SaveQuestPoint(session, qp + 1)
             return build_response(
-                build_attr(qp + 1, diag, NE, NW, SE, SW, "north wall"),
+                build_attr(qp + 1, lap, NE, NW, SE, SW, "north wall"),
                 [
-                    text_title_interact_north_wall(),
-                    text_interact_north_wall_qp2(),
-                    text_prompt(),
-                    audio_moving_wall(),
-                    audio_letter_box()
+                    get_text("title_interact_north_wall"),
+                    get_text("interact_north_wall_qp2"),
+                    get_text("prompt"),
+                    get_audio("moving_wall"),
+                    get_audio("letter_box")
                 ]
             )
         else:
             return build_response(
-                build_attr(qp, diag, NE, NW, SE, SW, "north wall"),
+                build_attr(qp, lap, NE, NW, SE, SW, "north wall"),
                 [
-                    text_title_interact_north_wall_qp2(),
-                    text_interact_north_wall(),
-                    text_prompt()
+                    get_text("title_interact_north_wall_qp2"),
+                    get_text("interact_north_wall"),
+                    get_text("prompt")
                 ]
             )
-    elif (obj == "south wall") or (obj == "south"):
+    elif (obj == "south wall"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "south wall"),
+            build_attr(qp, lap, NE, NW, SE, SW, "south wall"),
             [
-                text_title_interact_south_wall(),
-                text_interact_south_wall(),
-                text_prompt()
+                get_text("title_interact_south_wall"),
+                get_text("interact_south_wall"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "east wall") or (obj == "east"):
+    elif (obj == "east wall"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "east wall"),
+            build_attr(qp, lap, NE, NW, SE, SW, "east wall"),
             [
-                text_title_interact_east_wall(),
-                text_interact_east_wall(),
-                text_prompt()
+                get_text("title_interact_east_wall"),
+                get_text("interact_east_wall"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "west wall") or (obj == "west"):
+    elif (obj == "west wall"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "west wall"),
+            build_attr(qp, lap, NE, NW, SE, SW, "west wall"),
             [
-                text_title_interact_west_wall(),
-                text_interact_west_wall(),
-                text_prompt()
+                get_text("title_interact_west_wall"),
+                get_text("interact_west_wall"),
+                get_text("prompt")
             ]
         )
     elif (obj == "wall"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, get_context(session)),
+            build_attr(qp, lap, NE, NW, SE, SW, state.context),
             [
-                text_wall_prompt(),
-                text_interact_wall(),
-                text_wall_prompt()
+                get_text("wall_prompt"),
+                get_text("interact_wall"),
+                get_text("wall_prompt")
             ]
         )
     elif (obj == "letter"):
-        return on_intent_read(session)
+        return on_intent_read(session, state)
     elif (obj == "letter box"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "letter box"),
+            build_attr(qp, lap, NE, NW, SE, SW, "letter box"),
             [
-                text_title_interact_letter_box(),
-                text_interact_letter_box(),
-                text_prompt()
+                get_text("title_interact_letter_box"),
+                get_text("interact_letter_box"),
+                get_text("prompt")
             ]
         )
-    elif (obj == "metal cabinet") or (obj == "cabinet"):
+    elif (obj == "metal cabinet"):
         return build_response(
-            build_attr(qp, diag, NE, NW, SE, SW, "metal cabinet"),
+            build_attr(qp, lap, NE, NW, SE, SW, "metal cabinet"),
             [
-                text_title_interact_metal_cabinet(),
-                text_interact_metal_cabinet(),
-                text_prompt()
+                get_text("title_interact_metal_cabinet"),
+                get_text("interact_metal_cabinet"),
+                get_text("prompt")
             ]
         )
-    elif ((obj == "northeast terminal") or  (obj == "northwest terminal") or
-          (obj == "southeast terminal") or (obj == "southwest terminal") or
-          (obj == "central terminal") or (obj == "terminal") or
-          (obj == "northeast computer") or (obj == "northwest computer") or
-          (obj == "southeast computer") or (obj == "southwest computer") or
-          (obj == "central computer") or (obj == "computer") or
-          (obj == "computer terminal")):
-        if (obj == "terminal") or (obj == "computer") or (obj == "computer terminal"):
-            context = get_context(session)
+    elif (obj in TERMINALS):
+        if (obj == "terminal"):
+            context = state.context
             if ("terminal" in context):
                 obj = context
-        return on_intent_interact_with_terminal(session, obj)
-    elif ((obj == "northeast statue") or (obj == "northwest statue") or
-          (obj == "southeast statue") or (obj == "southwest statue") or
-          (obj == "northeast raven") or (obj == "northwest raven") or
-          (obj == "southeast raven") or (obj == "southwest raven") or
-          (obj == "statue") or (obj == "raven")):
-        if (obj == "statue") or (obj == "raven"):
-            context = get_context(session)
+        return on_intent_interact_with_terminal(session, state, obj)
+    elif (obj in STATUES):
+        if (obj == "statue"):
+            context = state.context
             if ("statue" in context):
                 obj = context
-        return on_intent_interact_with_statue(session, obj)
-    elif ((obj == "northeast") or (obj == "northwest") or
-          (obj == "southeast") or (obj == "southwest") or
-          (obj == "northeast corner") or (obj == "northwest corner") or
-          (obj == "southeast corner") or (obj == "southwest corner")):
+        return on_intent_interact_with_statue(session, state, obj)
+    elif (obj in CORNERS):
         if qp < 6:
-            return on_intent_interact_with_statue(session, obj + " statue")
+            return on_intent_interact_with_statue(session, state, obj + " statue")
         else:
-            return on_intent_interact_with_terminal(session, obj + " terminal")
+            return on_intent_interact_with_terminal(session, state, obj + " terminal")
     else:
         return misunderstand_response(attr)
 
-def on_intent_read(session):
-    qp = get_quest_point(session)
-    diag = get_diag_order(session)
-    NE = get_ne_complete(session)
-    NW = get_nw_complete(session)
-    SE = get_se_complete(session)
-    SW = get_sw_complete(session)
-    context = get_context(session)
-    attr = session['attributes']
+# Quest point reading the letter moves the game to, the text read out and the clip played
+READ_TRANSITIONS = {
+    1: (2, "interact_letter_qp2_first_time", "sharp_click"),
+    2: (2, "interact_letter_qp2", None),
+    3: (4, "interact_letter_qp4", None),
+    4: (4, "interact_letter_qp4", None),
+    5: (6, "interact_letter_qp6_first_time", "moving_statue"),
+    6: (6, "interact_letter_qp6", None),
+    7: (8, "interact_letter_qp8", None),
+    8: (8, "interact_letter_qp8", None),
+}
+
+def on_intent_read(session, state):
+    qp = get_quest_point(session, state)
+    context = state.context
 
     if (qp == 0):
-        return misunderstand_response(attr)
-    elif (qp == 1):
-        SaveQuestPoint(session, 2)
-        return build_response(
-            build_attr(2, "", False, False, False, False, context),
-            [
-                text_title_read_letter(),
-                text_interact_letter_qp2_first_time(),
-                text_prompt(),
-                audio_sharp_click()
-            ]
-        )
-    elif (qp == 2):
-        return build_response(
-            build_attr(2, "", False, False, False, False, context),
-            [
-                text_title_read_letter(),
-                text_interact_letter_qp2(),
-                text_prompt()
-            ]
-        )
-    elif (qp == 3):
-        SaveQuestPoint(session, 4)
-        return build_response(
-            build_attr(4, "", False, False, False, False, context),
-            [
-                text_title_read_letter(),
-                text_interact_letter_qp4(),
-                text_prompt()
-            ]
-        )
-    elif (qp == 4):
-        return build_response(
-            build_attr(4, diag, False, False, False, False, context),
-            [
-                text_title_read_letter(),
-                text_interact_letter_qp4(),
-                text_prompt()
-            ]
-        )
-    elif (qp == 5):
-        SaveQuestPoint(session, 6)
-        return build_response(
-            build_attr(6, "", False, False, False, False, context),
-            [
-                text_title_read_letter(),
-                text_interact_letter_qp6_first_time(),
-                text_prompt(),
-                audio_moving_statue()
-            ]
-        )
-    elif (qp == 6):
-        return build_response(
-            build_attr(6, "", NE, NW, SE, SW, context),
-            [
-                text_title_read_letter(),
-                text_interact_letter_qp6(),
-                text_prompt()
-            ]
-        )
-    elif (qp == 7) or (qp == 8):
-        if (qp == 7):
-            SaveQuestPoint(session, 8)
-        return build_response(
-            build_attr(8, "", False, False, False, False, context),
-            [
-                text_title_read_letter(),
-                text_interact_letter_qp8(),
-                text_prompt()
-            ]
-        )
+        return misunderstand_response(session['attributes'])
     elif (qp == 9):
-        SaveQuestPoint(session, 0)
-        return build_response(
-            {},
-            [
-                text_title_read_letter(),
-                text_end(),
-                "",
-                audio_jingle()
-            ],
-            True
-        )
-    else:
+        return on_intent_read_end(session)
+    transition = READ_TRANSITIONS.get(qp)
+    if transition is None:
         return error_response()
+    next_qp, text, clip = transition
+    if next_qp != qp:
+        SaveQuestPoint(session, next_qp)
+        attr = build_attr(next_qp, 0, False, False, False, False, context)
+    else:
+        # Rereading the letter keeps the progress on the current puzzle
+        attr = build_attr(qp, state.lap, state.ne, state.nw,
+                          state.se, state.sw, context)
+    response_text = [
+        get_text("title_read_letter"),
+        get_text(text),
+        get_text("prompt")
+    ]
+    if clip is not None:
+        response_text.append(get_audio(clip))
+    return build_response(attr, response_text)
+
+def on_intent_read_end(session):
+    SaveQuestPoint(session, 0)
+    return build_response(
+        {},
+        [
+            get_text("title_read_letter"),
+            get_text("end"),
+            "",
+            get_audio("jingle")
+        ],
+        True
+    )
 
-
-def on_intent_option(session, intent):
+def on_intent_option(session, state, intent):
     option = get_option_slot(intent)
-    NE = get_ne_complete(session)
-    NW = get_nw_complete(session)
-    SE = get_se_complete(session)
-    SW = get_sw_complete(session)
-    context = get_context(session)
+    NE = state.ne
+    NW = state.nw
+    SE = state.se
+    SW = state.sw
+    context = state.context
     attr = session['attributes']
 
     if (context == "qp6_ne"):
         if (option == "1"):
             return build_response(
-                build_attr(6, "", NE, NW, SE, SW, "northeast terminal"),
+                build_attr(6, 0, NE, NW, SE, SW, "northeast terminal"),
                 [
-                    text_title_nice_option(),
-                    text_option_non_end_northeast_computer_terminal_a(),
-                    text_prompt()
+                    get_text("title_nice_option"),
+                    get_text("option_non_end_northeast_computer_terminal_a"),
+                    get_text("prompt")
                 ]
             )
         elif (option == "2"):
             if NW and SE and SW:
                 SaveQuestPoint(session, 7)
                 return build_response(
-                    build_attr(7, "", False, False, False, False, "northeast terminal"),
+                    build_attr(7, 0, False, False, False, False, "northeast terminal"),
                     [
-                        text_title_mean_option(),
-                        text_option_end_northeast_computer_terminal_b(),
-                        text_prompt(),
-                        audio_computer_beeping(),
-                        audio_letter_box()
+                        get_text("title_mean_option"),
+                        get_text("option_end_northeast_computer_terminal_b"),
+                        get_text("prompt"),
+                        get_audio("computer_beeping"),
+                        get_audio("letter_box")
                     ]
                 )
             else:
                 return build_response(
-                    build_attr(6, "", True, NW, SE, SW, "northeast terminal"),
+                    build_attr(6, 0, True, NW, SE, SW, "northeast terminal"),
                     [
-                        text_title_mean_option(),
-                        text_option_non_end_northeast_computer_terminal_b(),
-                        text_prompt()
+                        get_text("title_mean_option"),
+                        get_text("option_non_end_northeast_computer_terminal_b"),
+                        get_text("prompt")
                     ]
                 )
         else:
@@ -2290,31 +2703,31 @@ def on_intent_option(session, intent):
             if NE and SE and SW:
                 SaveQuestPoint(session, 7)
                 return build_response(
-                    build_attr(7, "", False, False, False, False, "northwest terminal"),
+                    build_attr(7, 0, False, False, False, False, "northwest terminal"),
                     [
-                        text_title_mean_option(),
-                        text_option_end_northwest_computer_terminal_a(),
-                        text_prompt(),
-                        audio_computer_beeping(),
-                        audio_letter_box()
+                        get_text("title_mean_option"),
+                        get_text("option_end_northwest_computer_terminal_a"),
+                        get_text("prompt"),
+                        get_audio("computer_beeping"),
+                        get_audio("letter_box")
                     ]
                 )
             else:
                 return build_response(
-                    build_attr(6, "", NE, True, SE, SW, "northwest terminal"),
+                    build_attr(6, 0, NE, True, SE, SW, "northwest terminal"),
                     [
-                        text_title_mean_option(),
-                        text_option_non_end_northwest_computer_terminal_a(),
-                        text_prompt()
+                        get_text("title_mean_option"),
+                        get_text("option_non_end_northwest_computer_terminal_a"),
+                        get_text("prompt")
                     ]
                 )
         elif (option == "2"):
             return build_response(
-                build_attr(6, "", NE, NW, SE, SW, "northwest terminal"),
+                build_attr(6, 0, NE, NW, SE, SW, "northwest terminal"),
                 [
-                    text_title_nice_option(),
-                    text_option_non_end_northwest_computer_terminal_b(),
-                    text_prompt()
+                    get_text("title_nice_option"),
+                    get_text("option_non_end_northwest_computer_terminal_b"),
+                    get_text("prompt")
                 ]
             )
         else:
@@ -2322,33 +2735,33 @@ def on_intent_option(session, intent):
     elif (context == "qp6_se"):
         if (option == "1"):
             return build_response(
-                build_attr(6, "", NE, NW, SE, SW, "southeast terminal"),
+                build_attr(6, 0, NE, NW, SE, SW, "southeast terminal"),
                 [
-                    text_title_nice_option(),
-                    text_option_non_end_southeast_computer_terminal_a(),
-                    text_prompt()
+                    get_text("title_nice_option"),
+                    get_text("option_non_end_southeast_computer_terminal_a"),
+                    get_text("prompt")
                 ]
             )
         elif (option == "2"):
             if NE and NW and SW:
                 SaveQuestPoint(session, 7)
                 return build_response(
-                    build_attr(7, "", False, False, False, False, "southeast terminal"),
+                    build_attr(7, 0, False, False, False, False, "southeast terminal"),
                     [
-                        text_title_mean_option(),
-                        text_option_end_southeast_computer_terminal_b(),
-                        text_prompt(),
-                        audio_computer_beeping(),
-                        audio_letter_box()
+                        get_text("title_mean_option"),
+                        get_text("option_end_southeast_computer_terminal_b"),
+                        get_text("prompt"),
+                        get_audio("computer_beeping"),
+                        get_audio("letter_box")
                     ]
                 )
             else:
                 return build_response(
-                    build_attr(6, "", NE, NW, True, SW, "southeast terminal"),
+                    build_attr(6, 0, NE, NW, True, SW, "southeast terminal"),
                     [
-                        text_title_mean_option(),
-                        text_option_non_end_southeast_computer_terminal_b(),
-                        text_prompt()
+                        get_text("title_mean_option"),
+                        get_text("option_non_end_southeast_computer_terminal_b"),
+                        get_text("prompt")
                     ]
                 )
         else:
@@ -2358,31 +2771,31 @@ def on_intent_option(session, intent):
             if NE and NW and SE:
                 SaveQuestPoint(session, 7)
                 return build_response(
-                    build_attr(7, "", False, False, False, False, "southwest terminal"),
+                    build_attr(7, 0, False, False, False, False, "southwest terminal"),
                     [
-                        text_title_mean_option(),
-                        text_option_end_southwest_computer_terminal_a(),
-                        text_prompt(),
-                        audio_computer_beeping(),
-                        audio_letter_box()
+                        get_text("title_mean_option"),
+                        get_text("option_end_southwest_computer_terminal_a"),
+                        get_text("prompt"),
+                        get_audio("computer_beeping"),
+                        get_audio("letter_box")
                     ]
                 )
             else:
                 return build_response(
-                    build_attr(6, "", NE, NW, SE, True, "southwest terminal"),
+                    build_attr(6, 0, NE, NW, SE, True, "southwest terminal"),
                     [
-                        text_title_mean_option(),
-                        text_option_non_end_southwest_computer_terminal_a(),
-                        text_prompt()
+                        get_text("title_mean_option"),
+                        get_text("option_non_end_southwest_computer_terminal_a"),
+                        get_text("prompt")
                     ]
                 )
         elif (option == "2"):
             return build_response(
-                build_attr(6, "", NE, NW, SE, SW, "southwest terminal"),
+                build_attr(6, 0, NE, NW, SE, SW, "southwest terminal"),
                 [
-                    text_title_nice_option(),
-                    text_option_non_end_southwest_computer_terminal_b(),
-                    text_prompt()
+                    get_text("title_nice_option"),
+                    get_text("option_non_end_southwest_computer_terminal_b"),
+                    get_text("prompt")
                 ]
             )
         else:
@@ -2393,70 +2806,152 @@ def on_intent_option(session, intent):
 
 
 
+# --------------- Intent Transitions
+
+# Every intent in Intent_Schema.txt, other intent names are looked up as OTHER
+INTENT_NAMES = (
+    "AMAZON.HelpIntent",
+    "AMAZON.RepeatIntent",
+    "AMAZON.StartOverIntent",
+    "AMAZON.StopIntent",
+    "AMAZON.CancelIntent",
+    "PlayIntent",
+    "WalkIntent",
+    "InteractIntent",
+    "InteractWithIntent",
+    "ReadIntent",
+    "OptionIntent",
+)
+# Other quest points are looked up as OTHER
+QUEST_POINTS = tuple(range(10))
+OTHER = None
+
+# Not playing, in the room, or at a qp6 terminal answering options
+IDLE = "idle"
+ROOM = "room"
+TERMINAL = "terminal"
+CONTEXT_CLASSES = (IDLE, ROOM, TERMINAL)
+
+ANY = None
+
+# First match wins: intents, quest points, context classes (ANY matches everything, OTHER
+# included) and the handler called with (session, state, intent)
+INTENT_RULES = (
+    (ANY, ANY, (IDLE,), lambda session, state, intent: on_intent_start(session, state)),
+    (("AMAZON.StartOverIntent",), ANY, ANY, lambda session, state, intent: on_transition_startover(session)),
+    (("AMAZON.StopIntent", "AMAZON.CancelIntent"), ANY, ANY, lambda session, state, intent: on_intent_stop()),
+    (("PlayIntent",), ANY, ANY, lambda session, state, intent: on_intent_start(session, state)),
+    (("OptionIntent",), ANY, (TERMINAL,), on_intent_option),
+    (("AMAZON.HelpIntent",), ANY, (TERMINAL,), lambda session, state, intent: on_intent_help_on_terminal(session, state)),
+    (("AMAZON.RepeatIntent",), ANY, (TERMINAL,), lambda session, state, intent: on_intent_repeat_on_terminal(session, state)),
+    (ANY, ANY, (TERMINAL,), lambda session, state, intent: misunderstand_response(session['attributes'])),
+    (("AMAZON.HelpIntent",), QUEST_POINTS, (ROOM,), lambda session, state, intent: on_intent_help(session, state)),
+    (("AMAZON.RepeatIntent",), QUEST_POINTS, (ROOM,), lambda session, state, intent: on_intent_repeat(session, state)),
+    (("WalkIntent",), ANY, (ROOM,), lambda session, state, intent: on_intent_walk(session, state, get_object_slot(intent))),
+    (("InteractIntent",), ANY, (ROOM,), lambda session, state, intent: on_intent_interact_with(session, state, state.context)),
+    (("InteractWithIntent",), ANY, (ROOM,), lambda session, state, intent: on_intent_interact_with(session, state, get_object_slot(intent))),
+    (("ReadIntent",), ANY, (ROOM,), lambda session, state, intent: on_intent_read(session, state)),
+    (("OptionIntent",), ANY, (ROOM,), lambda session, state, intent: misunderstand_response(session['attributes'])),
+    (ANY, ANY, (ROOM,), lambda session, state, intent: error_response()),
+)
+
+def on_transition_startover(session):
+    SaveQuestPoint(session, 0)
+    return on_intent_startover()
+
+def transition_states():
+    """ Every (intent, quest point, context class) the game can be in """
+    states = []
+    for intent_name in INTENT_NAMES + (OTHER,):
+        for qp in QUEST_POINTS + (OTHER,):
+            for context_class in CONTEXT_CLASSES:
+                states.append((intent_name, qp, context_class))
+    return states
+
+def rule_matches(rule, state):
+    for values, value in zip(rule[:3], state):
+        if values is not ANY and value not in values:
+            return False
+    return True
+
+def compile_intent_rules(rules):
+    """ Returns the handler of every state, with the index of the rule it came from """
+    transitions = {}
+    sources = {}
+    for state in transition_states():
+        for index, rule in enumerate(rules):
+            if rule_matches(rule, state):
+                transitions[state] = rule[3]
+                sources[state] = index
+                break
+    return transitions, sources
+
+def check_intent_transitions(rules, transitions, sources):
+    """ Returns a list of problems: states without a handler and rules that never match """
+    problems = []
+    for state in transition_states():
+        if state not in transitions:
+            problems.append("no transition for " + repr(state))
+    used = set(sources.values())
+    for index in range(len(rules)):
+        if index not in used:
+            problems.append("rule " + str(index) + " is shadowed by earlier rules")
+    return problems
+
+intent_transitions, intent_transition_sources = compile_intent_rules(INTENT_RULES)
+intent_transition_problems = check_intent_transitions(INTENT_RULES, intent_transitions, intent_transition_sources)
+if intent_transition_problems:
+    raise ValueError("Intent transitions are incomplete: " + "; ".join(intent_transition_problems))
+
+def get_context_class(state):
+    if (state.is_playing == False):
+        return IDLE
+    elif ("qp6_" in state.context):
+        return TERMINAL
+    else:
+        return ROOM
+
+def get_transition(intent_name, qp, context_class):
+    transition = intent_transitions.get((intent_name, qp, context_class))
+    if transition is None:
+        if intent_name not in INTENT_NAMES:
+            intent_name = OTHER
+        if qp not in QUEST_POINTS:
+            qp = OTHER
+        transition = intent_transitions[(intent_name, qp, context_class)]
+    return transition
+
 # --------------- Events ------------------
 
 
 def on_session_started(session_started_request, session):
     """ Called when the session starts """
 
-    print("on_session_started requestId=" + session_started_request['requestId']
-          + ", sessionId=" + session['sessionId'])
+    log('DEBUG', "on_session_started",
+        lambda: {'requestId': session_started_request['requestId'], 'sessionId': session['sessionId']})
 
 
-def on_launch(launch_request, session):
+def on_launch(launch_request, session, state):
     """ Called when the user launches the skill without specifying what they
     want
     """
 
-    print("on_launch requestId=" + launch_request['requestId'] +
-          ", sessionId=" + session['sessionId'])
+    log('DEBUG', "on_launch",
+        lambda: {'requestId': launch_request['requestId'], 'sessionId': session['sessionId']})
 
-    return on_intent_start(session)
+    return on_intent_start(session, state)
 
 
-def on_intent(intent_request, session):
+def on_intent(intent_request, session, state):
     """ Called when the user specifies an intent for this skill """
 
-    print("on_intent requestId=" + intent_request['requestId'] +
-          ", sessionId=" + session['sessionId'])
+    log('DEBUG', "on_intent",
+        lambda: {'requestId': intent_request['requestId'], 'sessionId': session['sessionId']})
 
     intent = intent_request['intent']
-    intent_name = intent_request['intent']['name']
-
-    if (get_is_playing(session) == False):
-        return on_intent_start(session)
-    elif (intent_name == "AMAZON.StartOverIntent"):
-        SaveQuestPoint(session, 0)
-        return on_intent_startover()
-    elif (intent_name == "AMAZON.StopIntent") or (intent_name == "AMAZON.CancelIntent"):
-        return on_intent_stop()
-    elif (intent_name == "PlayIntent"):
-        return on_intent_start(session)
-    elif ("qp6_" in get_context(session)):
-        if (intent_name == "OptionIntent"):
-            return on_intent_option(session, intent)
-        elif (intent_name == "AMAZON.HelpIntent"):
-            return on_intent_help_on_terminal(session)
-        elif (intent_name == "AMAZON.RepeatIntent"):
-            return on_intent_repeat_on_terminal(session)
-        else:
-            return misunderstand_response(session['attributes'])
-    elif (intent_name == "AMAZON.HelpIntent"):
-        return on_intent_help(session)
-    elif (intent_name == "AMAZON.RepeatIntent"):
-        return on_intent_repeat(session)
-    elif (intent_name == "WalkIntent"):
-        return on_intent_walk(session, get_object_slot(intent))
-    elif (intent_name == "InteractIntent"):
-        return on_intent_interact_with(session, get_context(session))
-    elif (intent_name == "InteractWithIntent"):
-        return on_intent_interact_with(session, get_object_slot(intent))
-    elif (intent_name == "ReadIntent"):
-        return on_intent_read(session)
-    elif (intent_name == "OptionIntent"):
-        return misunderstand_response(session['attributes'])
-    else:
-        return error_response()
+    context_class = get_context_class(state)
+    transition = get_transition(intent['name'], get_quest_point(session, state), context_class)
+    return transition(session, state, intent)
 
 
 def on_session_ended(session_ended_request, session):
@@ -2464,34 +2959,56 @@ def on_session_ended(session_ended_request, session):
 
     Is not called when the skill returns should_end_session=true
     """
-    print("on_session_ended requestId=" + session_ended_request['requestId'] +
-          ", sessionId=" + session['sessionId'])
+    log('DEBUG', "on_session_ended",
+        lambda: {'requestId': session_ended_request['requestId'], 'sessionId': session['sessionId']})
 
 
 # --------------- Main handler ------------------
 
+APPLICATION_ID = "amzn1.ask.skill.a378ad35-70d7-4bda-a6ae-adc144158b0f"
+
 def lambda_handler(event, context):
     """ Route the incoming request based on type (LaunchRequest, IntentRequest,
     etc.) The JSON body of the request is provided in the event parameter.
     """
-    print("event.session.application.applicationId=" +
-          event['session']['application']['applicationId'])
-
-    if (event['session']['application']['applicationId'] !=
-             "amzn1.ask.skill.a378ad35-70d7-4bda-a6ae-adc144158b0f"):
+    if (event['session']['application']['applicationId'] != APPLICATION_ID):
          raise ValueError("Invalid Application ID")
 
-    global locale
+    global locale, database_clients_built, loaded_quest_point, pending_quest_point, quest_point_unknown
     locale = event['request']['locale']
-    print("locale is " + locale)
+    start_request_log(event)
+    request_storage.clear()
+    database_clients_built = 0
+    loaded_quest_point = None
+    # Parsed once here and passed down to the handlers
+    state = decode_session_state(event['session'].get('attributes'))
+    pending_quest_point = state.pending_quest_point
+    quest_point_unknown = state.quest_point_unknown
+    set_request_deadline(context)
 
     if event['session']['new']:
         on_session_started({'requestId': event['request']['requestId']},
                            event['session'])
 
-    if event['request']['type'] == "LaunchRequest":
-        return on_launch(event['request'], event['session'])
-    elif event['request']['type'] == "IntentRequest":
-        return on_intent(event['request'], event['session'])
-    elif event['request']['type'] == "SessionEndedRequest":
-        return on_session_ended(event['request'], event['session'])
\ No newline at end of file
+    response = None
+    start = time.perf_counter()
+    try:
+        if event['request']['type'] == "LaunchRequest":
+            response = on_launch(event['request'], event['session'], state)
+        elif event['request']['type'] == "IntentRequest":
+            response = on_intent(event['request'], event['session'], state)
+        elif event['request']['type'] == "SessionEndedRequest":
+            response = on_session_ended(event['request'], event['session'])
+
+        carry_pending_quest_point(event['session'], response)
+    except Exception as e:
+        finish_request_log(None, state, e)
+        raise
+    handler_seconds = time.perf_counter() - start
+
+    request = event['request']
+    record_request_metrics(request['intent']['name'] if 'intent' in request else request['type'],
+                           request_quest_point(state), handler_seconds, response)
+    finish_request_log(response, state)
+    flush_metrics()
+    return response
@@ -0,0 +1,97 @@
+"""
+Alexa request events for driving lambda_handler offline, and the solution from the testing instructions
+
+Actions are (request type, intent name, slot name, slot value) tuples, so they can be used as dict keys.
+"""
+
+from __future__ import print_function
+import os
+import re
+
+import PuzzlePrison
+
+INSTRUCTIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Publishing", "Testing Instructions.txt")
+SLOTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+LAUNCH = ("LaunchRequest", None, None, None)
+SESSION_ENDED = ("SessionEndedRequest", None, None, None)
+
+# Spoken solution steps and the action each one becomes
+UTTERANCES = (
+    (re.compile(r"^alexa play puzzle prison$"), "LaunchRequest", None, None),
+    (re.compile(r"^interact with (.+)$"), "IntentRequest", "InteractWithIntent", "object"),
+    (re.compile(r"^walk to (.+)$"), "IntentRequest", "WalkIntent", "object"),
+    (re.compile(r"^read letter$"), "IntentRequest", "ReadIntent", None),
+    (re.compile(r"^select option (.+)$"), "IntentRequest", "OptionIntent", "option"),
+    (re.compile(r"^stop$"), "IntentRequest", "AMAZON.StopIntent", None),
+)
+OPTION_WORDS = {"one": "1", "two": "2"}
+
+def intent_action(intent_name, slot_name=None, slot_value=None):
+    return ("IntentRequest", intent_name, slot_name, slot_value)
+
+def build_event(action, user_id, locale, attributes=None, new=False, request_id="offline"):
+    """ The request Alexa sends for action, attributes being the previous response's sessionAttributes """
+    request_type, intent_name, slot_name, slot_value = action
+    request = {
+        'type': request_type,
+        'requestId': request_id,
+        'locale': locale,
+    }
+    if request_type == "IntentRequest":
+        slots = {}
+        if slot_name is not None:
+            slots[slot_name] = {'name': slot_name, 'value': slot_value}
+        request['intent'] = {'name': intent_name, 'slots': slots}
+    elif request_type == "SessionEndedRequest":
+        request['reason'] = "USER_INITIATED"
+
+    session = {
+        'new': new,
+        'sessionId': "offline." + user_id,
+        'application': {'applicationId': PuzzlePrison.APPLICATION_ID},
+        'user': {'userId': user_id},
+    }
+    if attributes:
+        session['attributes'] = attributes
+    return {'session': session, 'request': request}
+
+def slot_values(file_name):
+    with open(os.path.join(SLOTS_DIRECTORY, file_name)) as slots:
+        return [line.strip().lower() for line in slots if line.strip()]
+
+def all_actions():
+    """ Every intent with every value of its slot, and without the slot """
+    actions = []
+    for intent_name in PuzzlePrison.INTENT_NAMES:
+        actions.append(intent_action(intent_name))
+    for intent_name in ("WalkIntent", "InteractWithIntent"):
+        for value in slot_values("Custom_Slots_Object.txt"):
+            actions.append(intent_action(intent_name, "object", value))
+    for value in slot_values("Custom_Slots_Option.txt"):
+        actions.append(intent_action("OptionIntent", "option", value))
+    return actions
+
+def parse_utterance(utterance):
+    text = " ".join(utterance.lower().split())
+    for pattern, request_type, intent_name, slot_name in UTTERANCES:
+        match = pattern.match(text)
+        if match is None:
+            continue
+        if slot_name is None:
+            return (request_type, intent_name, None, None)
+        value = match.group(1)
+        if slot_name == "option":
+            value = OPTION_WORDS.get(value, value)
+        return (request_type, intent_name, slot_name, value)
+    raise ValueError("No action for the utterance " + repr(utterance))
+
+def testing_instructions(path=INSTRUCTIONS_PATH):
+    """ The numbered solution steps as (step, utterance, action), step 0 being the launch """
+    steps = []
+    with open(path) as instructions:
+        for line in instructions:
+            match = re.match(r'^\s*(\d+)\s*-\s*[^"]*"([^"]+)"', line)
+            if match:
+                steps.append((int(match.group(1)), match.group(2), parse_utterance(match.group(2))))
+    return steps
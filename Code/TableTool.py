@@ -0,0 +1,376 @@
+"""
+Offline export, audit and repair tool for the Puzzle Prison quest point table
+
+Runs a segmented parallel scan over the storage backend selected with --store, the same
+backends the skill uses (dynamodb, memory or sqlite).
+
+Examples:
+    python TableTool.py audit --segments 8
+    python TableTool.py export --output PuzzlePrison.jsonl.gz
+    python TableTool.py repair --rate 25 --dry-run
+    python TableTool.py audit --store memory --seed 10000
+    python TableTool.py migrate --target-region eu-west-1
+
+migrate copies every user into the target table unless the user is already there, so it
+never overwrites progress made since regional tables were turned on. repair likewise only
+writes users whose quest point is still the one scanned, so it never reverts progress saved
+while the scan runs.
+"""
+
+from __future__ import print_function
+import argparse
+import contextlib
+import datetime
+import decimal
+import gzip
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import PuzzlePrison
+
+# Items handed from scan workers to the writer at a time
+PAGE_SIZE = 100
+# Items per BatchWriteItem request
+BATCH_SIZE = 25
+# Seconds a scan worker waits for room in the queue before checking whether the scan was stopped
+PUT_TIMEOUT = 0.1
+
+# --------------- Stores
+
+def open_store(args):
+    if args.store == "sqlite":
+        return PuzzlePrison.SQLiteQuestPointStore(args.sqlite_path)
+    elif args.store == "dynamodb":
+        return PuzzlePrison.DynamoDBQuestPointStore(args.region)
+    else:
+        return PuzzlePrison.create_quest_point_store(args.store)
+
+def open_target_store(args):
+    if args.store == "sqlite":
+        return PuzzlePrison.SQLiteQuestPointStore(args.target_sqlite_path)
+    else:
+        return PuzzlePrison.DynamoDBQuestPointStore(args.target_region)
+
+def seed_store(store, count):
+    """ Fills a stand-in table with random users, including some that need repairing """
+    rng = random.Random(count)
+    today = datetime.date.today()
+    items = []
+    for index in range(count):
+        roll = rng.random()
+        if roll < 0.02:
+            qp = rng.choice([-1, 11, 42])
+        else:
+            qp = rng.randint(0, 9)
+        if roll > 0.99:
+            last_update = "unknown"
+        else:
+            last_update = (today - datetime.timedelta(days=rng.randint(0, 900))).strftime("%Y-%m-%d")
+        items.append({'userID': "amzn1.ask.account.seed" + str(index), 'questPoint': qp, 'lastUpdate': last_update})
+        if len(items) == 1000:
+            store.write_items(items)
+            items = []
+    if items:
+        store.write_items(items)
+
+# --------------- Items
+
+def normalise(item):
+    qp = item.get('questPoint')
+    if isinstance(qp, decimal.Decimal):
+        qp = int(qp)
+    return {'userID': item['userID'], 'questPoint': qp, 'lastUpdate': item.get('lastUpdate')}
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+def repaired(item):
+    """ Returns the fixed item, or None if the item is fine """
+    fixed = dict(item)
+    if fixed['questPoint'] is None or not PuzzlePrison.valid_quest_point(fixed['questPoint']):
+        fixed['questPoint'] = 0
+        fixed['lastUpdate'] = PuzzlePrison.today()
+    elif parse_date(fixed['lastUpdate']) is None:
+        fixed['lastUpdate'] = PuzzlePrison.today()
+    if fixed == item:
+        return None
+    return fixed
+
+# --------------- Writers
+
+class JsonLinesWriter(object):
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wt') if path.endswith(".gz") else open(path, 'w')
+
+    def write(self, item):
+        self.file.write(json.dumps(item, sort_keys=True))
+        self.file.write("\n")
+
+    def close(self):
+        self.file.close()
+
+class ParquetWriter(object):
+    """ Columnar output, needs pyarrow """
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow, install it or export to .jsonl.gz instead")
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([
+            ('userID', pyarrow.string()),
+            ('questPoint', pyarrow.int64()),
+            ('lastUpdate', pyarrow.string()),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+        self.rows = []
+
+    def write(self, item):
+        self.rows.append(item)
+        if len(self.rows) >= 10000:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(self.pyarrow.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+def open_writer(path):
+    if path.endswith(".parquet"):
+        return ParquetWriter(path)
+    else:
+        return JsonLinesWriter(path)
+
+# --------------- Rate limiting
+
+class RateLimiter(object):
+    """ Token bucket allowing rate items per second """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.last = time.time()
+
+    def acquire(self, count):
+        while True:
+            now = time.time()
+            self.tokens = min(max(self.rate, count), self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= count:
+                self.tokens -= count
+                return
+            time.sleep((count - self.tokens) / self.rate)
+
+# --------------- Scan
+
+def put_page(pages, page, stop):
+    """ Waits for room in the queue, returns False if the scan is stopped first """
+    while not stop.is_set():
+        try:
+            pages.put(page, timeout=PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def scan_worker(store, segment, total_segments, pages, stop):
+    try:
+        page = []
+        for item in store.scan_segment(segment, total_segments):
+            if stop.is_set():
+                return
+            page.append(normalise(item))
+            if len(page) == PAGE_SIZE:
+                if not put_page(pages, page, stop):
+                    return
+                page = []
+        if page and not put_page(pages, page, stop):
+            return
+        put_page(pages, None, stop)
+    except Exception as e:
+        put_page(pages, e, stop)
+
+def drain(pages):
+    while True:
+        try:
+            pages.get_nowait()
+        except queue.Empty:
+            return
+
+def parallel_scan(store, segments, workers):
+    """ Yields every item in the table while the segments are scanned in parallel.
+
+    Close the generator when done with it, a caller that stops early otherwise leaves the
+    workers waiting on the queue.
+    """
+    pages = queue.Queue(maxsize=workers * 4)
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for segment in range(segments):
+                executor.submit(scan_worker, store, segment, segments, pages, stop)
+            finished = 0
+            while finished < segments:
+                page = pages.get()
+                if page is None:
+                    finished += 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    for item in page:
+                        yield item
+        finally:
+            # A failed segment or caller must not leave workers blocked on a full queue,
+            # the executor waits for them before the error gets out
+            stop.set()
+            drain(pages)
+
+# --------------- Commands
+
+def run(args):
+    store = open_store(args)
+    if args.seed:
+        seed_store(store, args.seed)
+
+    writer = open_writer(args.output) if args.command == "export" else None
+    target = open_target_store(args) if args.command == "migrate" else None
+    limiter = RateLimiter(args.rate)
+    stale_before = datetime.date.today() - datetime.timedelta(days=args.stale_days)
+
+    distribution = {}
+    out_of_range = 0
+    stale = 0
+    bad_dates = 0
+    fixes = []
+    fixed = 0
+    copies = []
+    copied = 0
+    count = 0
+    start = time.time()
+
+    with contextlib.closing(parallel_scan(store, args.segments, args.workers)) as items:
+        for item in items:
+            count += 1
+            qp = item['questPoint']
+            distribution[qp] = distribution.get(qp, 0) + 1
+            if qp is None or not PuzzlePrison.valid_quest_point(qp):
+                out_of_range += 1
+            last_update = parse_date(item['lastUpdate'])
+            if last_update is None:
+                bad_dates += 1
+            elif last_update < stale_before:
+                stale += 1
+
+            if writer is not None:
+                writer.write(item)
+
+            if args.command == "repair":
+                fix = repaired(item)
+                if fix is not None:
+                    fixes.append((qp, fix))
+                if len(fixes) == BATCH_SIZE:
+                    fixed += apply_fixes(store, fixes, limiter, args.dry_run)
+                    fixes = []
+
+            if args.command == "migrate":
+                copies.append(repaired(item) or item)
+                if len(copies) == BATCH_SIZE:
+                    copied += apply_copies(target, copies, limiter, args.dry_run)
+                    copies = []
+
+    if fixes:
+        fixed += apply_fixes(store, fixes, limiter, args.dry_run)
+    if copies:
+        copied += apply_copies(target, copies, limiter, args.dry_run)
+    if writer is not None:
+        writer.close()
+
+    elapsed = time.time() - start
+    report = {
+        "command": args.command,
+        "store": store.name,
+        "items": count,
+        "seconds": round(elapsed, 3),
+        "itemsPerSecond": round(count / elapsed, 1) if elapsed > 0 else None,
+        "questPoints": dict((str(qp), total) for qp, total in sorted(distribution.items(), key=lambda entry: str(entry[0]))),
+        "outOfRange": out_of_range,
+        "badLastUpdate": bad_dates,
+        "staleLastUpdate": stale,
+        "staleDays": args.stale_days,
+    }
+    if args.command == "repair":
+        report["fixed"] = fixed
+        report["dryRun"] = args.dry_run
+    if args.command == "migrate":
+        report["target"] = target.name
+        report["copied"] = copied
+        report["dryRun"] = args.dry_run
+    if writer is not None:
+        report["output"] = args.output
+    return report
+
+def apply_fixes(store, fixes, limiter, dry_run):
+    if dry_run:
+        return len(fixes)
+    limiter.acquire(len(fixes))
+    return store.repair_items(fixes)
+
+def apply_copies(target, copies, limiter, dry_run):
+    limiter.acquire(len(copies))
+    if dry_run:
+        # Counts the users the copy would write, reading the target but leaving it alone
+        return len(target.missing_items(copies))
+    return target.insert_items(copies)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Export, audit and repair the Puzzle Prison quest point table")
+    parser.add_argument("command", choices=["export", "audit", "repair", "migrate"])
+    parser.add_argument("--store", default=PuzzlePrison.DATABASE_BACKEND, choices=["dynamodb", "memory", "sqlite"])
+    parser.add_argument("--region", default=None, help="DynamoDB region to scan, defaults to the configured region")
+    parser.add_argument("--sqlite-path", default=PuzzlePrison.SQLITE_PATH)
+    parser.add_argument("--target-region", default=None, help="DynamoDB region migrate copies users into")
+    parser.add_argument("--target-sqlite-path", default=None, help="SQLite file migrate copies users into")
+    parser.add_argument("--segments", type=int, default=8, help="total segments of the parallel scan")
+    parser.add_argument("--workers", type=int, default=8, help="scan threads")
+    parser.add_argument("--output", default="PuzzlePrison.jsonl.gz", help=".jsonl, .jsonl.gz or .parquet")
+    parser.add_argument("--rate", type=float, default=25.0, help="repair or migrate writes per second")
+    parser.add_argument("--stale-days", type=int, default=365)
+    parser.add_argument("--dry-run", action="store_true", help="report repairs or copies without writing them")
+    parser.add_argument("--seed", type=int, default=0, help="add this many random users first, for stand-in tables")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        # Without a target the copy would go to the source table, fail part way through, or
+        # with the memory store go to a table thrown away when the run ends
+        if args.store == "memory":
+            parser.error("migrate needs a table that outlives the run, use --store dynamodb or sqlite")
+        if args.store == "dynamodb" and (args.target_region is None or args.target_region == args.region):
+            parser.error("migrate needs a --target-region other than the region scanned")
+        if args.store == "sqlite" and (args.target_sqlite_path is None or args.target_sqlite_path == args.sqlite_path):
+            parser.error("migrate needs a --target-sqlite-path other than the file scanned")
+    return args
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    print(json.dumps(run(args), indent=2, sort_keys=True))
+
+if __name__ == "__main__":
+    main()
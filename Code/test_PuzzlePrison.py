@@ -0,0 +1,388 @@
+"""
+Checks of quest point storage, the circuit breaker around it, the response cache, the packed
+session state, the text catalogs and the object slot
+
+    python -m pytest Code/test_PuzzlePrison.py
+    python -m unittest test_PuzzlePrison
+"""
+
+from __future__ import print_function
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+# Never touch a real table
+os.environ["PUZZLE_PRISON_STORE"] = "memory"
+
+import PuzzlePrison
+import SkillRequests
+
+LOCALE = "en-US"
+
+class FaultyStore(PuzzlePrison.MemoryQuestPointStore):
+    """ Memory store whose next loads or saves fail, counting the saves attempted """
+
+    errors = (IOError,)
+
+    def __init__(self):
+        PuzzlePrison.MemoryQuestPointStore.__init__(self)
+        self.failing_loads = 0
+        self.failing_saves = 0
+        self.throttled_saves = 0
+        self.saves = 0
+
+    def is_throttle(self, error):
+        return "throttled" in str(error)
+
+    def load_item(self, user_id):
+        if self.failing_loads:
+            self.failing_loads -= 1
+            raise IOError("load failed")
+        return PuzzlePrison.MemoryQuestPointStore.load_item(self, user_id)
+
+    def save_item(self, user_id, qp, touch):
+        self.saves += 1
+        if self.throttled_saves:
+            self.throttled_saves -= 1
+            raise IOError("throttled")
+        if self.failing_saves:
+            self.failing_saves -= 1
+            raise IOError("save failed")
+        return PuzzlePrison.MemoryQuestPointStore.save_item(self, user_id, qp, touch)
+
+class ShortContext(object):
+    """ A Lambda context with too little time left for a storage call """
+
+    def get_remaining_time_in_millis(self):
+        return int((PuzzlePrison.RESPONSE_RESERVE + PuzzlePrison.STORAGE_CALL_BUDGET / 2) * 1000)
+
+def stop_steps():
+    """ The golden path up to and including its first stop """
+    steps = SkillRequests.testing_instructions()
+    stop = [action for step, utterance, action in steps].index(SkillRequests.intent_action("AMAZON.StopIntent"))
+    return steps[:stop + 1]
+
+class StorageTestCase(unittest.TestCase):
+    """ Runs each test against a fresh faulty memory store, with logs and metrics kept off stdout """
+
+    def setUp(self):
+        self.region = PuzzlePrison.get_storage_region()
+        self.saved_store = PuzzlePrison.database_stores.get(self.region)
+        self.store = PuzzlePrison.database_stores[self.region] = FaultyStore()
+        self.saved_write_behind = PuzzlePrison.WRITE_BEHIND
+        PuzzlePrison.quest_point_cache.entries.clear()
+        # Left over from the last request handled
+        PuzzlePrison.quest_point_unknown = False
+        PuzzlePrison.pending_quest_point = None
+        PuzzlePrison.set_request_deadline(None)
+        PuzzlePrison.log_sink = io.StringIO()
+        PuzzlePrison.metrics_sink = io.StringIO()
+
+    def tearDown(self):
+        PuzzlePrison.WRITE_BEHIND = self.saved_write_behind
+        PuzzlePrison.log_sink = None
+        PuzzlePrison.metrics_sink = None
+        if self.saved_store is None:
+            del PuzzlePrison.database_stores[self.region]
+        else:
+            PuzzlePrison.database_stores[self.region] = self.saved_store
+
+    def play(self, steps, user_id, on_turn=None):
+        """ Plays steps as one player, on_turn(turn) may change the store and returns the context to use """
+        attributes = None
+        new = True
+        response = None
+        for turn, (step, utterance, action) in enumerate(steps):
+            context = on_turn(turn) if on_turn is not None else None
+            event = SkillRequests.build_event(action, user_id, LOCALE, attributes, new)
+            response = PuzzlePrison.lambda_handler(event, context)
+            if response is None or response['response']['shouldEndSession']:
+                attributes = None
+                new = True
+            else:
+                attributes = response['sessionAttributes']
+                new = False
+        return response
+
+    def stored(self, user_id):
+        return self.store.items[user_id]['questPoint']
+
+    def store_user(self, user_id, qp):
+        self.store.items[user_id] = {'questPoint': qp, 'lastUpdate': PuzzlePrison.today()}
+
+# --------------- Saves
+
+class ProgressTest(StorageTestCase):
+
+    def expected_progress(self):
+        self.play(stop_steps(), "amzn1.ask.account.test.expected")
+        return self.stored("amzn1.ask.account.test.expected")
+
+    def test_failed_save_is_written_when_the_session_stops(self):
+        expected = self.expected_progress()
+
+        def fail_first_save(turn):
+            if turn == 1:
+                self.store.failing_saves = 1
+
+        self.play(stop_steps(), "amzn1.ask.account.test.failed-save", fail_first_save)
+        self.assertEqual(self.stored("amzn1.ask.account.test.failed-save"), expected)
+
+    def test_failed_load_never_overwrites_stored_progress(self):
+        user_id = "amzn1.ask.account.test.failed-load"
+        self.store_user(user_id, 7)
+        self.store.failing_loads = 1
+        self.play([
+            (0, "", SkillRequests.LAUNCH),
+            (1, "", SkillRequests.intent_action("InteractWithIntent", "object", "terminal")),
+            (2, "", SkillRequests.intent_action("AMAZON.StopIntent")),
+        ], user_id)
+        self.assertEqual(self.stored(user_id), 7)
+
+    def test_deferred_save_is_written_when_the_session_stops(self):
+        expected = self.expected_progress()
+
+        def defer_first_save(turn):
+            return ShortContext() if turn == 1 else None
+
+        self.play(stop_steps(), "amzn1.ask.account.test.deferred-save", defer_first_save)
+        self.assertEqual(self.stored("amzn1.ask.account.test.deferred-save"), expected)
+
+    def test_load_is_not_skipped_near_the_deadline(self):
+        user_id = "amzn1.ask.account.test.late-load"
+        self.store_user(user_id, 7)
+        response = self.play([(0, "", SkillRequests.LAUNCH)], user_id, lambda turn: ShortContext())
+        state = PuzzlePrison.decode_session_state(response['sessionAttributes'])
+        self.assertEqual(state.quest_point, 7)
+        self.assertFalse(state.quest_point_unknown)
+
+    def test_write_behind_flushes_once_per_stop(self):
+        PuzzlePrison.WRITE_BEHIND = True
+        user_id = "amzn1.ask.account.test.write-behind"
+        steps = stop_steps()
+        lost = PuzzlePrison.storage_metrics["lostWrites"]
+
+        def fail_at_stop(turn):
+            if turn == len(steps) - 1:
+                self.store.failing_saves = 2
+                self.store.saves = 0
+
+        self.play(steps, user_id, fail_at_stop)
+        self.assertEqual(self.store.saves, 1)
+        self.assertEqual(PuzzlePrison.storage_metrics["lostWrites"], lost + 1)
+        records = [json.loads(line) for line in PuzzlePrison.metrics_sink.getvalue().splitlines()]
+        self.assertEqual([record["LostWrites"] for record in records], [0] * (len(steps) - 1) + [1])
+
+    def test_staged_quest_point_is_cached(self):
+        PuzzlePrison.WRITE_BEHIND = True
+        user_id = "amzn1.ask.account.test.staged"
+        self.play(stop_steps()[:2], user_id)
+        self.assertEqual(PuzzlePrison.quest_point_cache.get(user_id), 1)
+        self.assertEqual(self.stored(user_id), 0)
+
+    def test_save_from_an_older_quest_point_is_refused(self):
+        # A relaunch on a container whose cache missed progress saved on another
+        user_id = "amzn1.ask.account.test.stale-cache"
+        self.store_user(user_id, 5)
+        PuzzlePrison.quest_point_cache.set(user_id, 3)
+        stale = PuzzlePrison.storage_metrics["staleSaves"]
+        PuzzlePrison.WriteQuestPoint({'user': {'userId': user_id}}, 4)
+        self.assertEqual(self.stored(user_id), 5)
+        self.assertIsNone(PuzzlePrison.quest_point_cache.get(user_id))
+        self.assertEqual(PuzzlePrison.storage_metrics["staleSaves"], stale + 1)
+
+    def test_start_over_is_written_straight_away(self):
+        PuzzlePrison.WRITE_BEHIND = True
+        user_id = "amzn1.ask.account.test.start-over"
+        self.store_user(user_id, 5)
+        self.play([
+            (0, "", SkillRequests.LAUNCH),
+            (1, "", SkillRequests.intent_action("AMAZON.StartOverIntent")),
+        ], user_id)
+        self.assertEqual(self.stored(user_id), 0)
+
+# --------------- Circuit breaker
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_repeated_failures(self):
+        breaker = PuzzlePrison.CircuitBreaker(3, 30.0)
+        for failure in range(2):
+            breaker.record_failure()
+            self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open())
+        self.assertFalse(breaker.allow())
+
+    def test_lets_one_trial_call_through_after_the_cooldown(self):
+        breaker = PuzzlePrison.CircuitBreaker(1, 30.0)
+        breaker.record_failure()
+        breaker.opened_at = time.time() - 31.0
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertFalse(breaker.is_open())
+        self.assertTrue(breaker.allow())
+
+class RetryTest(StorageTestCase):
+
+    def test_open_breaker_short_circuits_storage(self):
+        for failure in range(PuzzlePrison.BREAKER_FAILURE_THRESHOLD):
+            self.store.breaker.record_failure()
+        saves = self.store.saves
+        with self.assertRaises(PuzzlePrison.StorageUnavailable):
+            PuzzlePrison.call_storage("save", "amzn1.ask.account.test.breaker", 1, True)
+        self.assertEqual(self.store.saves, saves)
+
+    def test_throttled_call_is_retried(self):
+        user_id = "amzn1.ask.account.test.throttled"
+        self.store.throttled_saves = 1
+        PuzzlePrison.call_storage("save", user_id, 3, True)
+        self.assertEqual(self.store.saves, 2)
+        self.assertEqual(self.stored(user_id), 3)
+        self.assertFalse(self.store.breaker.is_open())
+
+    def test_failed_call_is_not_retried(self):
+        self.store.failing_saves = 1
+        with self.assertRaises(PuzzlePrison.StorageError):
+            PuzzlePrison.call_storage("save", "amzn1.ask.account.test.failed", 3, True)
+        self.assertEqual(self.store.saves, 1)
+
+# --------------- Metrics
+
+class MetricsTest(StorageTestCase):
+
+    def test_records_carry_the_storage_region(self):
+        self.play([(0, "", SkillRequests.LAUNCH)], "amzn1.ask.account.test.region")
+        record = json.loads(PuzzlePrison.metrics_sink.getvalue())
+        self.assertEqual(record["Region"], "memory")
+        self.assertIn(["Region"], record["_aws"]["CloudWatchMetrics"][0]["Dimensions"])
+
+# --------------- Session state
+
+class SessionStateTest(unittest.TestCase):
+
+    def assertSameState(self, state, other):
+        for field in PuzzlePrison.SessionState.__slots__:
+            self.assertEqual(getattr(state, field), getattr(other, field), field)
+
+    def round_trip(self, state):
+        packed = PuzzlePrison.pack_session_state(state)
+        self.assertIsNotNone(packed)
+        self.assertSameState(PuzzlePrison.unpack_session_state(packed), state)
+
+    def test_pack_round_trips_every_position(self):
+        for qp in range(10):
+            for lap in range(len(PuzzlePrison.LAP_PROGRESS)):
+                for context in PuzzlePrison.CONTEXTS:
+                    self.round_trip(PuzzlePrison.SessionState(qp, lap, False, False, False, False, context, True, None))
+
+    def test_pack_round_trips_every_flag(self):
+        for flags in range(1 << 6):
+            ne, nw, se, sw, is_playing, unknown = [bool(flags & (1 << bit)) for bit in range(6)]
+            for pending in (None,) + tuple(range(11)):
+                self.round_trip(PuzzlePrison.SessionState(6, 0, ne, nw, se, sw, "qp6_ne", is_playing, pending, unknown))
+
+    def test_states_the_packing_cannot_hold_use_the_original_attributes(self):
+        state = PuzzlePrison.SessionState(16, 0, False, False, False, False, "", True, None, True)
+        self.assertIsNone(PuzzlePrison.pack_session_state(state))
+        attributes = PuzzlePrison.encode_session_state(state)
+        self.assertNotIn(PuzzlePrison.SESSION_STATE_KEY, attributes)
+        self.assertSameState(PuzzlePrison.decode_session_state(attributes), state)
+
+    def test_original_attributes_are_read(self):
+        state = PuzzlePrison.decode_session_state({"QuestPoint": 4, "Context": "letter", "IsPlaying": True,
+                                                   "DiagProgress": "AB"})
+        self.assertEqual(state.quest_point, 4)
+        self.assertEqual(PuzzlePrison.LAP_PROGRESS[state.lap], "AB")
+        self.assertFalse(state.quest_point_unknown)
+
+    def test_bad_packed_state_is_empty(self):
+        for packed in (-1, 1 << sum(PuzzlePrison.STATE_FIELD_BITS), "1", 1.0):
+            self.assertIs(PuzzlePrison.unpack_session_state(packed), PuzzlePrison.EMPTY_SESSION_STATE)
+
+# --------------- Response cache
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        PuzzlePrison.locale = LOCALE
+
+    def text(self):
+        return [PuzzlePrison.get_text("title_stop"), PuzzlePrison.get_text("stop"), "", PuzzlePrison.get_audio("jingle")]
+
+    def test_cached_bodies_cannot_be_changed(self):
+        body = PuzzlePrison.build_response({}, self.text(), True)['response']
+        for change in (lambda: body.__setitem__('shouldEndSession', False), lambda: body.pop('card'),
+                       lambda: body['card'].update(title=""), lambda: body['outputSpeech'].clear()):
+            self.assertRaises(TypeError, change)
+
+    def test_equal_responses_share_one_body(self):
+        first = PuzzlePrison.build_response({"State": 1}, self.text(), True)
+        second = PuzzlePrison.build_response({"State": 2}, self.text(), True)
+        self.assertIs(first['response'], second['response'])
+        self.assertIsNot(first['response'], PuzzlePrison.build_response({}, self.text(), False)['response'])
+        self.assertEqual(second['sessionAttributes'], {"State": 2})
+
+    def test_response_size_is_the_json_length(self):
+        for attributes in ({"State": 12345}, {"State": 0}, {}, {"QuestPoint": 3, "Context": "Übung"}):
+            response = PuzzlePrison.build_response(attributes, self.text(), True)
+            self.assertEqual(PuzzlePrison.response_size(response), len(json.dumps(response, separators=(',', ':'))))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = PuzzlePrison.ResponseCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+# --------------- Texts
+
+class TextCatalogTest(unittest.TestCase):
+
+    def test_locale_without_a_catalog_uses_the_default_texts(self):
+        self.assertEqual(PuzzlePrison.get_text_catalog("de-DE"), PuzzlePrison.get_text_catalog(PuzzlePrison.DEFAULT_LOCALE))
+
+    def test_module_without_its_texts_does_not_import(self):
+        directory = tempfile.mkdtemp()
+        try:
+            shutil.copy(PuzzlePrison.__file__, directory)
+            result = subprocess.run([sys.executable, "-c", "import PuzzlePrison"], cwd=directory,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        finally:
+            shutil.rmtree(directory)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("Text catalog", result.stderr)
+
+# --------------- Object slot
+
+class ObjectSlotTest(unittest.TestCase):
+
+    def test_every_slot_value_resolves(self):
+        for value in SkillRequests.slot_values("Custom_Slots_Object.txt"):
+            self.assertIn(PuzzlePrison.resolve_object(value), PuzzlePrison.OBJECT_SYNONYMS, value)
+
+    def test_synonyms_resolve_to_their_object(self):
+        self.assertEqual(PuzzlePrison.resolve_object("Computer"), "terminal")
+        self.assertEqual(PuzzlePrison.resolve_object("the cabinet"), "metal cabinet")
+        self.assertEqual(PuzzlePrison.resolve_object("The  North Wall"), "north wall")
+
+    def test_close_values_are_corrected(self):
+        self.assertEqual(PuzzlePrison.resolve_object("nrth wall"), "north wall")
+        self.assertEqual(PuzzlePrison.resolve_object("northwest statu"), "northwest statue")
+
+    def test_unknown_and_ambiguous_values_resolve_to_nothing(self):
+        for value in ("", "the", "door", "xyzzy", "wast"):
+            self.assertIsNone(PuzzlePrison.resolve_object(value), value)
+
+if __name__ == "__main__":
+    unittest.main()
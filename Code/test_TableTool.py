@@ -0,0 +1,72 @@
+"""
+Checks of the export, audit and repair tool
+
+    python -m pytest Code/test_TableTool.py
+    python -m unittest test_TableTool
+"""
+
+from __future__ import print_function
+import contextlib
+import os
+import shutil
+import tempfile
+import unittest
+
+# Never touch a real table
+os.environ["PUZZLE_PRISON_STORE"] = "memory"
+
+import PuzzlePrison
+import TableTool
+
+USER_ID = "amzn1.ask.account.test.table"
+
+class RepairTest(unittest.TestCase):
+
+    def test_repair_keeps_progress_saved_since_the_scan(self):
+        store = PuzzlePrison.MemoryQuestPointStore()
+        store.items[USER_ID] = {'questPoint': 4, 'lastUpdate': PuzzlePrison.today()}
+        fix = {'userID': USER_ID, 'questPoint': 3, 'lastUpdate': PuzzlePrison.today()}
+        self.assertEqual(store.repair_items([(3, fix)]), 0)
+        self.assertEqual(store.items[USER_ID]['questPoint'], 4)
+        self.assertEqual(store.repair_items([(4, dict(fix, questPoint=4))]), 1)
+
+    def test_repaired_fixes_bad_quest_points_and_dates(self):
+        self.assertEqual(TableTool.repaired({'userID': USER_ID, 'questPoint': 42, 'lastUpdate': "2020-01-01"}),
+                         {'userID': USER_ID, 'questPoint': 0, 'lastUpdate': PuzzlePrison.today()})
+        self.assertEqual(TableTool.repaired({'userID': USER_ID, 'questPoint': 3, 'lastUpdate': "unknown"}),
+                         {'userID': USER_ID, 'questPoint': 3, 'lastUpdate': PuzzlePrison.today()})
+        self.assertIsNone(TableTool.repaired({'userID': USER_ID, 'questPoint': 3, 'lastUpdate': "2020-01-01"}))
+
+class MigrateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, "source.sqlite")
+        self.target = os.path.join(self.directory, "target.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def migrate(self, *extra):
+        args = TableTool.parse_args(["migrate", "--store", "sqlite", "--sqlite-path", self.source,
+                                     "--target-sqlite-path", self.target, "--rate", "100000"] + list(extra))
+        return TableTool.run(args)
+
+    def test_migrate_needs_a_target(self):
+        with open(os.devnull, "w") as sink, contextlib.redirect_stderr(sink):
+            for argv in (["migrate", "--store", "sqlite"], ["migrate", "--store", "dynamodb"],
+                         ["migrate", "--store", "dynamodb", "--region", "eu-west-1", "--target-region", "eu-west-1"],
+                         ["migrate", "--store", "memory"]):
+                with self.assertRaises(SystemExit):
+                    TableTool.parse_args(argv)
+
+    def test_dry_run_counts_the_users_it_would_copy(self):
+        PuzzlePrison.SQLiteQuestPointStore(self.target).write_items(
+            [{'userID': "amzn1.ask.account.seed0", 'questPoint': 5, 'lastUpdate': PuzzlePrison.today()}])
+        report = self.migrate("--seed", "30", "--dry-run")
+        self.assertEqual(report["copied"], 29)
+        self.assertEqual(self.migrate()["copied"], 29)
+        self.assertEqual(self.migrate("--dry-run")["copied"], 0)
+
+if __name__ == "__main__":
+    unittest.main()